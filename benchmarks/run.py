@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of openshift2nulecule export phases on synthetic projects.
+
+OpenShift and Docker are replaced by stub executables (see bin/), so
+benchmarks measure only work done by openshift2nulecule (plus configured
+latency of stubs).
+
+Example:
+    python benchmarks/run.py --controllers 1000 --save results.json
+    python benchmarks/run.py --controllers 1000 --compare results.json
+"""
+
+import argparse
+import collections
+import copy
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BIN_DIR = os.path.join(BENCHMARKS_DIR, "bin")
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from openshift2nulecule.constants import NULECULE_PROVIDERS  # noqa: E402
+from openshift2nulecule.docker_backend import DockerCliBackend  # noqa: E402
+from openshift2nulecule.openshift import (OpenshiftClient,  # noqa: E402
+                                          ExportedProject)
+from openshift2nulecule.pipeline import ExportPipeline  # noqa: E402
+from openshift2nulecule.writer import NuleculeWriter  # noqa: E402
+
+import synthetic  # noqa: E402
+
+logger = logging.getLogger("benchmarks")
+
+timer = getattr(time, "perf_counter", time.time)
+
+# registry where images are "pushed" by export_images benchmark
+TARGET_REGISTRY = "registry.example.com:5000"
+
+
+def measure(setup, func, repeat):
+    """
+    Run func `repeat` times, every run gets fresh state from setup
+    (setup is not measured).
+
+    Returns:
+        dict: `min` and `median` of durations (seconds) and all `runs`
+    """
+    runs = []
+    for _ in range(repeat):
+        state = setup()
+        start = timer()
+        func(state)
+        runs.append(timer() - start)
+    ordered = sorted(runs)
+    return {"min": ordered[0],
+            "median": ordered[len(ordered) // 2],
+            "runs": runs}
+
+
+class Benchmarks(object):
+    """
+    Benchmarks of one synthetic project.
+    """
+
+    def __init__(self, export_file, jobs=4):
+        """
+        Args:
+            export_file (str): file with synthetic `oc export` output
+            jobs (int): concurrency used by image export and writer
+        """
+        self.jobs = jobs
+        self.oc = OpenshiftClient(oc=os.path.join(BIN_DIR, "oc"),
+                                  namespace="bench")
+        self.tmpdir = tempfile.mkdtemp(prefix="o2n-bench-")
+        os.environ["BENCH_EXPORT"] = export_file
+        os.environ["BENCH_EXPORT_DIR"] = self._split_export(export_file)
+        # artifacts as returned by OpenShift (before any processing)
+        self.artifacts = {provider: [] for provider in NULECULE_PROVIDERS}
+        for provider, artifact in self.oc.iter_artifacts():
+            self.artifacts[provider].append(artifact)
+
+    def _split_export(self, export_file):
+        """
+        Split synthetic export to `oc export` output of every resource type
+        (every resource type is exported by separate command).
+
+        Returns:
+            str: directory with `<resource>.json` files
+        """
+        with open(export_file) as f:
+            export = json.load(f)
+        lists = {}
+        for obj in export["items"]:
+            # eg. DeploymentConfig -> deploymentConfig
+            resource = obj["kind"][0].lower() + obj["kind"][1:]
+            lists.setdefault(resource, dict(export, items=[]))
+            lists[resource]["items"].append(obj)
+
+        directory = os.path.join(self.tmpdir, "export")
+        os.mkdir(directory)
+        for resource, resource_list in lists.items():
+            with open(os.path.join(directory, resource + ".json"), "w") as f:
+                json.dump(resource_list, f)
+        return directory
+
+    def close(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _project(self):
+        return ExportedProject(artifacts=copy.deepcopy(self.artifacts),
+                               docker=DockerCliBackend())
+
+    def export_project(self):
+        return None, lambda state: self.oc.export_project()
+
+    def exported_project_init(self):
+        return (lambda: copy.deepcopy(self.artifacts),
+                lambda artifacts: ExportedProject(artifacts=artifacts))
+
+    def update_artifacts_images(self):
+        def setup():
+            project = self._project()
+            for image_info in project.images.values():
+                image_info["image"] = ExportedProject._target_name(
+                    image_info["original_image"], TARGET_REGISTRY)
+            return project
+        return setup, lambda project: project.update_artifacts_images()
+
+    def export_images(self):
+        def run(project):
+            failed = project.export_images("172.30.1.1:5000", "developer",
+                                           "token", TARGET_REGISTRY,
+                                           only_internal=False,
+                                           jobs=self.jobs)
+            if failed:
+                raise Exception("Exporting images failed: {}".format(failed))
+        return self._project, run
+
+    def write(self):
+        def setup():
+            project = self._project()
+            return project, tempfile.mkdtemp(dir=self.tmpdir)
+
+        def run(state):
+            project, directory = state
+            writer = NuleculeWriter(os.path.join(directory, "app"), "bench",
+                                    jobs=self.jobs)
+            for provider in NULECULE_PROVIDERS:
+                for artifact in project.artifacts[provider]:
+                    writer.write_artifact(provider, artifact)
+            writer.close()
+        return setup, run
+
+    def pipeline(self):
+        def setup():
+            return tempfile.mkdtemp(dir=self.tmpdir)
+
+        def run(directory):
+            writer = NuleculeWriter(os.path.join(directory, "app"), "bench",
+                                    jobs=self.jobs)
+            shared = ExportedProject(docker=DockerCliBackend())
+            export_image = shared.image_exporter("172.30.1.1:5000",
+                                                 "developer", "token",
+                                                 TARGET_REGISTRY)
+            failed = ExportPipeline(
+                collections.OrderedDict([("bench", (self.oc, writer))]),
+                shared, export_image, TARGET_REGISTRY, only_internal=False,
+                jobs=self.jobs).run()
+            if failed:
+                raise Exception("Exporting images failed: {}".format(failed))
+        return setup, run
+
+    def run(self, names, repeat):
+        """
+        Run benchmarks
+
+        Args:
+            names (list): names of benchmarks
+            repeat (int): number of runs of every benchmark
+
+        Returns:
+            dict: results of every benchmark (see measure)
+        """
+        results = {}
+        for name in names:
+            setup, func = getattr(self, name)()
+            logger.info("Running {}".format(name))
+            results[name] = measure(setup or (lambda: None), func, repeat)
+        return results
+
+
+BENCHMARKS = ["export_project", "exported_project_init",
+              "update_artifacts_images", "export_images", "write",
+              "pipeline"]
+
+
+def compare(results, previous, threshold):
+    """
+    Print comparison of results with previous results.
+
+    Args:
+        results (dict): current results
+        previous (dict): previously saved results
+        threshold (float): relative slowdown of median reported as regression
+
+    Returns:
+        list: names of benchmarks that regressed
+    """
+    if previous["params"] != results["params"]:
+        logger.warning("Previous results were measured with different "
+                       "parameters: {}".format(previous["params"]))
+
+    regressions = []
+    print("{:<26} {:>12} {:>12} {:>9}".format("benchmark", "previous",
+                                              "current", "change"))
+    for name, result in sorted(results["results"].items()):
+        old = previous["results"].get(name)
+        if not old:
+            print("{:<26} {:>12} {:>12.4f}".format(name, "-",
+                                                   result["median"]))
+            continue
+        change = (result["median"] - old["median"]) / old["median"]
+        flag = ""
+        if change > threshold:
+            flag = " REGRESSION"
+            regressions.append(name)
+        print("{:<26} {:>12.4f} {:>12.4f} {:>+8.1f}%{}".format(
+            name, old["median"], result["median"], change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split(
+        "\n")[0])
+    synthetic.add_arguments(parser)
+    parser.add_argument("--jobs", type=int, default=4,
+                        help="concurrency of image export and writer "
+                             "(default 4)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="runs of every benchmark (default 5)")
+    parser.add_argument("--oc-latency", type=float, default=0.0,
+                        help="seconds every oc command takes (default 0)")
+    parser.add_argument("--docker-latency", type=float, default=0.0,
+                        help="seconds every docker command takes "
+                             "(default 0)")
+    parser.add_argument("--benchmark", action="append", choices=BENCHMARKS,
+                        help="run only this benchmark (can be used more "
+                             "times)")
+    parser.add_argument("--save", help="save results to this file")
+    parser.add_argument("--compare",
+                        help="compare results with results saved in this "
+                             "file")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown reported as regression "
+                             "(default 0.1)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING,
+                        format="%(levelname)s - %(message)s")
+    logger.setLevel(logging.INFO)
+
+    # stub docker has to be found before real one
+    os.environ["PATH"] = BIN_DIR + os.pathsep + os.environ.get("PATH", "")
+    os.environ["BENCH_OC_LATENCY"] = str(args.oc_latency)
+    os.environ["BENCH_DOCKER_LATENCY"] = str(args.docker_latency)
+
+    fd, export_file = tempfile.mkstemp(prefix="o2n-bench-", suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump(synthetic.project_from_args(args), f)
+
+    benchmarks = Benchmarks(export_file, args.jobs)
+    try:
+        params = {key: getattr(args, key)
+                  for key in ["services", "controllers", "containers",
+                              "images", "internal_ratio", "seed", "jobs",
+                              "oc_latency", "docker_latency"]}
+        params["export_bytes"] = os.path.getsize(export_file)
+        results = {"params": params,
+                   "python": platform.python_version(),
+                   "timestamp": time.time(),
+                   "results": benchmarks.run(args.benchmark or BENCHMARKS,
+                                             args.repeat)}
+    finally:
+        benchmarks.close()
+        os.remove(export_file)
+
+    for name in args.benchmark or BENCHMARKS:
+        result = results["results"][name]
+        print("{:<26} min {:.4f}s  median {:.4f}s".format(
+            name, result["min"], result["median"]))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        logger.info("Results saved to {}".format(args.save))
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        regressions = compare(results, previous, args.threshold)
+        if regressions:
+            logger.error("Regressions: {}".format(", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Generate synthetic `oc export -o json` output (document of kind List).
+
+Example:
+    python benchmarks/synthetic.py --services 500 --controllers 500 \
+        --containers 3 --images 40 > export.json
+"""
+
+import argparse
+import json
+import random
+import sys
+
+# host of internal OpenShift registry used in generated images
+INTERNAL_REGISTRY = "172.30.1.1:5000"
+
+
+def generate_images(count, internal_ratio=0.5):
+    """
+    Generate list of distinct image names
+
+    Args:
+        count (int): number of images
+        internal_ratio (float): ratio of images from internal registry
+
+    Returns:
+        list of image names
+    """
+    internal = int(round(count * internal_ratio))
+    images = []
+    for i in range(count):
+        if i < internal:
+            images.append("{}/bench/app-{}@sha256:{:064x}".format(
+                INTERNAL_REGISTRY, i, i + 1))
+        else:
+            images.append("docker.io/bench/base-{}:1.{}".format(i, i % 10))
+    return images
+
+
+def pod_template(name, containers, images, rnd):
+    """
+    Generate pod template with `containers` containers, images are
+    randomly chosen from `images` (so they are duplicated across objects).
+    """
+    return {
+        "metadata": {"creationTimestamp": None,
+                     "labels": {"app": name}},
+        "spec": {
+            "containers": [{"name": "{}-{}".format(name, i),
+                            "image": rnd.choice(images),
+                            "ports": [{"containerPort": 8080 + i,
+                                       "protocol": "TCP"}],
+                            "env": [{"name": "VAR_{}".format(j),
+                                     "value": "value-{}".format(j)}
+                                    for j in range(5)],
+                            "resources": {},
+                            "terminationMessagePath": "/dev/termination-log",
+                            "imagePullPolicy": "IfNotPresent"}
+                           for i in range(containers)],
+            "restartPolicy": "Always",
+            "dnsPolicy": "ClusterFirst"}}
+
+
+def generate_project(services=100, controllers=100, containers=2, images=20,
+                     internal_ratio=0.5, seed=0):
+    """
+    Generate exported project.
+
+    For every controller one DeploymentConfig and two
+    ReplicationControllers are generated, one of them created by the
+    DeploymentConfig (it is removed from OpenShift artifacts on export).
+
+    Args:
+        services (int): number of Services
+        controllers (int): number of DeploymentConfigs
+        containers (int): number of containers in every pod template
+        images (int): number of distinct images used by containers
+        internal_ratio (float): ratio of images from internal registry
+        seed (int): seed for random image assignment
+
+    Returns:
+        dict: document of kind List
+    """
+    rnd = random.Random(seed)
+    image_names = generate_images(images, internal_ratio)
+    items = []
+
+    for i in range(services):
+        name = "svc-{}".format(i)
+        items.append({
+            "kind": "Service",
+            "apiVersion": "v1",
+            "metadata": {"name": name, "creationTimestamp": None,
+                         "labels": {"app": name}},
+            "spec": {"ports": [{"name": "http", "protocol": "TCP",
+                                "port": 80, "targetPort": 8080}],
+                     "selector": {"app": name},
+                     "type": "ClusterIP",
+                     "sessionAffinity": "None"},
+            "status": {"loadBalancer": {}}})
+
+    for i in range(controllers):
+        name = "app-{}".format(i)
+        items.append({
+            "kind": "DeploymentConfig",
+            "apiVersion": "v1",
+            "metadata": {"name": name, "creationTimestamp": None,
+                         "labels": {"app": name}},
+            "spec": {"replicas": 1,
+                     "selector": {"app": name},
+                     "strategy": {"type": "Rolling"},
+                     "template": pod_template(name, containers,
+                                              image_names, rnd)},
+            "status": {}})
+        items.append({
+            "kind": "ReplicationController",
+            "apiVersion": "v1",
+            "metadata": {"name": "{}-1".format(name),
+                         "creationTimestamp": None,
+                         "annotations": {
+                             "openshift.io/deployment-config.name": name}},
+            "spec": {"replicas": 1,
+                     "selector": {"app": name},
+                     "template": pod_template(name, containers,
+                                              image_names, rnd)},
+            "status": {"replicas": 0}})
+        items.append({
+            "kind": "ReplicationController",
+            "apiVersion": "v1",
+            "metadata": {"name": "rc-{}".format(i),
+                         "creationTimestamp": None},
+            "spec": {"replicas": 1,
+                     "selector": {"app": "rc-{}".format(i)},
+                     "template": pod_template("rc-{}".format(i), containers,
+                                              image_names, rnd)},
+            "status": {"replicas": 0}})
+
+    return {"kind": "List", "apiVersion": "v1", "metadata": {},
+            "items": items}
+
+
+def add_arguments(parser):
+    """
+    Add arguments describing size of synthetic project to parser
+    """
+    parser.add_argument("--services", type=int, default=100,
+                        help="number of Services (default 100)")
+    parser.add_argument("--controllers", type=int, default=100,
+                        help="number of DeploymentConfigs, every one comes "
+                             "with two ReplicationControllers (default 100)")
+    parser.add_argument("--containers", type=int, default=2,
+                        help="containers in every pod template (default 2)")
+    parser.add_argument("--images", type=int, default=20,
+                        help="number of distinct images (default 20)")
+    parser.add_argument("--internal-ratio", type=float, default=0.5,
+                        help="ratio of images from internal registry "
+                             "(default 0.5)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed (default 0)")
+
+
+def project_from_args(args):
+    """
+    Generate project described by parsed arguments (see add_arguments)
+    """
+    return generate_project(args.services, args.controllers,
+                            args.containers, args.images,
+                            args.internal_ratio, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split(
+        "\n")[0])
+    add_arguments(parser)
+    args = parser.parse_args()
+    json.dump(project_from_args(args), sys.stdout, indent=4)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
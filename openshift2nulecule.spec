@@ -11,7 +11,7 @@ Source0:       https://github.com/projectatomic/%{name}/archive/v%{version}.tar.
 BuildRequires: python2-devel
 BuildRequires: python-setuptools
 Requires:      python-requests
-Requires:      python-anymarkup
+Requires:      PyYAML
 Requires:      python-ipaddress
 Requires:      docker
 
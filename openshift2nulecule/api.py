@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+from openshift2nulecule import serializer, utils
+from openshift2nulecule.constants import RESOURCE_API_PATHS, WATCH_TIMEOUT
+from openshift2nulecule.openshift import OpenshiftClient
+from openshift2nulecule.profiling import span
+
+logger = logging.getLogger(__name__)
+
+# Accept header of requests that need only metadata of listed objects,
+# servers that don't support partial object metadata return full objects
+METADATA_ACCEPT = "application/json;as=PartialObjectMetadataList;" \
+                  "v=v1;g=meta.k8s.io, application/json"
+
+# number of times listing is started again when its continue token expires
+LIST_RESTARTS = 3
+
+
+class OpenshiftApiClient(OpenshiftClient):
+    """
+    OpenShift client that talks directly to OpenShift REST API instead of
+    running `oc` binary.
+    Connection details and credentials are read from kubeconfig file (same
+    file as `oc` is using). All requests are using one pooled HTTP session.
+    """
+
+    # url of OpenShift master
+    server = None
+
+    # token used for authentication (None if other method is used)
+    token = None
+
+    # requests.Session used for all api calls
+    session = None
+
+    # watch requests always start at version of list
+    can_watch = True
+
+    def __init__(self, namespace=None, oc_config=None, selector=None,
+                 chunk_size=500, cache=None, timeout=None, retries=0):
+        """
+        Args:
+            namespace (str): namespace (project) to work with, if None
+                             namespace from current kubeconfig context is used
+            oc_config (str): path to kubeconfig file, if None $KUBECONFIG or
+                             ~/.kube/config is used
+            selector (str): label selector for exported objects
+            chunk_size (int): maximal number of objects returned by one
+                              list request
+            cache (ExportCache): cache for exported objects
+            timeout (float): timeout for listing one resource type (seconds)
+            retries (int): number of retries of failed listing
+        """
+        if oc_config:
+            self.oc_config = utils.get_path(oc_config)
+        else:
+            kubeconfig = os.environ.get("KUBECONFIG", "~/.kube/config")
+            self.oc_config = utils.get_path(kubeconfig.split(os.pathsep)[0])
+
+        self.selector = selector
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.timeout = timeout
+        self.retries = retries
+
+        # requests is imported only when api client is used
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=10)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        context_namespace = self._load_config(self.oc_config)
+        self.namespace = namespace or context_namespace
+
+    def _load_config(self, path):
+        """
+        Read current context from kubeconfig and configure session.
+
+        Args:
+            path (str): path to kubeconfig
+
+        Returns:
+            str: namespace of current context (None if not set)
+        """
+        logger.debug("Reading kubeconfig {}".format(path))
+        config = serializer.load_yaml_file(path)
+
+        def find(section, name):
+            for item in config.get(section) or []:
+                if item["name"] == name:
+                    return item[section[:-1]]
+            msg = "{} {} not found in {}".format(section[:-1], name, path)
+            logger.critical(msg)
+            raise Exception(msg)
+
+        context = find("contexts", config["current-context"])
+        cluster = find("clusters", context["cluster"])
+        user = find("users", context["user"])
+
+        self.server = cluster["server"].rstrip("/")
+
+        if cluster.get("insecure-skip-tls-verify"):
+            self.session.verify = False
+        elif cluster.get("certificate-authority-data"):
+            self.session.verify = self._data_file(
+                cluster["certificate-authority-data"])
+        elif cluster.get("certificate-authority"):
+            self.session.verify = cluster["certificate-authority"]
+
+        if user.get("token"):
+            self.token = user["token"]
+            self.session.headers["Authorization"] = "Bearer {}".format(
+                self.token)
+        elif user.get("client-certificate-data"):
+            self.session.cert = (
+                self._data_file(user["client-certificate-data"]),
+                self._data_file(user["client-key-data"]))
+        elif user.get("client-certificate"):
+            self.session.cert = (user["client-certificate"],
+                                 user["client-key"])
+        elif user.get("username"):
+            self.session.auth = (user["username"], user.get("password"))
+
+        return context.get("namespace")
+
+    @staticmethod
+    def _data_file(data):
+        """
+        Write base64 encoded data from kubeconfig (certificate or key) to
+        temporary file. File is removed when program exits.
+
+        Args:
+            data (str): base64 encoded data
+
+        Returns:
+            str: path to file
+        """
+        fd, path = tempfile.mkstemp(prefix="openshift2nulecule-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(base64.b64decode(data))
+        atexit.register(os.remove, path)
+        return path
+
+    def _request(self, path, params=None, timeout=None, headers=None):
+        """
+        Send GET request to OpenShift API
+
+        Args:
+            path (str): api path (without server)
+            params (dict): query parameters
+            timeout (float): timeout of request (seconds), None for no timeout
+            headers (dict): additional request headers
+
+        Returns:
+            requests.Response
+        """
+        url = "{}/{}".format(self.server, path)
+        logger.debug("GET {} {}".format(url, params))
+        with span("api request", path=path) as request_span:
+            response = self.session.get(url, params=params, timeout=timeout,
+                                        headers=headers)
+            request_span["status"] = response.status_code
+            request_span["bytes"] = len(response.content)
+        return response
+
+    def _decode(self, response):
+        """
+        Return decoded response, raise exception if request failed
+        """
+        if response.status_code != 200:
+            msg = "GET {} failed ({}): {}".format(response.url,
+                                                  response.status_code,
+                                                  response.text)
+            logger.error(msg)
+            raise Exception(msg)
+        return serializer.loads_json(response.content)
+
+    def _get(self, path, params=None, timeout=None):
+        """
+        Send GET request to OpenShift API
+
+        Args:
+            path (str): api path (without server)
+            params (dict): query parameters
+            timeout (float): timeout of request (seconds), None for no timeout
+
+        Returns:
+            dict: decoded response
+        """
+        return self._decode(self._request(path, params, timeout))
+
+    def get_username(self):
+        """
+        Return the currently authenticated user name
+        """
+        try:
+            user = self._get("oapi/v1/users/~")
+        except Exception:
+            return None
+        return user["metadata"]["name"]
+
+    def get_token(self):
+        """
+        Get the token the current session is using.
+        """
+        return self.token
+
+    def get_projects(self, selector=None):
+        """
+        Return names of all projects accessible by current user
+
+        Args:
+            selector (str): label selector for projects
+
+        Returns:
+            list: project names (sorted)
+        """
+        params = {}
+        if selector:
+            params["labelSelector"] = selector
+        projects = self._get("oapi/v1/projects", params)
+        return sorted(project["metadata"]["name"]
+                      for project in projects.get("items") or [])
+
+    def cache_key(self):
+        """
+        Return identification of exported objects for cache.
+
+        Returns:
+            tuple (server, namespace, selector)
+        """
+        return self.server, self.namespace, self.selector
+
+    def fingerprint(self, resources):
+        """
+        Return fingerprint of current state of exported objects.
+        Fingerprint changes whenever any exported object is created,
+        modified or deleted. Only metadata of objects is requested (if
+        server supports it), so this is much cheaper than export.
+
+        Args:
+            resources (list): resource types to export
+
+        Returns:
+            str: fingerprint
+        """
+        versions = []
+        for resource in resources:
+            items, _ = self._list_items(resource,
+                                        headers={"Accept": METADATA_ACCEPT})
+            for obj in items:
+                metadata = obj.get("metadata") or {}
+                versions.append("{}/{}={}".format(
+                    resource, metadata.get("name"),
+                    metadata.get("resourceVersion")))
+        versions.sort()
+        return hashlib.sha256("\n".join(versions).encode("utf-8")).hexdigest()
+
+    def _iter_pages(self, resource, headers=None):
+        """
+        List all objects of one resource type page by page.
+        Objects are requested in chunks of `chunk_size` objects, all
+        requests together have to finish in `timeout` seconds. If continue
+        token expires before all chunks are received (server compacted
+        versions the list was started from), listing is started again
+        (at most LIST_RESTARTS times).
+
+        Args:
+            resource (str): resource type (eg. deploymentConfig)
+            headers (dict): additional request headers
+
+        Yields:
+            tuples (list of objects, metadata of list, restarted), where
+            restarted is True for first page of list that was started
+            again (pages received before are from older list)
+        """
+        api, collection = RESOURCE_API_PATHS[resource]
+        path = "{}/namespaces/{}/{}".format(api, self.namespace, collection)
+
+        deadline = None
+        if self.timeout:
+            deadline = time.time() + self.timeout
+
+        restarts = 0
+        restarted = False
+        params = {}
+        while True:
+            if "continue" not in params:
+                params = {"limit": self.chunk_size}
+                if self.selector:
+                    params["labelSelector"] = self.selector
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    msg = "Listing {} timed out after {} seconds".format(
+                        resource, self.timeout)
+                    logger.error(msg)
+                    raise Exception(msg)
+            response = self._request(path, params, timeout, headers)
+            if response.status_code == 410 and "continue" in params and \
+                    restarts < LIST_RESTARTS:
+                restarts += 1
+                restarted = True
+                logger.warning("Continue token of {} list expired, listing "
+                               "it again".format(resource))
+                del params["continue"]
+                continue
+            objects = self._decode(response)
+            metadata = objects.get("metadata") or {}
+            yield objects.get("items") or [], metadata, restarted
+            restarted = False
+
+            if not metadata.get("continue"):
+                return
+            params["continue"] = metadata["continue"]
+
+    def _list_items(self, resource, headers=None):
+        """
+        List all objects of one resource type (see _iter_pages). List is
+        always consistent, objects of list that had to be started again
+        are dropped.
+
+        Args:
+            resource (str): resource type (eg. deploymentConfig)
+            headers (dict): additional request headers
+
+        Returns:
+            tuple (list of objects, metadata of list)
+        """
+        items = []
+        metadata = {}
+        for page, metadata, restarted in self._iter_pages(resource, headers):
+            if restarted:
+                items = []
+            items.extend(page)
+        return items, metadata
+
+    def _list_resource(self, resource, metadata=None):
+        """
+        List and export all objects of one resource type (see _list_items)
+
+        Args:
+            resource (str): resource type (eg. deploymentConfig)
+            metadata (dict): gets updated with metadata of list (like
+                             `resourceVersion`)
+
+        Returns:
+            list: exported objects
+        """
+        items, list_metadata = self._list_items(resource)
+        if metadata is not None:
+            metadata.update(list_metadata)
+        return [self._export_object(resource, obj) for obj in items]
+
+    def _iter_resource(self, resource, stop=None):
+        """
+        Export all objects of one resource type using OpenShift REST API.
+        Objects are returned as pages arrive, only one page is kept in
+        memory. If listing has to be started again, objects that were
+        already returned are skipped (only their names are kept).
+
+        Args:
+            resource (str): resource type (eg. deploymentConfig)
+            stop (threading.Event): listing is stopped when event is set
+
+        Yields:
+            exported objects
+        """
+        # names of returned objects (objects of list that was started
+        # again are not returned twice)
+        names = set()
+        with span("fetch resource", resource=resource,
+                  objects=0) as fetch_span:
+            for page, metadata, restarted in self._iter_pages(resource):
+                if stop is not None and stop.is_set():
+                    raise Exception("Listing {} stopped".format(resource))
+                for obj in page:
+                    name = obj["metadata"].get("name")
+                    if name in names:
+                        continue
+                    names.add(name)
+                    fetch_span["objects"] += 1
+                    yield self._export_object(resource, obj)
+
+    def _watch_list(self, resource):
+        """
+        List objects of resource type before watching it
+
+        Args:
+            resource (str): resource type (eg. deploymentConfig)
+
+        Returns:
+            tuple (list of exported objects, resourceVersion of list)
+        """
+        metadata = {}
+        objects = list(self._list_resource(resource, metadata))
+        return objects, metadata.get("resourceVersion")
+
+    def _watch_events(self, resource, version, stop):
+        """
+        Watch changes of one resource type since `version` using watch
+        request. Request is ended by server after WATCH_TIMEOUT seconds.
+
+        Args:
+            resource (str): resource type (eg. deploymentConfig)
+            version (str): resourceVersion to watch from
+            stop (threading.Event): watch is stopped when event is set
+
+        Yields:
+            tuples (event, exported object, resourceVersion of object)
+        """
+        api, collection = RESOURCE_API_PATHS[resource]
+        url = "{}/{}/namespaces/{}/{}".format(self.server, api,
+                                              self.namespace, collection)
+        params = {"watch": "true", "timeoutSeconds": WATCH_TIMEOUT}
+        if version:
+            params["resourceVersion"] = version
+        if self.selector:
+            params["labelSelector"] = self.selector
+        logger.debug("GET {} {}".format(url, params))
+
+        response = self.session.get(url, params=params, stream=True,
+                                    timeout=WATCH_TIMEOUT + 30)
+        try:
+            if response.status_code != 200:
+                msg = "GET {} failed ({}): {}".format(
+                    url, response.status_code, response.text)
+                logger.error(msg)
+                raise Exception(msg)
+            for line in response.iter_lines():
+                if stop.is_set():
+                    return
+                if not line:
+                    continue
+                event = serializer.loads_json(line)
+                obj = event["object"]
+                if event["type"] == "ERROR":
+                    # eg. 410 Gone if version is too old
+                    raise Exception("Watch of {} failed: {}".format(
+                        resource, obj.get("message")))
+                version = obj["metadata"].get("resourceVersion")
+                yield (event["type"], self._export_object(resource, obj),
+                       version)
+        finally:
+            response.close()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import os
+import time
+
+from openshift2nulecule import serializer, utils
+from openshift2nulecule.profiling import span
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_dir():
+    """
+    Return default directory for cache ($XDG_CACHE_HOME/openshift2nulecule)
+
+    Returns:
+        str: path to cache directory
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join("~", ".cache")
+    return os.path.join(base, "openshift2nulecule")
+
+
+class ExportCache(object):
+    """
+    On-disk cache of objects exported from OpenShift.
+
+    Every entry is identified by OpenShift server, namespace and label
+    selector. Together with exported objects entry stores fingerprint of
+    cluster state (see OpenshiftClient.fingerprint), which is much cheaper
+    to get than the export itself. Entry is used only if fingerprint
+    didn't change, otherwise objects are exported again and cache is
+    updated while they are being read. When fingerprint can't be computed
+    cheaply, objects are always exported again (cache is then useful only
+    in offline mode).
+
+    In offline mode cluster is not contacted at all, objects are always
+    read from cache.
+
+    Entry consists of two files in cache directory:
+      <key>.json - exported objects (JSON document of kind List)
+      <key>.meta.json - server, namespace, selector, fingerprint and time
+                        of export
+    """
+
+    # directory with cache entries
+    directory = None
+
+    # don't contact cluster, use only cached objects
+    offline = False
+
+    def __init__(self, directory=None, offline=False):
+        """
+        Args:
+            directory (str): cache directory (created if it doesn't exist),
+                             default is default_cache_dir()
+            offline (bool): use only cached objects
+        """
+        self.directory = utils.get_path(directory or default_cache_dir())
+        self.offline = offline
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def _paths(self, server, namespace, selector):
+        """
+        Return paths to objects and metadata files of entry
+        """
+        key = hashlib.sha256(serializer.dumps_json(
+            [server, namespace, selector], indent=False)).hexdigest()
+        base = os.path.join(self.directory, key)
+        return base + ".json", base + ".meta.json"
+
+    def load_meta(self, server, namespace, selector):
+        """
+        Return metadata of cache entry
+
+        Args:
+            server (str): url of OpenShift server
+            namespace (str): exported namespace
+            selector (str): label selector of exported objects
+
+        Returns:
+            dict: metadata (with `fingerprint`), None if entry doesn't exist
+        """
+        objects_path, meta_path = self._paths(server, namespace, selector)
+        if not (os.path.exists(objects_path) and os.path.exists(meta_path)):
+            return None
+        with open(meta_path, "rb") as f:
+            return serializer.loads_json(f.read())
+
+    def iter_objects(self, client, resources):
+        """
+        Return objects exported by client, from cache if it is valid.
+
+        Args:
+            client (OpenshiftClient): client used for export
+            resources (list): resource types to export
+
+        Returns:
+            iterator of exported objects
+        """
+        server, namespace, selector = client.cache_key()
+        objects_path, meta_path = self._paths(server, namespace, selector)
+        meta = self.load_meta(server, namespace, selector)
+
+        if self.offline:
+            if meta is None:
+                msg = "Namespace {} (selector: {}) of {} is not in cache " \
+                      "{}".format(namespace, selector, server, self.directory)
+                logger.critical(msg)
+                raise Exception(msg)
+            logger.info("Using objects exported at {} from cache".format(
+                time.ctime(meta["created"])))
+            return self._read(objects_path)
+
+        with span("fingerprint", namespace=namespace):
+            fingerprint = client.fingerprint(resources)
+        if fingerprint is None:
+            logger.info("State of {} can't be checked cheaply, objects are "
+                        "exported again".format(namespace))
+        elif meta is not None and meta["fingerprint"] == fingerprint and \
+                meta.get("resources") == resources:
+            logger.info("Objects in {} have not changed since {}, using "
+                        "cache".format(namespace, time.ctime(meta["created"])))
+            return self._read(objects_path)
+
+        meta = {"server": server,
+                "namespace": namespace,
+                "selector": selector,
+                "resources": resources,
+                "fingerprint": fingerprint,
+                "created": time.time()}
+        return self._write_through(objects_path, meta_path, meta,
+                                   client._iter_resources(resources))
+
+    @staticmethod
+    def _read(objects_path):
+        """
+        Read cached objects
+        """
+        with span("read cache", objects=0) as read_span:
+            with open(objects_path, "rb") as f:
+                for obj in utils.iter_list_items(f, kind="List"):
+                    read_span["objects"] += 1
+                    yield obj
+
+    @staticmethod
+    def _write_through(objects_path, meta_path, meta, objects):
+        """
+        Store objects to cache while they are being yielded.
+        Entry is replaced only when all objects were read.
+        """
+        tmp_path = "{}.{}.tmp".format(objects_path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(b'{"kind": "List", "apiVersion": "v1", "items": [\n')
+                separator = b""
+                for obj in objects:
+                    f.write(separator)
+                    f.write(serializer.dumps_json(obj))
+                    separator = b",\n"
+                    yield obj
+                f.write(b"\n]}\n")
+            # metadata is removed first, so entry is never valid while
+            # objects are being replaced
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            os.rename(tmp_path, objects_path)
+            with open(meta_path, "wb") as f:
+                f.write(serializer.dumps_json(meta, sort_keys=True))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -1,15 +1,25 @@
 # -*- coding: utf-8 -*-
 
 import os
+from collections import OrderedDict
 
 import argparse
 import logging
-import anymarkup
 
-from openshift2nulecule.constants import (NULECULE_PROVIDERS,
-                                          ATOMICAPP_VERSION)
+from openshift2nulecule.constants import (ATOMICAPP_VERSION,
+                                          DOCKER_URL,
+                                          JOURNAL_FILE)
+from openshift2nulecule.cache import default_cache_dir
+from openshift2nulecule.export import (create_client, export_partitions,
+                                       export_projects, is_partitioned,
+                                       watch_project)
+from openshift2nulecule.image import ImageRef
+from openshift2nulecule.journal import ExportJournal
+from openshift2nulecule.partition import Selector
 from openshift2nulecule.openshift import OpenshiftClient
-from openshift2nulecule import utils
+from openshift2nulecule.profiling import span, tracer
+from openshift2nulecule.server import ExportServer
+from openshift2nulecule import transforms, utils
 
 logger = logging.getLogger()
 logger.handlers = []
@@ -27,13 +37,40 @@ class CLI():
     def __init__(self):
         self.parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
         self.parser.add_argument("--output",
-                                 help="Directory where the new Nulecule app will be created (must not exist)",
+                                 help="Directory where the new Nulecule app will be created (must not exist,\n"
+                                      "unless --incremental or --resume is used). When more projects are\n"
+                                      "exported, one Nulecule app is created for every project in\n"
+                                      "<output>/<project>.\n"
+                                      "With archive --output-format this is path to archive, '-' for stdout.",
                                  type=str,
-                                 required=True)
+                                 required=False)
+        self.parser.add_argument("--output-format",
+                                 help="Format of the Nulecule app. Choices are:\n"
+                                      " 'dir': directory (default)\n"
+                                      " 'tar': tar archive (default if --output is '-' or ends with .tar)\n"
+                                      " 'tar.gz': gzip compressed tar archive (default if --output ends with\n"
+                                      "           .tar.gz or .tgz)\n"
+                                      "Archive is written directly, without temporary files.",
+                                 choices=["dir", "tar", "tar.gz"],
+                                 required=False)
+        self.parser.add_argument("--build-image",
+                                 help="Build Atomic App image with this name from the created Nulecule app.\n"
+                                      "The app is streamed to docker build as build context.",
+                                 type=str,
+                                 required=False)
         self.parser.add_argument("--project",
-                                 help="OpenShift project (namespace) to export as a Nulecule application",
+                                 help="OpenShift project (namespace) to export as a Nulecule application.\n"
+                                      "Can be used more times to export more projects.",
+                                 type=str,
+                                 action="append",
+                                 required=False)
+        self.parser.add_argument("--project-selector",
+                                 help="Export all projects matching this label selector (key=value).",
                                  type=str,
-                                 required=True)
+                                 required=False)
+        self.parser.add_argument("--all-projects",
+                                 help="Export all projects accessible by current user.",
+                                 action='store_true')
         self.parser.add_argument("--oc",
                                  help="Path to the oc binary",
                                  type=str,
@@ -42,14 +79,71 @@ class CLI():
                                  help="Path to the config file for the oc command",
                                  type=str,
                                  required=False)
+        self.parser.add_argument("--incremental",
+                                 help="Update an existing Nulecule app in --output. Only changed artifacts are\n"
+                                      "rewritten and images that haven't changed since the last export are\n"
+                                      "not transferred again.",
+                                 action='store_true')
+        self.parser.add_argument("--resume",
+                                 help="Continue interrupted export into the same --output (with the same\n"
+                                      "arguments). Progress of every export of images is recorded in journal in --output,\n"
+                                      "objects, images and artifacts recorded there are not fetched,\n"
+                                      "transferred and written again. Works with directory output only.",
+                                 action='store_true')
+        self.parser.add_argument("--api",
+                                 help="Talk directly to the OpenShift REST API instead of running the oc binary.\n"
+                                      "Connection details are read from the oc config file (see --oc-config).",
+                                 action='store_true')
+        self.parser.add_argument("--cache",
+                                 help="Keep exported objects in local cache and reuse them while they don't\n"
+                                      "change in OpenShift (checked by resourceVersion of objects).",
+                                 action='store_true')
+        self.parser.add_argument("--cache-dir",
+                                 help="Directory with cache (implies --cache, default {})".format(
+                                     default_cache_dir()),
+                                 type=str,
+                                 required=False)
+        self.parser.add_argument("--from-cache",
+                                 help="Don't contact OpenShift at all, create Nulecule app from objects in cache.",
+                                 action='store_true')
+        self.parser.add_argument("--fetch-timeout",
+                                 help="Seconds to wait for objects of one resource type (eg. services), every\n"
+                                      "resource type is fetched concurrently (0 for no timeout, default 300).",
+                                 type=float,
+                                 default=300,
+                                 required=False)
+        self.parser.add_argument("--fetch-retries",
+                                 help="Number of retries when fetching objects of one resource type fails\n"
+                                      "(default 2).",
+                                 type=int,
+                                 default=2,
+                                 required=False)
         self.parser.add_argument("--debug",
                                  help="Show debug messages",
                                  action='store_true')
+        self.parser.add_argument("--progress",
+                                 help="Write progress events (fetched objects, exported images, written\n"
+                                      "artifacts) to stderr, one JSON object per line.",
+                                 action='store_true')
+        self.parser.add_argument("--profile",
+                                 help="Write JSON report with duration of every stage, command, image transfer\n"
+                                      "and written file (with bytes and object counts) to this file.",
+                                 type=str,
+                                 required=False)
 
         self.parser.add_argument("--oc-registry-host",
                                  help="Hostname of the exposed internal OpenShift registry",
                                  required=False)
 
+        self.parser.add_argument("--internal-registry",
+                                 help="Host (host:port or just host) of internal OpenShift registry as used in\n"
+                                      "image names in artifacts (eg. docker-registry.default.svc:5000). Can be used\n"
+                                      "more times. If not set, registries with private ip address or cluster\n"
+                                      "service hostname (*.svc) are considered internal.",
+                                 type=str,
+                                 action="append",
+                                 required=False)
+
         self.parser.add_argument("--export-images",
                                  help="Pull images that are specified in OpenShift "
                                       "artifacts to a local Docker instance \n"
@@ -74,17 +168,96 @@ class CLI():
                                  help="Don't push images to external registry. (usefull for testing)",
                                  action='store_true')
 
+        self.parser.add_argument("--jobs",
+                                 help="Number of images that are exported (pulled, tagged and pushed) concurrently,\n"
+                                      "number of threads writing artifact files and number of projects\n"
+                                      "that are read concurrently when more projects are exported.",
+                                 type=int,
+                                 default=4,
+                                 required=False)
+
+        self.parser.add_argument("--transfer-mode",
+                                 help="How images are transferred to the registry specified by --registry-host.\n"
+                                      "Choices are:\n"
+                                      " 'docker': pull images to a local Docker instance, tag and push them (default)\n"
+                                      " 'registry': copy images directly between registries without Docker daemon,\n"
+                                      "             layers that already are in the registry are not copied",
+                                 choices=["docker", "registry"],
+                                 default="docker",
+                                 required=False)
+        self.parser.add_argument("--bandwidth-limit",
+                                 help="Maximum total bandwidth of image transfers in bytes per second,\n"
+                                      "with optional K, M or G suffix (eg. 50M). Can be used only with\n"
+                                      "--transfer-mode registry (transfers of Docker daemon can't be throttled).",
+                                 type=str,
+                                 required=False)
+        self.parser.add_argument("--docker-backend",
+                                 help="How to communicate with Docker daemon when exporting images.\n"
+                                      "Choices are:\n"
+                                      " 'cli': use docker command line client (default)\n"
+                                      " 'api': use Docker Engine API directly (requires docker-py)",
+                                 choices=["cli", "api"],
+                                 default="cli",
+                                 required=False)
+        self.parser.add_argument("--docker-url",
+                                 help="Url of Docker daemon used by 'api' docker backend (default {})".format(DOCKER_URL),
+                                 type=str,
+                                 default=DOCKER_URL,
+                                 required=False)
+
         self.parser.add_argument("--atomicapp-ver",
                                  help="Specify custom Atomic App version for the Dockerfile that will be generated.",
                                  type=str,
                                  default=ATOMICAPP_VERSION,
                                  required=False)
 
+        self.parser.add_argument("--transform",
+                                 help="Apply this Python function (module:function) to every exported object,\n"
+                                      "after built-in transforms. Function gets provider and object and returns\n"
+                                      "the object or None to drop it. Can be used more times.",
+                                 type=str,
+                                 action="append",
+                                 required=False)
+
         self.parser.add_argument("--selector",
                                  help="Specify it in the form key=value, the only configuration that matches this will\n"
                                       "be exported. This helps you to select app from the multiple apps deployed in a\n"
-                                      "single project.",
+                                      "single project. Can be used more times: the project is fetched once and one\n"
+                                      "Nulecule app is created for every selector in <output>/<name> (name is the value\n"
+                                      "of key=value selector), selectors are evaluated locally.",
+                                 type=str,
+                                 action="append",
+                                 required=False)
+        self.parser.add_argument("--group-by",
+                                 help="Label key. The project is fetched once and one Nulecule app is created for\n"
+                                      "every value of this label in <output>/<value>.",
+                                 type=str,
+                                 required=False)
+
+        self.parser.add_argument("--watch",
+                                 help="After export keep watching the project and update the Nulecule app\n"
+                                      "whenever exported objects change (until interrupted). Only changed\n"
+                                      "artifacts are written and only newly used images are exported.\n"
+                                      "Works with one --project and directory output, existing app is updated.",
+                                 action='store_true')
+
+        self.parser.add_argument("--serve",
+                                 help="Run export server listening on [HOST:]PORT (default host 127.0.0.1).\n"
+                                      "Exports are requested over HTTP API (POST /jobs with {\"args\": [...]}),\n"
+                                      "other arguments of server are defaults for arguments of every export.",
+                                 type=str,
+                                 required=False)
+        self.parser.add_argument("--server-jobs",
+                                 help="Number of exports that export server runs concurrently (default 2).",
+                                 type=int,
+                                 default=2,
+                                 required=False)
+        self.parser.add_argument("--server-root",
+                                 help="Directory export server writes exports to, --output of every export has to\n"
+                                      "be a path inside it, relative --output is relative to it (default current\n"
+                                      "directory).",
                                  type=str,
+                                 default=".",
                                  required=False)
 
     def run(self):
@@ -94,7 +267,87 @@ class CLI():
             logger.setLevel(logging.DEBUG)
         logger.debug("Running with arguments {}".format(args))
 
-        if utils.in_container() and not os.path.isabs(args.output):
+        if args.profile:
+            profile_path = utils.get_path(args.profile)
+            tracer.enable()
+        try:
+            if args.serve:
+                self.serve(args)
+            else:
+                with span("run"):
+                    self.export(args)
+        finally:
+            if args.profile:
+                tracer.write(profile_path)
+
+    def serve(self, args):
+        """
+        Run export server until interrupted
+
+        Args:
+            args (argparse.Namespace): parsed command line arguments
+        """
+        if ":" in args.serve:
+            host, port = args.serve.rsplit(":", 1)
+        else:
+            host, port = "127.0.0.1", args.serve
+        if not port.isdigit():
+            msg = "Invalid --serve {}, use [HOST:]PORT".format(args.serve)
+            logger.critical(msg)
+            raise Exception(msg)
+
+        if not args.api and not args.oc:
+            # find oc only once for all exports
+            args.oc = OpenshiftClient._find_oc()
+        ImageRef.set_internal_registries(args.internal_registry)
+        transforms.load_transforms(args.transform)
+
+        server = ExportServer(self, args, host, int(port), args.server_jobs,
+                              args.server_root)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Export server stopped")
+
+    def export(self, args, session=None):
+        """
+        Export projects as Nulecule applications
+
+        Args:
+            args (argparse.Namespace): parsed command line arguments
+            session (ExportSession): state shared with other exports
+                                     (see ExportServer)
+        """
+        if not args.output:
+            msg = "--output is required"
+            logger.critical(msg)
+            raise Exception(msg)
+
+        if args.output_format is None:
+            if args.output == "-" or args.output.endswith(".tar"):
+                args.output_format = "tar"
+            elif args.output.endswith((".tar.gz", ".tgz")):
+                args.output_format = "tar.gz"
+            else:
+                args.output_format = "dir"
+
+        if args.output == "-" and args.output_format == "dir":
+            msg = "Only archive can be written to stdout, use --output-format tar or tar.gz"
+            logger.critical(msg)
+            raise Exception(msg)
+
+        if args.output_format != "dir" and args.incremental:
+            msg = "--incremental can't be used with archive --output-format"
+            logger.critical(msg)
+            raise Exception(msg)
+
+        if args.resume and (args.output_format != "dir" or args.watch):
+            msg = "--resume can be used only with directory --output (without --watch)"
+            logger.critical(msg)
+            raise Exception(msg)
+
+        if utils.in_container() and args.output != "-" and \
+                not os.path.isabs(args.output):
             msg = "If running inside container --output path has to be absolute path"
             logger.critical(msg)
             raise Exception(msg)
@@ -104,6 +357,42 @@ class CLI():
             logger.critical(msg)
             raise Exception(msg)
 
+        if args.transfer_mode == "registry" and args.export_images != 'none' and \
+                (args.skip_push or not args.registry_host):
+            msg = "With --transfer-mode registry you need to set --registry-host and you can't use --skip-push"
+            logger.critical(msg)
+            raise Exception(msg)
+
+        if args.from_cache and args.export_images != 'none':
+            msg = "--export-images can't be used with --from-cache"
+            logger.critical(msg)
+            raise Exception(msg)
+
+        if args.fetch_timeout < 0 or args.fetch_retries < 0:
+            msg = "--fetch-timeout and --fetch-retries can't be negative"
+            logger.critical(msg)
+            raise Exception(msg)
+
+        if args.bandwidth_limit:
+            try:
+                bandwidth_limit = utils.parse_size(args.bandwidth_limit)
+            except ValueError:
+                bandwidth_limit = 0
+            if bandwidth_limit <= 0:
+                msg = "Invalid --bandwidth-limit {}, use number of bytes per second (eg. 50M)".format(
+                    args.bandwidth_limit)
+                logger.critical(msg)
+                raise Exception(msg)
+            if args.transfer_mode != "registry":
+                msg = "--bandwidth-limit can be used only with --transfer-mode registry, transfers of Docker daemon can't be throttled"
+                logger.critical(msg)
+                raise Exception(msg)
+
+        if args.from_cache and not args.project:
+            msg = "Projects have to be specified by --project with --from-cache"
+            logger.critical(msg)
+            raise Exception(msg)
+
         # validate and parse --registry-login
         if args.registry_login is None:
             registry_user = None
@@ -116,82 +405,112 @@ class CLI():
             logger.critical(msg)
             raise Exception(msg)
 
-        nulecule_dir = utils.get_path(args.output)
-
-        if os.path.exists(nulecule_dir):
-            msg = "{} must not exist".format(nulecule_dir)
+        if bool(args.project) + bool(args.project_selector) + \
+                args.all_projects != 1:
+            msg = "Use one of --project, --project-selector or --all-projects"
             logger.critical(msg)
             raise Exception(msg)
 
-        artifacts_dir = os.path.join(nulecule_dir, "artifacts")
-        provider_paths = {provider: os.path.join(artifacts_dir, provider)
-                          for provider in NULECULE_PROVIDERS}
-        nulecule_file = os.path.join(nulecule_dir, "Nulecule")
-
-        oc = OpenshiftClient(oc=args.oc,
-                             namespace=args.project,
-                             oc_config=args.oc_config,
-                             selector=args.selector)
-
-        # export project info from openshift
-        exported_project = oc.export_project()
-
-        # export images
-        if args.export_images != "none":
-            if args.export_images == "internal":
-                only_internal = True
-            elif args.export_images == "all":
-                only_internal = False
-
-            exported_project.pull_images(args.oc_registry_host,
-                                         oc.get_username(),
-                                         oc.get_token(),
-                                         only_internal)
-
-            # if registy-host is not set or skip-push is set do not perform push
-            if args.registry_host and not args.skip_push:
-                exported_project.push_images(args.registry_host,
-                                             registry_user,
-                                             registry_password,
-                                             only_internal)
-
-            exported_project.update_artifacts_images()
-
-        provider_artifacts = {}
-        for provider, path in provider_paths.items():
-            # list of artifact for Nulecule file
-            nulecule_artifacts = []
-
-            os.makedirs(path)
-            # create artifact files
-            for artifact in exported_project.artifacts[provider]:
-                if "name" in artifact["metadata"]:
-                    name = artifact["metadata"]["name"]
-                else:
-                    name = "unknown"
-                kind = artifact["kind"]
-                filename = "{}-{}.json".format(name, kind)
-                filepath = os.path.join(path, filename)
-
-                if os.path.exists(filepath):
-                    filepath = utils.get_new_name(filepath)
-
-                nulecule_artifacts.append("file://{}".format(os.path.relpath(
-                                          filepath, nulecule_dir)))
-                anymarkup.serialize_file(artifact, filepath, format="json")
-
-            provider_artifacts[provider] = nulecule_artifacts
-
-        nulecule = {"specversion": "0.0.2",
-                    "id": args.project,
-                    "metadata": {"name": args.project},
-                    "graph": [{"name": args.project,
-                               "artifacts": provider_artifacts}]}
-        anymarkup.serialize_file(nulecule, nulecule_file, format="yaml")
-
-        utils.generate_dockerfile(nulecule_dir, args.atomicapp_ver)
-        logger.info("Nulecule application created in {}".format(
-            utils.remove_path(nulecule_dir)))
+        if args.output == "-":
+            nulecule_dir = args.output
+        else:
+            nulecule_dir = utils.get_path(args.output)
+
+        if is_partitioned(args):
+            if args.group_by and args.selector:
+                msg = "--group-by can't be used with --selector"
+                logger.critical(msg)
+                raise Exception(msg)
+            if not (args.project and len(args.project) == 1) or \
+                    args.output_format != "dir" or args.build_image or \
+                    args.watch:
+                msg = "More --selector and --group-by can be used only with one --project and " \
+                      "directory --output (without --build-image and --watch)"
+                logger.critical(msg)
+                raise Exception(msg)
+            names = {}
+            for selector in args.selector or []:
+                try:
+                    name = Selector(selector).name()
+                except ValueError as e:
+                    msg = "Invalid --selector: {}".format(e)
+                    logger.critical(msg)
+                    raise Exception(msg)
+                if name in names:
+                    msg = "Selectors {} and {} give the same app name {}".format(
+                        names[name], selector, name)
+                    logger.critical(msg)
+                    raise Exception(msg)
+                names[name] = selector
+
+        if args.watch:
+            if not (args.project and len(args.project) == 1) or \
+                    args.output_format != "dir" or args.build_image or \
+                    args.from_cache:
+                msg = "--watch can be used only with one --project and directory --output " \
+                      "(without --build-image and --from-cache)"
+                logger.critical(msg)
+                raise Exception(msg)
+            watch_project(args, args.project[0], nulecule_dir, registry_user,
+                          registry_password, session)
+            return
+
+        if args.project and len(args.project) == 1:
+            outputs = OrderedDict([(args.project[0], nulecule_dir)])
+        elif args.output_format != "dir" or args.build_image:
+            msg = "Archive --output-format and --build-image can be used only with one project"
+            logger.critical(msg)
+            raise Exception(msg)
+        else:
+            if args.project:
+                projects = args.project
+            else:
+                projects = create_client(args).get_projects(
+                    args.project_selector)
+                if not projects:
+                    msg = "No projects to export"
+                    logger.critical(msg)
+                    raise Exception(msg)
+                logger.info("Exporting projects: {}".format(
+                    ", ".join(projects)))
+            outputs = OrderedDict((project,
+                                   os.path.join(nulecule_dir, project))
+                                  for project in projects)
+
+        journal = None
+        # exports without images are quick to run again, only transfers of
+        # images are worth journaling (writing every object again)
+        if args.output_format == "dir" and \
+                (args.export_images != "none" or args.resume):
+            journal = ExportJournal(os.path.join(nulecule_dir, JOURNAL_FILE),
+                                    args.resume)
+
+        if is_partitioned(args):
+            # applications are known only after project is fetched
+            failed_images = export_partitions(args, args.project[0],
+                                              nulecule_dir, registry_user,
+                                              registry_password, session,
+                                              journal)
+        else:
+            if not args.incremental and not args.resume:
+                for path in outputs.values():
+                    if path != "-" and os.path.exists(path):
+                        msg = "{} must not exist".format(path)
+                        logger.critical(msg)
+                        raise Exception(msg)
+
+            failed_images = export_projects(args, outputs, registry_user,
+                                            registry_password, session,
+                                            journal)
+
+        if failed_images:
+            for image, error in failed_images:
+                logger.error("Image {} was not exported: {}".format(image,
+                                                                    error))
+            msg = "Failed to export {} image(s), artifacts are referencing " \
+                  "original images instead".format(len(failed_images))
+            logger.critical(msg)
+            raise Exception(msg)
 
 
 def main():
@@ -4,3 +4,67 @@ HOST_DIR = "/host"
 ATOMICAPP_VERSION = "0.5.1"
 NULECULE_SPECVERSION = "0.0.2"
 NULECULE_PROVIDERS = ["kubernetes", "openshift"]
+
+DOCKER_URL = "unix://var/run/docker.sock"
+
+# registry of images without registry in name
+DOCKER_HUB = "docker.io"
+
+# hostname suffixes of cluster services, registries with these hostnames
+# are considered internal OpenShift registries (unless internal registries
+# are specified explicitly)
+INTERNAL_REGISTRY_SUFFIXES = (".svc", ".svc.cluster.local")
+
+# metadata fields that are specific to running cluster and are removed
+# from exported objects (same as `oc export` does)
+CLUSTER_METADATA = ["uid", "selfLink", "resourceVersion", "namespace",
+                    "generation", "deletionTimestamp",
+                    "deletionGracePeriodSeconds"]
+
+# manifest of exported application (hashes of artifacts, exported images)
+MANIFEST_FILE = ".openshift2nulecule.json"
+
+# journal of export in progress (see ExportJournal), it is removed when
+# export finishes
+JOURNAL_FILE = ".openshift2nulecule.journal"
+
+# Resources to export for each provider.
+# Don't export Pods for now.
+# Exporting ReplicationControllers should be enough.
+# Ideally this should detect Pods that are not created by
+# ReplicationController and only export those.
+# Order in resource list is significant! Objects are written to Nulecule
+# file in the same order as they are specified here.
+# ImageStream is first as workaround for this https://github.com/openshift/origin/issues/4518
+# But this workaround is going to work only after resolving
+# https://github.com/projectatomic/atomicapp/issues/669
+PROVIDER_RESOURCES = {"kubernetes": ["persistentVolumeClaim",
+                                     "service",
+                                     "replicationController"],
+                      "openshift": ["imageStream",
+                                    "service",
+                                    "persistentVolumeClaim",
+                                    "replicationController",
+                                    "deploymentConfig",
+                                    "buildConfig"]}
+
+# api prefix and name of collection for every exported resource
+RESOURCE_API_PATHS = {"persistentVolumeClaim": ("api/v1", "persistentvolumeclaims"),
+                      "service": ("api/v1", "services"),
+                      "replicationController": ("api/v1", "replicationcontrollers"),
+                      "imageStream": ("oapi/v1", "imagestreams"),
+                      "deploymentConfig": ("oapi/v1", "deploymentconfigs"),
+                      "buildConfig": ("oapi/v1", "buildconfigs")}
+
+# number of seconds after which server ends watch request (watch is then
+# started again from last seen version)
+WATCH_TIMEOUT = 300
+
+# Kinds of objects that have pod template in spec.template
+POD_TEMPLATE_KINDS = ["ReplicationController",
+                      "DeploymentConfig",
+                      "DaemonSet",
+                      "Job",
+                      "StatefulSet",
+                      "ReplicaSet",
+                      "Deployment"]
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import tempfile
+import threading
+from subprocess import Popen, PIPE, STDOUT
+
+from openshift2nulecule import serializer, utils
+from openshift2nulecule.constants import DOCKER_URL
+from openshift2nulecule.image import ImageRef
+
+logger = logging.getLogger(__name__)
+
+
+class DockerCliBackend(object):
+    """
+    Performs image operations using docker command line client.
+    """
+
+    def login(self, registry, username, password):
+        """
+        Login to docker registry
+
+        Args:
+            registry (str): url of registry
+            username (str): username for docker registry
+            password (str): password for docker registry
+        """
+        ec, stdout, stderr = utils.run_cmd(['docker', 'login',
+                                            '-u', username,
+                                            '-p', password,
+                                            '-e', "{}@{}".format(username,
+                                                                 registry),
+                                            registry])
+
+    def pull(self, image):
+        """
+        Pull image
+
+        Args:
+            image (str): full image name (with tag or digest)
+        """
+        ec, stdout, stderr = utils.run_cmd(['docker', 'pull', image])
+
+    def tag(self, image, new_name):
+        """
+        Tag image with new name
+
+        Args:
+            image (str): existing image name
+            new_name (str): new name of image (with tag)
+        """
+        ec, stdout, stderr = utils.run_cmd(['docker', 'tag', '-f', image,
+                                            new_name])
+
+    def push(self, image):
+        """
+        Push image
+
+        Args:
+            image (str): full image name (with tag)
+        """
+        ec, stdout, stderr = utils.run_cmd(['docker', 'push', image])
+
+    def start_build(self, tag):
+        """
+        Start building image from build context that is streamed to
+        `docker build -`.
+
+        Args:
+            tag (str): name of built image
+
+        Returns:
+            ImageBuild: build context (tar archive) has to be written to it,
+                        build finishes when it is closed
+        """
+        cmd = ['docker', 'build', '-t', tag, '-']
+        logger.debug("running cmd %s", cmd)
+        output = tempfile.TemporaryFile()
+        p = Popen(cmd, stdin=PIPE, stdout=output, stderr=STDOUT)
+
+        def finish():
+            p.stdin.close()
+            ec = p.wait()
+            output.seek(0)
+            log = output.read().decode("utf-8", "replace")
+            output.close()
+            logger.debug("\n<<< docker build >>>\n%s<<< end >>>\n", log)
+            if ec != 0:
+                raise Exception("Building image {} failed:\n{}".format(tag,
+                                                                      log))
+
+        return ImageBuild(tag, p.stdin, finish)
+
+
+class ImageBuild(object):
+    """
+    Docker build in progress. Build context (tar archive) is written to it
+    as a file, closing it waits until image is built.
+    """
+
+    def __init__(self, tag, context, finish):
+        """
+        Args:
+            tag (str): name of built image
+            context: file object build context is written to
+            finish: function called on close, waits for build and raises
+                    exception if build failed
+        """
+        self.tag = tag
+        self._context = context
+        self._finish = finish
+        self.bytes_written = 0
+
+    def write(self, data):
+        try:
+            self._context.write(data)
+        except (IOError, OSError):
+            # builder exited before reading whole context, its error is
+            # reported by close()
+            self.close()
+            raise
+        self.bytes_written += len(data)
+
+    def close(self):
+        if self._finish is None:
+            return
+        finish, self._finish = self._finish, None
+        logger.info("Building image {}".format(self.tag))
+        finish()
+        logger.info("Image {} built".format(self.tag))
+
+
+class DockerApiBackend(object):
+    """
+    Performs image operations using Docker Engine API (via docker-py).
+    Single client (and its connection pool) is used for all operations,
+    progress of pull and push is streamed to log.
+    """
+
+    client = None
+
+    def __init__(self, base_url=DOCKER_URL, timeout=None):
+        """
+        Args:
+            base_url (str): url of docker daemon
+                            (eg. unix://var/run/docker.sock)
+            timeout (int): timeout for api calls in seconds
+        """
+        # docker-py is optional, it is required only for this backend
+        import docker
+
+        kwargs = {"base_url": base_url, "version": "auto"}
+        if timeout:
+            kwargs["timeout"] = timeout
+
+        # docker-py >= 2.0 renamed Client to APIClient
+        client_class = getattr(docker, "APIClient", None) or docker.Client
+        self.client = client_class(**kwargs)
+
+    def login(self, registry, username, password):
+        """
+        Login to docker registry.
+        Credentials are remembered by client and used for following pulls
+        and pushes to this registry.
+
+        Args:
+            registry (str): url of registry
+            username (str): username for docker registry
+            password (str): password for docker registry
+        """
+        logger.debug("Logging in to {} as {}".format(registry, username))
+        self.client.login(username, password=password,
+                          email="{}@{}".format(username, registry),
+                          registry=registry, reauth=True)
+
+    def pull(self, image):
+        """
+        Pull image
+
+        Args:
+            image (str): full image name (with tag or digest)
+        """
+        ref = ImageRef.parse(image)
+        stream = self.client.pull(ref.repository_name, tag=ref.reference,
+                                  stream=True)
+        self._consume_stream(stream, image)
+
+    def tag(self, image, new_name):
+        """
+        Tag image with new name
+
+        Args:
+            image (str): existing image name
+            new_name (str): new name of image (with tag)
+        """
+        ref = ImageRef.parse(new_name)
+        if not self.client.tag(image, ref.repository_name, tag=ref.reference,
+                               force=True):
+            raise Exception("Tagging image {} as {} failed".format(image,
+                                                                   new_name))
+
+    def push(self, image):
+        """
+        Push image
+
+        Args:
+            image (str): full image name (with tag)
+        """
+        ref = ImageRef.parse(image)
+        stream = self.client.push(ref.repository_name, tag=ref.reference,
+                                  stream=True)
+        self._consume_stream(stream, image)
+
+    def start_build(self, tag):
+        """
+        Start building image from build context that is streamed to
+        Docker daemon (build runs in separate thread).
+
+        Args:
+            tag (str): name of built image
+
+        Returns:
+            ImageBuild: build context (tar archive) has to be written to it,
+                        build finishes when it is closed
+        """
+        read_fd, write_fd = os.pipe()
+        context = os.fdopen(read_fd, "rb")
+        errors = []
+
+        def build():
+            try:
+                stream = self.client.build(fileobj=context,
+                                           custom_context=True, tag=tag,
+                                           rm=True)
+                self._consume_stream(stream, tag)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                context.close()
+
+        thread = threading.Thread(target=build)
+        thread.daemon = True
+        thread.start()
+        writer = os.fdopen(write_fd, "wb")
+
+        def finish():
+            writer.close()
+            thread.join()
+            if errors:
+                raise Exception("Building image {} failed: {}".format(
+                    tag, errors[0]))
+
+        return ImageBuild(tag, writer, finish)
+
+    @staticmethod
+    def _consume_stream(stream, image):
+        """
+        Read progress stream of pull or push operation, log progress and
+        raise exception if operation failed.
+
+        Args:
+            stream: iterable of json encoded progress messages
+            image (str): image that is being processed (used for logging)
+        """
+        # message can be split between chunks, incomplete last line of
+        # chunk is kept until rest of it arrives
+        pending = ""
+        for chunk in stream:
+            if isinstance(chunk, bytes):
+                chunk = chunk.decode("utf-8")
+            lines = (pending + chunk).split("\n")
+            pending = lines.pop()
+            for line in lines:
+                DockerApiBackend._check_message(line, image)
+        DockerApiBackend._check_message(pending, image)
+
+    @staticmethod
+    def _check_message(line, image):
+        """
+        Log one progress message, raise exception if it reports error
+        """
+        if not line.strip():
+            return
+        message = serializer.loads_json(line)
+        if "error" in message:
+            raise Exception("{}: {}".format(image, message["error"]))
+        if "stream" in message:
+            # output of docker build
+            logger.debug("{}: {}".format(image, message["stream"].rstrip()))
+            return
+        logger.debug("{}: {} {} {}".format(image, message.get("id", ""),
+                                           message.get("status", ""),
+                                           message.get("progress", "")))
+
+def get_backend(name, base_url=DOCKER_URL):
+    """
+    Return docker backend
+
+    Args:
+        name (str): name of backend ('cli' or 'api')
+        base_url (str): url of docker daemon (used only for 'api' backend)
+
+    Returns:
+        docker backend object
+    """
+    if name == "cli":
+        return DockerCliBackend()
+    elif name == "api":
+        return DockerApiBackend(base_url)
+    else:
+        raise Exception("Unknown docker backend {}".format(name))
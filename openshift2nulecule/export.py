@@ -0,0 +1,611 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import Pool
+
+from openshift2nulecule.docker_backend import get_backend
+from openshift2nulecule.image import ImageRef
+from openshift2nulecule.api import OpenshiftApiClient
+from openshift2nulecule.cache import ExportCache
+from openshift2nulecule.openshift import OpenshiftClient, ExportedProject
+from openshift2nulecule.partition import (PartitionClient, Selector,
+                                          partition_by_label,
+                                          partition_by_selectors)
+from openshift2nulecule.pipeline import ExportPipeline, json_listener
+from openshift2nulecule.writer import (NuleculeWriter, TarWriter,
+                                       load_manifest)
+from openshift2nulecule.profiling import span, tracer
+from openshift2nulecule.scheduler import Throttle
+from openshift2nulecule.watch import WatchExport
+from openshift2nulecule import transforms, utils
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_selector(options):
+    """
+    Return label selector objects are fetched with. With more --selector
+    or with --group-by objects are fetched once and partitioned locally
+    (see export_partitions), only objects that have the --group-by label
+    are fetched.
+
+    Args:
+        options (argparse.Namespace): parsed command line arguments
+
+    Returns:
+        str: label selector, None if all objects are fetched
+    """
+    if options.group_by:
+        return options.group_by
+    if options.selector and len(options.selector) == 1:
+        return options.selector[0]
+    return None
+
+
+def is_partitioned(options):
+    """
+    Return True if project is partitioned into more applications (more
+    --selector or --group-by)
+    """
+    return bool(options.group_by or
+                (options.selector and len(options.selector) > 1))
+
+
+def create_client(options, namespace=None):
+    """
+    Create OpenShift client
+
+    Args:
+        options (argparse.Namespace): parsed command line arguments
+        namespace (str): project the client works with
+
+    Returns:
+        OpenshiftApiClient if --api was used, OpenshiftClient otherwise
+    """
+    cache = None
+    if options.cache or options.cache_dir or options.from_cache:
+        cache = ExportCache(options.cache_dir, offline=options.from_cache)
+
+    selector = fetch_selector(options)
+    if options.api:
+        return OpenshiftApiClient(namespace=namespace,
+                                  oc_config=options.oc_config,
+                                  selector=selector,
+                                  cache=cache,
+                                  timeout=options.fetch_timeout,
+                                  retries=options.fetch_retries)
+    return OpenshiftClient(oc=options.oc,
+                           namespace=namespace,
+                           oc_config=options.oc_config,
+                           selector=selector,
+                           cache=cache,
+                           timeout=options.fetch_timeout,
+                           retries=options.fetch_retries)
+
+
+class ExportSession(object):
+    """
+    State that can be reused by more exports run by one process (see
+    ExportServer): OpenShift clients (and their connections), docker
+    backend, registry clients (with their authorization tokens), OpenShift
+    credentials and images exported by previous exports.
+
+    Images that were exported before are not transferred again if their
+    digest in source registry hasn't changed (same as with --incremental).
+    Session can be used by more exports at the same time.
+    """
+
+    # number of seconds OpenShift username and token are reused
+    credentials_ttl = 300
+
+    def __init__(self):
+        # registry clients shared by all exports (see ExportedProject)
+        self.registries = {}
+        # images exported to registry, key is original image, value is
+        # dict with `digest`, `image` and `registry` (same as in manifest)
+        self.exported_images = {}
+
+        self._clients = {}
+        self._backends = {}
+        self._credentials = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _client_key(options, namespace):
+        return (options.api, options.oc, options.oc_config, namespace,
+                fetch_selector(options), options.cache, options.cache_dir,
+                options.from_cache, options.fetch_timeout,
+                options.fetch_retries)
+
+    def client(self, options, namespace=None):
+        """
+        Return OpenShift client (see create_client), client is created only
+        once for the same options.
+        """
+        key = self._client_key(options, namespace)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = create_client(options, namespace)
+            return self._clients[key]
+
+    def docker_backend(self, options):
+        """
+        Return docker backend, backend is created only once for the same
+        options.
+        """
+        key = (options.docker_backend, options.docker_url)
+        with self._lock:
+            if key not in self._backends:
+                self._backends[key] = get_backend(options.docker_backend,
+                                                  options.docker_url)
+            return self._backends[key]
+
+    def credentials(self, options):
+        """
+        Return username and token of current OpenShift user, they are
+        reused for `credentials_ttl` seconds.
+
+        Returns:
+            tuple (username, token)
+        """
+        key = self._client_key(options, None)
+        with self._lock:
+            cached = self._credentials.get(key)
+        if cached and time.time() - cached[0] < self.credentials_ttl:
+            return cached[1]
+
+        oc = self.client(options)
+        credentials = oc.get_username(), oc.get_token()
+        with self._lock:
+            self._credentials[key] = (time.time(), credentials)
+        return credentials
+
+    def known_images(self):
+        """
+        Return images exported by previous exports
+
+        Returns:
+            dict (copy of exported_images)
+        """
+        with self._lock:
+            return dict(self.exported_images)
+
+    def add_exported_images(self, images):
+        """
+        Remember exported images
+
+        Args:
+            images (dict): original image: dict with `digest`, `image` and
+                           `registry`
+        """
+        with self._lock:
+            self.exported_images.update(images)
+
+
+def create_writer(options, project, output, manifest=None, journal=None):
+    """
+    Create writer of Nulecule application
+
+    Args:
+        options (argparse.Namespace): parsed command line arguments
+        project (str): exported project (name of application)
+        output (str): application directory or archive ("-" for stdout)
+        manifest (dict): manifest of previous export (see load_manifest)
+        journal (ExportJournal): journal where written artifacts are
+                                 recorded (only directory output)
+
+    Returns:
+        TarWriter if output format is archive, NuleculeWriter otherwise
+    """
+    build = None
+    if options.build_image:
+        build = get_backend(options.docker_backend,
+                            options.docker_url).start_build(
+                                options.build_image)
+
+    if options.output_format == "dir":
+        return NuleculeWriter(output, project, options.atomicapp_ver,
+                              options.jobs, manifest, build, journal)
+    return TarWriter(output, project, options.atomicapp_ver,
+                     options.output_format == "tar.gz", build)
+
+
+def _output_name(output):
+    """
+    Return output of application for logging
+    """
+    if output == "-":
+        return "stdout"
+    return utils.remove_path(output)
+
+
+def _write_project(task):
+    """
+    Export project as Nulecule application without exporting images
+    (runs in worker process). Artifacts are written as soon as they are
+    read from OpenShift.
+
+    Args:
+        task (tuple): (options, project, nulecule_dir, manifest)
+
+    Returns:
+        str: project
+    """
+    options, project, nulecule_dir, manifest = task
+    # worker process doesn't have to inherit transforms from main process
+    transforms.load_transforms(options.transform)
+    logger.info("Exporting project {}".format(project))
+    with span("export project", project=project, objects=0) as export_span:
+        oc = create_client(options, project)
+        writer = create_writer(options, project, nulecule_dir, manifest)
+        for provider, artifact in oc.iter_artifacts():
+            artifact = ExportedProject.prepare_artifact(provider, artifact)
+            if artifact is not None:
+                writer.write_artifact(provider, artifact)
+                export_span["objects"] += 1
+        writer.close()
+    logger.info("Nulecule application created in {}".format(
+        _output_name(nulecule_dir)))
+    return project
+
+
+def _run_task(task):
+    """
+    Run one task in worker process. Spans recorded by worker are returned
+    with result, so they can be added to trace of main process.
+
+    Args:
+        task (tuple): (func, task for func, True if tracing is enabled)
+
+    Returns:
+        tuple (result, spans)
+    """
+    func, func_task, profile = task
+    # forget spans inherited from main process
+    tracer.pop_spans()
+    if profile:
+        tracer.enable()
+    return func(func_task), tracer.pop_spans()
+
+
+def _map(func, tasks, jobs):
+    """
+    Run func for every task in pool of `jobs` worker processes.
+    Single task is run in current process.
+
+    Returns:
+        list of results (in order of tasks)
+    """
+    if len(tasks) == 1:
+        return [func(tasks[0])]
+
+    pool = Pool(min(max(jobs, 1), len(tasks)))
+    try:
+        results = pool.map(_run_task, [(func, task, tracer.enabled)
+                                       for task in tasks])
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+    for result, spans in results:
+        tracer.add_spans(spans)
+    return [result for result, spans in results]
+
+
+def _image_index(options, session):
+    """
+    Return ExportedProject used as image index (and for image export)
+    """
+    if options.export_images != "none":
+        return ExportedProject(docker=session.docker_backend(options),
+                               registries=session.registries)
+    return ExportedProject(registries=session.registries)
+
+
+def _push_registry(options):
+    """
+    Return registry where images are pushed, None if they are not pushed
+    """
+    # if registy-host is not set or skip-push is set do not perform push
+    if options.registry_host and not options.skip_push:
+        return options.registry_host
+    return None
+
+
+def _image_exporter(options, session, images, registry_user,
+                    registry_password, known_images, journal=None):
+    """
+    Return functions that export one image and look up its size (see
+    ExportedProject.image_exporter and ExportedProject.image_size), both
+    are None if images are not exported.
+
+    Returns:
+        tuple (export_image, image_size)
+    """
+    if options.export_images == "none":
+        return None, None
+
+    oc_username, oc_token = session.credentials(options)
+    throttle = None
+    if options.bandwidth_limit and options.transfer_mode == "registry":
+        throttle = Throttle(utils.parse_size(options.bandwidth_limit))
+    export_image = images.image_exporter(
+        options.oc_registry_host, oc_username, oc_token,
+        _push_registry(options), registry_user, registry_password,
+        known_images, options.transfer_mode == "registry", throttle,
+        journal)
+
+    def image_size(image_info):
+        return images.image_size(image_info, options.oc_registry_host,
+                                 oc_username, oc_token)
+
+    return export_image, image_size
+
+
+def export_projects(options, outputs, registry_user=None,
+                    registry_password=None, session=None, journal=None,
+                    clients=None):
+    """
+    Export OpenShift projects as Nulecule applications.
+
+    Fetching objects, exporting images and writing artifacts overlap
+    (see ExportPipeline). Images of all projects are collected to one
+    shared image index, so every unique image is exported only once even
+    if it is used by more projects. One Nulecule application is written
+    for every project. When images are not exported, more projects are
+    exported in parallel worker processes, unless `session` is given.
+
+    If `journal` is given, progress of export is recorded in it (see
+    ExportJournal). Journal is removed when export finishes and kept when
+    it is interrupted or some images fail to export, so the export can be
+    resumed. Resumed journal (--resume) is continued: objects, images and
+    artifacts recorded in it are not fetched, transferred and written
+    again.
+
+    Args:
+        options (argparse.Namespace): parsed command line arguments
+        outputs (OrderedDict): project names and directories (or archives)
+                               where their Nulecule applications are
+                               created
+        registry_user (str): username for registry where images are pushed
+        registry_password (str): password for registry where images are
+                                 pushed
+        session (ExportSession): state shared with other exports, if None
+                                 new session is used
+        journal (ExportJournal): journal of export, None if export is not
+                                 journaled
+        clients (dict): clients that objects of projects are read from
+                        (see PartitionClient), default is OpenShift client
+                        of every project
+
+    Returns:
+        list of tuples (image, error) for images that failed to export
+    """
+    ImageRef.set_internal_registries(options.internal_registry)
+    transforms.load_transforms(options.transform)
+
+    resume = journal is not None and journal.resume
+    manifests = {}
+    for project, nulecule_dir in outputs.items():
+        if options.incremental:
+            manifests[project] = load_manifest(nulecule_dir)
+        else:
+            manifests[project] = None
+        if resume:
+            # artifacts written by interrupted export are not written again
+            manifest = manifests[project] or {"artifacts": {}, "images": {}}
+            manifest["artifacts"].update(journal.written.get(project, {}))
+            manifests[project] = manifest
+
+    if options.export_images == "none" and len(outputs) > 1 and \
+            not options.progress and session is None and not resume and \
+            clients is None:
+        # images are not exported, so every project can be written
+        # independently (in separate process) as soon as its artifacts
+        # are read
+        _map(_write_project,
+             [(options, project, nulecule_dir, manifests[project])
+              for project, nulecule_dir in outputs.items()],
+             options.jobs)
+        return []
+
+    known_images = None
+    if session is not None:
+        known_images = session.known_images()
+    else:
+        session = ExportSession()
+
+    # one image index shared by all projects
+    shared = _image_index(options, session)
+    for project in outputs:
+        if options.incremental:
+            if known_images is None:
+                known_images = {}
+            known_images.update(manifests[project]["images"])
+
+    push_registry = _push_registry(options)
+    export_image, image_size = _image_exporter(
+        options, session, shared, registry_user, registry_password,
+        known_images, journal)
+
+    if journal is not None:
+        journal.start(outputs)
+    try:
+        projects = OrderedDict(
+            (project, ((clients or {}).get(project) or
+                       session.client(options, project),
+                       create_writer(options, project, nulecule_dir,
+                                     manifests[project], journal)))
+            for project, nulecule_dir in outputs.items())
+        listeners = [json_listener()] if options.progress else []
+        pipeline = ExportPipeline(projects, shared, export_image,
+                                  push_registry,
+                                  options.export_images == "internal",
+                                  options.jobs, listeners, image_size,
+                                  journal)
+        with span("export pipeline") as pipeline_span:
+            failed_images = pipeline.run()
+            pipeline_span.update(pipeline.counters)
+    except BaseException:
+        if journal is not None:
+            journal.close()
+            logger.info("Export was interrupted, it can be resumed with "
+                        "--resume (journal {})".format(journal.path))
+        raise
+
+    if journal is not None:
+        if failed_images:
+            journal.close()
+            logger.info("Export of failed images can be retried with "
+                        "--resume (journal {})".format(journal.path))
+        else:
+            journal.remove()
+
+    failed = set(image for image, error in failed_images)
+    session.add_exported_images(
+        (image, {"digest": image_info["digest"],
+                 "image": image_info["image"],
+                 "registry": push_registry})
+        for image, image_info in shared.images.items()
+        if image_info.get("digest") and image not in failed)
+
+    for nulecule_dir in outputs.values():
+        logger.info("Nulecule application created in {}".format(
+            _output_name(nulecule_dir)))
+
+    return failed_images
+
+
+def export_partitions(options, project, nulecule_dir, registry_user=None,
+                      registry_password=None, session=None, journal=None):
+    """
+    Export one OpenShift project as more Nulecule applications, one for
+    every --selector or for every value of --group-by label.
+
+    Objects of project are fetched only once, selectors are evaluated
+    locally against labels of objects. Applications are written to
+    <nulecule_dir>/<name> (see Selector.name), images are exported once
+    for all applications (see export_projects). Resumed export (--resume)
+    doesn't fetch project when objects of all its applications are in
+    journal.
+
+    Args:
+        options (argparse.Namespace): parsed command line arguments
+        project (str): exported project
+        nulecule_dir (str): directory where applications are created
+        registry_user (str): username for registry where images are pushed
+        registry_password (str): password for registry where images are
+                                 pushed
+        session (ExportSession): state shared with other exports
+        journal (ExportJournal): journal of export
+
+    Returns:
+        list of tuples (image, error) for images that failed to export
+    """
+    if journal is not None and journal.resume and journal.projects and \
+            all(journal.fetched(name) for name in journal.projects):
+        # objects of all applications are read from journal by
+        # ExportPipeline, project doesn't have to be fetched again
+        logger.info("Applications of project {} are read from journal: "
+                    "{}".format(project, ", ".join(journal.projects)))
+        partitions = OrderedDict((name, journal.objects[name])
+                                 for name in journal.projects)
+    else:
+        partitions = _fetch_partitions(options, project, session)
+
+    outputs = OrderedDict((name, os.path.join(nulecule_dir, name))
+                          for name in partitions)
+    if not options.incremental and not options.resume:
+        for path in outputs.values():
+            if os.path.exists(path):
+                msg = "{} must not exist".format(path)
+                logger.critical(msg)
+                raise Exception(msg)
+
+    clients = dict((name, PartitionClient(objects))
+                   for name, objects in partitions.items())
+    return export_projects(options, outputs, registry_user,
+                           registry_password, session, journal, clients)
+
+
+def _fetch_partitions(options, project, session=None):
+    """
+    Fetch objects of project and partition them into applications (see
+    export_partitions).
+
+    Returns:
+        OrderedDict, name of application: list of tuples
+        (provider, artifact)
+    """
+    if session is not None:
+        client = session.client(options, project)
+    else:
+        client = create_client(options, project)
+    with span("fetch project", project=project) as fetch_span:
+        artifacts = list(client.iter_artifacts())
+        fetch_span["objects"] = len(artifacts)
+
+    if options.group_by:
+        partitions = partition_by_label(artifacts, options.group_by)
+    else:
+        partitions = partition_by_selectors(
+            artifacts, [Selector(selector) for selector in options.selector])
+    for name, objects in list(partitions.items()):
+        if not objects:
+            logger.warning("No objects of project {} match selector for "
+                           "application {}".format(project, name))
+            del partitions[name]
+    if not partitions:
+        msg = "No objects of project {} to export".format(project)
+        logger.critical(msg)
+        raise Exception(msg)
+    logger.info("Project {} partitioned into {} application(s): {}".format(
+        project, len(partitions), ", ".join(partitions)))
+
+    return partitions
+
+
+def watch_project(options, project, nulecule_dir, registry_user=None,
+                  registry_password=None, session=None):
+    """
+    Export OpenShift project as Nulecule application and keep it in sync
+    with project until interrupted (see WatchExport).
+
+    Args:
+        options (argparse.Namespace): parsed command line arguments
+        project (str): project to watch
+        nulecule_dir (str): directory with Nulecule application (created
+                            or updated)
+        registry_user (str): username for registry where images are pushed
+        registry_password (str): password for registry where images are
+                                 pushed
+        session (ExportSession): state shared with other exports
+    """
+    ImageRef.set_internal_registries(options.internal_registry)
+    transforms.load_transforms(options.transform)
+    session = session or ExportSession()
+
+    known_images = session.known_images()
+    known_images.update(load_manifest(nulecule_dir)["images"])
+    images = _image_index(options, session)
+    export_image, image_size = _image_exporter(
+        options, session, images, registry_user, registry_password,
+        known_images)
+
+    watch = WatchExport(session.client(options, project), nulecule_dir,
+                        project, export_image, image_size,
+                        _push_registry(options),
+                        options.export_images == "internal",
+                        options.atomicapp_ver, options.jobs)
+    try:
+        watch.run()
+    except KeyboardInterrupt:
+        logger.info("Stopped watching project {}".format(project))
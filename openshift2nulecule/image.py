@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+import ipaddress
+import logging
+import threading
+import weakref
+
+from openshift2nulecule.constants import (DOCKER_HUB,
+                                          INTERNAL_REGISTRY_SUFFIXES)
+
+logger = logging.getLogger(__name__)
+
+
+class ImageRef(object):
+    """
+    Parsed Docker image name.
+
+    Image name is parsed only once, instances are interned - ImageRef.parse
+    returns the same instance for the same image name, so images used by
+    many containers are represented by one small object. Interned instance
+    is kept only while it is used, so long running process (see
+    ExportServer) doesn't keep every image it has ever seen.
+
+    Example:
+      172.30.1.1:5000/foo/bar:1 -> registry "172.30.1.1:5000",
+                                   path "foo/bar", tag "1"
+      centos@sha256:abc -> registry None, path "centos", digest "sha256:abc"
+    """
+
+    __slots__ = ("name", "registry", "path", "tag", "digest", "__weakref__")
+
+    # interned instances (key is image name), instances that are not used
+    # anymore are removed
+    _instances = weakref.WeakValueDictionary()
+
+    # hosts of internal OpenShift registries (see set_internal_registries)
+    _internal_registries = None
+
+    # memoized classification of registries (registry: True if internal)
+    _internal_cache = {}
+    _lock = threading.Lock()
+
+    def __init__(self, name):
+        """
+        Args:
+            name (str): image name
+        """
+        self.name = name
+        self.tag = None
+        self.digest = None
+
+        if "@" in name:
+            path, self.digest = name.split("@", 1)
+        else:
+            path = name
+            if ":" in name.rsplit("/", 1)[-1]:
+                path, self.tag = name.rsplit(":", 1)
+
+        # first part is registry only if it looks like host (same rule as
+        # docker uses)
+        parts = path.split("/", 1)
+        if len(parts) == 2 and ("." in parts[0] or ":" in parts[0] or
+                                parts[0] == "localhost"):
+            self.registry, self.path = parts
+        else:
+            self.registry, self.path = None, path
+
+    @classmethod
+    def parse(cls, name):
+        """
+        Return (interned) ImageRef for image name
+
+        Args:
+            name (str): image name
+
+        Returns:
+            ImageRef
+        """
+        ref = cls._instances.get(name)
+        if ref is None:
+            ref = cls._instances.setdefault(name, cls(name))
+        return ref
+
+    def __reduce__(self):
+        return ImageRef.parse, (self.name,)
+
+    def __repr__(self):
+        return "ImageRef({!r})".format(self.name)
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def repository(self):
+        """
+        Repository name as used by Docker Registry API
+        (official Docker Hub images are in `library/`)
+        """
+        if self.registry is None and "/" not in self.path:
+            return "library/{}".format(self.path)
+        return self.path
+
+    @property
+    def reference(self):
+        """
+        Digest or tag of image (`latest` if none is given)
+        """
+        return self.digest or self.tag or "latest"
+
+    @property
+    def repository_name(self):
+        """
+        Image name without tag and digest
+        """
+        if self.registry is None:
+            return self.path
+        return "{}/{}".format(self.registry, self.path)
+
+    def split(self):
+        """
+        Split image name to registry, repository and reference.
+        Images without registry are from Docker Hub.
+
+        Returns:
+            tuple (registry, repository, reference)
+        """
+        return self.registry or DOCKER_HUB, self.repository, self.reference
+
+    def with_registry(self, registry):
+        """
+        Return image with registry replaced (or added if image doesn't have
+        any).
+
+        Args:
+            registry (str): new registry
+
+        Returns:
+            ImageRef
+        """
+        name = "{}/{}".format(registry, self.path)
+        if self.digest:
+            name = "{}@{}".format(name, self.digest)
+        elif self.tag:
+            name = "{}:{}".format(name, self.tag)
+        return ImageRef.parse(name)
+
+    @property
+    def internal(self):
+        """
+        True if image is in internal OpenShift registry
+        (see is_internal_registry)
+        """
+        return self.is_internal_registry(self.registry)
+
+    @classmethod
+    def set_internal_registries(cls, registries):
+        """
+        Configure hosts of internal OpenShift registries.
+
+        Args:
+            registries (list): registry hosts (host:port or just host for
+                               any port), if empty internal registries are
+                               guessed (see is_internal_registry)
+        """
+        with cls._lock:
+            cls._internal_registries = set(registries or []) or None
+            cls._internal_cache = {}
+
+    @classmethod
+    def is_internal_registry(cls, registry):
+        """
+        Check if registry is internal OpenShift registry. Result is
+        memoized for every registry.
+
+        If internal registries are configured (set_internal_registries),
+        only those registries are internal. Otherwise registry is
+        considered internal if it is private ip address or cluster service
+        hostname (eg. docker-registry.default.svc:5000).
+
+        Args:
+            registry (str): registry host (with port), None for Docker Hub
+
+        Returns:
+            bool
+        """
+        internal = cls._internal_cache.get(registry)
+        if internal is None:
+            internal = cls._classify(registry)
+            cls._internal_cache[registry] = internal
+        return internal
+
+    @classmethod
+    def _classify(cls, registry):
+        if registry is None:
+            return False
+        host = registry.rsplit(":", 1)[0] if ":" in registry else registry
+
+        if cls._internal_registries is not None:
+            return (registry in cls._internal_registries or
+                    host in cls._internal_registries)
+
+        if host.endswith(INTERNAL_REGISTRY_SUFFIXES):
+            return True
+        try:
+            return ipaddress.ip_address(u"{}".format(host)).is_private
+        except ValueError:
+            # host is not an ip address
+            return False
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import threading
+
+from openshift2nulecule import serializer
+
+logger = logging.getLogger(__name__)
+
+# steps of image export recorded in journal
+IMAGE_PULLED = "pulled"
+IMAGE_TAGGED = "tagged"
+IMAGE_EXPORTED = "exported"
+IMAGE_FAILED = "failed"
+
+
+class ExportJournal(object):
+    """
+    Journal of progress of export, so interrupted export can be resumed
+    instead of started again.
+
+    Journal is a file with one JSON object per line, every line is written
+    (and flushed) as soon as the step it records is completed:
+
+        {"event": "start", "projects": [...]}
+        {"event": "fetch", "project": ...}          fetching of project
+                                                    started
+        {"event": "object", "project": ..., "provider": ...,
+         "artifact": {...}}                         fetched object (before
+                                                    it is prepared)
+        {"event": "fetched", "project": ...}        all objects fetched
+        {"event": "image", "image": ..., "step": ..., "registry": ...,
+         "new_image": ..., "digest": ...}           image was pulled, tagged
+                                                    or exported (or its
+                                                    export failed)
+        {"event": "written", "project": ..., "path": ..., "hash": ...}
+                                                    artifact file written
+
+    When journal is resumed, projects that were fetched completely are read
+    from journal instead of OpenShift (so resumed export writes the same
+    application), images are exported only from the step after the last
+    completed one and artifacts that were written are not written again.
+    Incomplete last line (export killed while writing it) is ignored.
+    """
+
+    # path to journal file
+    path = None
+
+    def __init__(self, path, resume=False):
+        """
+        Args:
+            path (str): path to journal file
+            resume (bool): load journal of interrupted export and continue
+                           it, otherwise journal is started again
+        """
+        self.path = path
+        self.resume = resume
+        # projects of export
+        self.projects = None
+        # fetched objects of completely fetched projects, project: list of
+        # tuples (provider, artifact)
+        self.objects = {}
+        # last step of every image, original image: journal entry
+        self.images = {}
+        # written artifacts, project: {path: hash}
+        self.written = {}
+
+        self._file = None
+        self._lock = threading.Lock()
+        if resume:
+            self._load()
+
+    def _load(self):
+        """
+        Load journal of interrupted export
+        """
+        if not os.path.exists(self.path):
+            msg = "Nothing to resume, journal {} doesn't exist".format(
+                self.path)
+            logger.critical(msg)
+            raise Exception(msg)
+
+        # objects of projects that are being fetched
+        fetching = {}
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    entry = serializer.loads_json(line)
+                except ValueError:
+                    logger.debug("Ignoring incomplete line of journal")
+                    break
+                event = entry["event"]
+                if event == "start":
+                    self.projects = entry["projects"]
+                elif event == "fetch":
+                    fetching[entry["project"]] = []
+                    self.objects.pop(entry["project"], None)
+                elif event == "object":
+                    fetching[entry["project"]].append((entry["provider"],
+                                                       entry["artifact"]))
+                elif event == "fetched":
+                    self.objects[entry["project"]] = \
+                        fetching.pop(entry["project"])
+                elif event == "image":
+                    if entry["step"] == IMAGE_FAILED:
+                        # image is exported again from the beginning
+                        self.images.pop(entry["image"], None)
+                    else:
+                        self.images[entry["image"]] = entry
+                elif event == "written":
+                    self.written.setdefault(entry["project"], {})[
+                        entry["path"]] = entry["hash"]
+
+        logger.info("Resuming export from journal {}: {} project(s) "
+                    "fetched, {} image(s) exported, {} artifact(s) "
+                    "written".format(
+                        self.path, len(self.objects),
+                        sum(1 for entry in self.images.values()
+                            if entry["step"] == IMAGE_EXPORTED),
+                        sum(len(paths) for paths in self.written.values())))
+
+    def start(self, projects):
+        """
+        Open journal for writing. Resumed journal has to be journal of
+        export of the same projects.
+
+        Args:
+            projects (list): exported projects
+        """
+        projects = list(projects)
+        if self.resume:
+            if sorted(projects) != sorted(self.projects or []):
+                msg = "Journal {} is journal of export of projects {}, " \
+                      "not {}".format(self.path,
+                                      ", ".join(self.projects or []),
+                                      ", ".join(projects))
+                logger.critical(msg)
+                raise Exception(msg)
+            self._file = open(self.path, "ab")
+            return
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._file = open(self.path, "wb")
+        self.projects = projects
+        self._record(event="start", projects=projects)
+
+    def _record(self, **entry):
+        """
+        Append entry to journal
+        """
+        data = serializer.dumps_json(entry, indent=False)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(data + b"\n")
+            self._file.flush()
+
+    def fetched(self, project):
+        """
+        Return True if all objects of project are in journal
+        """
+        return project in self.objects
+
+    def fetch_started(self, project):
+        """
+        Record that fetching of project started (objects recorded before
+        are discarded)
+        """
+        self._record(event="fetch", project=project)
+
+    def add_object(self, project, provider, artifact):
+        """
+        Record fetched object
+        """
+        self._record(event="object", project=project, provider=provider,
+                     artifact=artifact)
+
+    def fetch_finished(self, project):
+        """
+        Record that all objects of project were fetched
+        """
+        self._record(event="fetched", project=project)
+
+    def image_step(self, image, registry):
+        """
+        Return last completed step of export of image to registry (None
+        if image wasn't exported to registry yet).
+
+        Returns:
+            tuple (step, entry)
+        """
+        entry = self.images.get(image)
+        if entry is None or entry.get("registry") != registry:
+            return None, None
+        return entry["step"], entry
+
+    def add_image_step(self, image, step, registry=None, new_image=None,
+                       digest=None):
+        """
+        Record completed step of image export
+
+        Args:
+            image (str): original image
+            step (str): IMAGE_PULLED, IMAGE_TAGGED, IMAGE_EXPORTED or
+                        IMAGE_FAILED
+            registry (str): registry where image is exported
+            new_image (str): new name of exported image
+            digest (str): digest of image in source registry
+        """
+        self._record(event="image", image=image, step=step,
+                     registry=registry, new_image=new_image, digest=digest)
+
+    def add_written(self, project, path, digest):
+        """
+        Record written artifact file (path relative to application root)
+        """
+        self._record(event="written", project=project, path=path,
+                     hash=digest)
+
+    def close(self):
+        """
+        Close journal, it is kept so export can be resumed
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        """
+        Close and remove journal (export finished)
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,14 +1,44 @@
 # -*- coding: utf-8 -*-
 
 import logging
-import anymarkup
+import copy
 import os
+import tempfile
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from subprocess import Popen, PIPE
 
-from openshift2nulecule import utils
-from openshift2nulecule.constants import NULECULE_PROVIDERS
+from openshift2nulecule import serializer, transforms, utils
+from openshift2nulecule.profiling import span
+from openshift2nulecule.docker_backend import DockerCliBackend
+from openshift2nulecule.image import ImageRef
+from openshift2nulecule.journal import (IMAGE_EXPORTED, IMAGE_FAILED,
+                                        IMAGE_PULLED, IMAGE_TAGGED)
+from openshift2nulecule.registry import SIZE_TIMEOUT, RegistryClient
+from openshift2nulecule.scheduler import TransferScheduler
+from openshift2nulecule.constants import (CLUSTER_METADATA,
+                                          NULECULE_PROVIDERS,
+                                          PROVIDER_RESOURCES,
+                                          RESOURCE_API_PATHS,
+                                          WATCH_TIMEOUT)
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    # python 2
+    from urllib import urlencode
 
 logger = logging.getLogger(__name__)
 
+# seconds between listings of watched objects if oc can't watch them (see
+# OpenshiftClient.watch)
+WATCH_POLL_INTERVAL = 10
+
+# timeout for listing metadata of one resource type when fingerprint is
+# computed (seconds, used if client doesn't have timeout)
+FINGERPRINT_TIMEOUT = 30
+
 
 class OpenshiftClient(object):
 
@@ -18,8 +48,22 @@ class OpenshiftClient(object):
     namespace = None
     oc_config = None
 
+    # ExportCache used for exported objects (None if cache is not used)
+    cache = None
+
+    # timeout for fetching one resource type (seconds, None for no timeout)
+    timeout = None
+
+    # number of retries of failed fetch of resource type
+    retries = 0
+
+    # True if changes can be watched since version of list (using raw API
+    # requests of oc), False if objects are listed periodically instead
+    # (None if not known yet, see watch)
+    can_watch = None
+
     def __init__(self, oc=None, namespace=None, oc_config=None,
-                 selector=None):
+                 selector=None, cache=None, timeout=None, retries=0):
         if oc:
             self.oc = oc
         else:
@@ -27,6 +71,9 @@ class OpenshiftClient(object):
 
         self.namespace = namespace
         self.selector = selector
+        self.cache = cache
+        self.timeout = timeout
+        self.retries = retries
 
         if oc_config:
             self.oc_config = utils.get_path(oc_config)
@@ -37,7 +84,7 @@ class OpenshiftClient(object):
         """
         ec, stdout, stderr = self._call_oc(["whoami"])
         if ec == 0:
-            return stdout
+            return stdout.decode("utf-8").strip()
         else:
             return None
 
@@ -47,10 +94,78 @@ class OpenshiftClient(object):
         """
         ec, stdout, stderr = self._call_oc(["whoami", "-t"])
         if ec == 0:
-            return stdout
+            return stdout.decode("utf-8").strip()
         else:
             return None
 
+    def get_projects(self, selector=None):
+        """
+        Return names of all projects accessible by current user
+
+        Args:
+            selector (str): label selector for projects
+
+        Returns:
+            list: project names (sorted)
+        """
+        args = ["get", "projects", "-o", "json"]
+        if selector:
+            args.extend(["-l", selector])
+        ec, stdout, stderr = self._call_oc(args)
+        projects = serializer.loads_json(stdout)
+        return sorted(project["metadata"]["name"]
+                      for project in projects.get("items") or [])
+
+    def cache_key(self):
+        """
+        Return identification of exported objects for cache.
+        Server and current namespace are read from oc config, cluster is
+        not contacted.
+
+        Returns:
+            tuple (server, namespace, selector)
+        """
+        ec, stdout, stderr = self._call_oc(["whoami", "--show-server"])
+        server = stdout.decode("utf-8").strip()
+        namespace = self.namespace
+        if not namespace:
+            ec, stdout, stderr = self._call_oc(["project", "-q"])
+            namespace = stdout.decode("utf-8").strip()
+        return server, namespace, self.selector
+
+    def fingerprint(self, resources):
+        """
+        Return fingerprint of current state of exported objects.
+        Fingerprint changes whenever any exported object is created,
+        modified or deleted.
+
+        `oc get` always transfers complete objects (even with jsonpath
+        output, which is applied by oc), so fingerprint would cost as much
+        as the export. Objects are listed through REST API instead (see
+        OpenshiftApiClient.fingerprint), using kubeconfig of oc, and only
+        their metadata is transferred.
+
+        Args:
+            resources (list): resource types to export
+
+        Returns:
+            str: fingerprint, None if REST API can't be used (eg. requests
+                 library is not installed or kubeconfig uses authentication
+                 that is not supported)
+        """
+        # api client is imported only when it is needed (it requires
+        # requests)
+        try:
+            from openshift2nulecule.api import OpenshiftApiClient
+            client = OpenshiftApiClient(
+                self.namespace, self.oc_config, self.selector,
+                timeout=self.timeout or FINGERPRINT_TIMEOUT)
+            return client.fingerprint(resources)
+        except Exception as e:
+            logger.debug("Can't get fingerprint through REST API: "
+                         "{}".format(e))
+            return None
+
     @staticmethod
     def _find_oc():
         """
@@ -74,19 +189,16 @@ class OpenshiftClient(object):
                      "binary using --oc argument".format(":".join(test_paths)))
         return None
 
-    def _call_oc(self, args):
+    def _oc_cmd(self, args):
         """
-        Runs a oc command with its arguments and returns the results.
+        Return full oc command with global options and its arguments
 
         Args:
             args (list): arguments for oc command
 
         Returns:
-            ec:     The exit code from the command
-            stdout: stdout from the command
-            stderr: stderr from the command
+            list: command
         """
-
         cmd = [self.oc]
         if self.oc_config:
             cmd.extend(["--config", self.oc_config])
@@ -94,8 +206,21 @@ class OpenshiftClient(object):
             cmd.extend(["--namespace", self.namespace])
 
         cmd.extend(args)
+        return cmd
 
-        ec, stdout, stderr = utils.run_cmd(cmd)
+    def _call_oc(self, args):
+        """
+        Runs a oc command with its arguments and returns the results.
+
+        Args:
+            args (list): arguments for oc command
+
+        Returns:
+            ec:     The exit code from the command
+            stdout: stdout from the command
+            stderr: stderr from the command
+        """
+        ec, stdout, stderr = utils.run_cmd(self._oc_cmd(args))
 
         return (ec, stdout, stderr)
 
@@ -103,95 +228,581 @@ class OpenshiftClient(object):
         """
         Export configuration from Openshift for various providers
 
+        All resources needed by all providers are exported using single
+        `oc export` call and then split to providers.
+
+        Returns:
+            ExportedProject with artifacts for all providers
+        """
+        all_artifacts = {provider: [] for provider in NULECULE_PROVIDERS}
+        for provider, artifact in self.iter_artifacts():
+            all_artifacts[provider].append(artifact)
+
+        for provider, artifacts in all_artifacts.items():
+            artifacts.sort(key=lambda artifact: utils.kind_order(
+                provider, artifact["kind"]))
+
+        ep = ExportedProject(artifacts=all_artifacts)
+
+        return ep
+
+    def iter_artifacts(self):
+        """
+        Export configuration from Openshift for various providers.
+        Artifacts are returned as soon as they are read from OpenShift, in
+        order in which they were exported (not sorted by provider).
+        Every provider gets its own copy of object, so artifacts can be
+        modified independently.
+
+        Yields:
+            tuples (provider, artifact)
+        """
+        for obj in self._iter_objects(self._resources()):
+            for provider, artifact in self.provider_artifacts(obj):
+                yield provider, artifact
+
+    @staticmethod
+    def provider_artifacts(obj):
+        """
+        Split object to artifacts of providers that use its kind.
+        First provider gets the object itself, others get copies.
+
+        Args:
+            obj (dict): exported object
+
         Returns:
-            A dict with keys as provider and value as artifacts corresponding
-            to that provider.
-        """
-        # Resources to export.
-        # Don't export Pods for now.
-        # Exporting ReplicationControllers should be enough.
-        # Ideally this should detect Pods that are not created by
-        # ReplicationController and only export those.
-        # Order in resource list is significant! Object are exported in same
-        # order as they are specified on command line and they will have same
-        # order in Nulecule file also.
-        # ImageStream is first as workaround for this https://github.com/openshift/origin/issues/4518
-        # But this workaround is going to work only after resolving
-        # https://github.com/projectatomic/atomicapp/issues/669
-        all_artifacts = {}
+            list of tuples (provider, artifact)
+        """
+        providers = [provider for provider in NULECULE_PROVIDERS
+                     if obj["kind"] in [utils.resource_kind(resource)
+                                        for resource in
+                                        PROVIDER_RESOURCES[provider]]]
+        artifacts = [obj] + [copy.deepcopy(obj) for _ in providers[1:]]
+        return list(zip(providers, artifacts))
+
+    @staticmethod
+    def _resources():
+        """
+        Return union of resources for all providers
+
+        Returns:
+            list: resource types to export
+        """
+        resources = []
         for provider in NULECULE_PROVIDERS:
-            if provider == "kubernetes":
-                resources = ["persistentVolumeClaim",
-                             "service",
-                             "replicationController"]
-            elif provider == "openshift":
-                resources = ["imageStream",
-                             "service",
-                             "persistentVolumeClaim",
-                             "replicationController",
-                             "deploymentConfig",
-                             "buildConfig"]
-
-            # output of this export is kind List
-            args = ["export", ",".join(resources), "-o", "json"]
-            # if user has specified the selector append it to command
+            for resource in PROVIDER_RESOURCES[provider]:
+                if resource not in resources:
+                    resources.append(resource)
+        return resources
+
+    def _iter_objects(self, resources):
+        """
+        Export resources, using cache if it is configured.
+
+        Args:
+            resources (list): resource types to export
+
+        Returns:
+            iterator of exported objects
+        """
+        if self.cache is None:
+            return self._iter_resources(resources)
+        return self.cache.iter_objects(self, resources)
+
+    def _iter_resources(self, resources):
+        """
+        Export resources from OpenShift.
+        Every resource type is fetched concurrently as separate request
+        (see _iter_resource), failed requests are retried. Objects are
+        returned in order of resources: objects of the first resource type
+        are returned as they arrive, other resource types are spooled to
+        temporary files while they are fetched (so memory doesn't grow
+        with size of project) and read from them when their turn comes.
+        The first resource type is retried only if it fails before its
+        first object is returned.
+
+        If iteration fails or is abandoned, fetches that are still running
+        are stopped (their commands are killed).
+
+        Args:
+            resources (list): resource types to export
+
+        Yields:
+            exported objects
+        """
+        stop = threading.Event()
+        pool = ThreadPool(max(len(resources) - 1, 1))
+        spools = []
+        try:
+            spools = [pool.apply_async(utils.retry,
+                                       (self._spool_resource,
+                                        (resource, stop), self.retries),
+                                       {"description": "Exporting {}".format(
+                                           resource), "stop": stop})
+                      for resource in resources[1:]]
+            if resources:
+                first, objects = utils.retry(
+                    self._start_resource, (resources[0], stop), self.retries,
+                    description="Exporting {}".format(resources[0]),
+                    stop=stop)
+                if first is not None:
+                    yield first
+                    for obj in objects:
+                        yield obj
+            for result in spools:
+                with result.get() as spool:
+                    for obj in utils.iter_list_items(spool, kind="List"):
+                        yield obj
+        finally:
+            # stop requests that are still running (their commands are
+            # killed) and remove spools that weren't read
+            stop.set()
+            pool.close()
+            pool.join()
+            for result in spools:
+                if result.successful():
+                    result.get().close()
+
+    def _start_resource(self, resource, stop):
+        """
+        Start export of resource type and return its first object (None if
+        there are no objects) and iterator of the other objects
+        """
+        objects = self._iter_resource(resource, stop)
+        for obj in objects:
+            return obj, objects
+        return None, iter([])
+
+    def _spool_resource(self, resource, stop):
+        """
+        Export all objects of one resource type to temporary file (runs in
+        fetching thread).
+
+        Returns:
+            file object with JSON document of kind List (at its beginning)
+        """
+        if stop.is_set():
+            raise Exception("Export of {} stopped".format(resource))
+        spool = tempfile.TemporaryFile()
+        try:
+            spool.write(b'{"kind": "List", "apiVersion": "v1", "items": [\n')
+            separator = b""
+            for obj in self._iter_resource(resource, stop):
+                spool.write(separator)
+                spool.write(serializer.dumps_json(obj, indent=False))
+                separator = b",\n"
+            spool.write(b"\n]}\n")
+            spool.seek(0)
+        except BaseException:
+            spool.close()
+            raise
+        return spool
+
+    def _iter_resource(self, resource, stop=None):
+        """
+        Export all objects of one resource type using `oc export`.
+        Objects are returned as oc prints them (see utils.iter_list_items).
+        Command is killed if it doesn't finish in `timeout` seconds.
+
+        Args:
+            resource (str): resource type (eg. deploymentConfig)
+            stop (threading.Event): export is stopped when event is set
+
+        Yields:
+            exported objects
+        """
+        # output of this export is kind List
+        args = ["export", resource, "-o", "json"]
+        # if user has specified the selector append it to command
+        if self.selector:
+            args.extend(["-l", self.selector])
+
+        with span("fetch resource", resource=resource,
+                  objects=0) as fetch_span:
+            try:
+                with utils.stream_cmd(self._oc_cmd(args), self.timeout,
+                                      stop) as stdout:
+                    for obj in utils.iter_list_items(stdout, kind="List"):
+                        fetch_span["objects"] += 1
+                        yield obj
+            except Exception as e:
+                # oc export fails if there is nothing to export
+                if fetch_span["objects"] or \
+                        "no resources found" not in str(e).lower():
+                    raise
+
+    @staticmethod
+    def _export_object(resource, obj):
+        """
+        Remove cluster specific information from object
+        (like `oc export` does).
+
+        Args:
+            resource (str): resource type of object
+            obj (dict): object from api
+
+        Returns:
+            dict: exported object
+        """
+        # items in list don't have kind and apiVersion
+        obj["kind"] = utils.resource_kind(resource)
+        obj["apiVersion"] = "v1"
+
+        metadata = obj.setdefault("metadata", {})
+        for key in CLUSTER_METADATA:
+            metadata.pop(key, None)
+        metadata["creationTimestamp"] = None
+
+        if "status" in obj:
+            obj["status"] = {}
+
+        if obj["kind"] == "Service":
+            # cluster ip is assigned by cluster (keep headless services)
+            spec = obj.get("spec") or {}
+            if spec.get("clusterIP") and spec["clusterIP"] != "None":
+                del spec["clusterIP"]
+
+        return obj
+
+    def watch(self, events, stop, resources=None):
+        """
+        Watch exported objects for changes.
+        Every resource type is watched in separate thread. Watch of every
+        resource type starts with list of all its objects (`SYNC` event)
+        followed by events for every change since the list. If watch fails
+        or expires, objects are listed again (another `SYNC` event), so no
+        change is lost.
+
+        Changes are watched with raw API watch requests of oc
+        (`oc get --raw`), which start at version of the list. If oc
+        doesn't support raw requests, objects are listed every
+        WATCH_POLL_INTERVAL seconds instead.
+
+        Events are put to queue as tuples (resource, event, object), event
+        is `ADDED`, `MODIFIED` or `DELETED` (object is exported object) or
+        `SYNC` (object is list of all exported objects of resource type).
+
+        Args:
+            events (Queue): queue for events
+            stop (threading.Event): watching stops when event is set
+            resources (list): resource types to watch (all exported types
+                              if None)
+        """
+        if self.can_watch is None:
+            self.can_watch = self._supports_raw()
+            if not self.can_watch:
+                logger.warning("oc doesn't support raw API requests (oc get "
+                               "--raw), changes are detected by listing "
+                               "objects every {}s".format(
+                                   WATCH_POLL_INTERVAL))
+        for resource in resources or self._resources():
+            thread = threading.Thread(target=self._watch_resource,
+                                      args=(resource, events, stop))
+            thread.daemon = True
+            thread.start()
+
+    def _supports_raw(self):
+        """
+        Return True if oc can send raw API requests (`oc get --raw`)
+        """
+        try:
+            ec, stdout, stderr = self._call_oc(["get", "--help"])
+        except Exception as e:
+            logger.debug("Can't get help of oc get: {}".format(e))
+            return False
+        return b"--raw" in stdout
+
+    def _watch_resource(self, resource, events, stop):
+        """
+        Watch one resource type and send its events to queue (runs in
+        watching thread).
+        """
+        delay = 1.0
+        while not stop.is_set():
+            try:
+                objects, version = self._watch_list(resource)
+                events.put((resource, "SYNC", objects))
+                delay = 1.0
+                if version is None:
+                    # changes can't be watched from version of list
+                    stop.wait(WATCH_POLL_INTERVAL)
+                    continue
+                while not stop.is_set():
+                    for event, obj, version in self._watch_events(
+                            resource, version, stop):
+                        events.put((resource, event, obj))
+            except Exception as e:
+                if stop.is_set():
+                    return
+                logger.warning("Watching {} failed, listing it again in {}s: "
+                               "{}".format(resource, delay, e))
+                stop.wait(delay)
+                delay = min(delay * 2, 60)
+
+    def _raw_uri(self, resource, params=None):
+        """
+        Return API uri of resource type in namespace (for `oc get --raw`)
+
+        Args:
+            resource (str): resource type (eg. deploymentConfig)
+            params (dict): query parameters
+
+        Returns:
+            str: uri
+        """
+        if not self.namespace:
+            ec, stdout, stderr = self._call_oc(["project", "-q"])
+            self.namespace = stdout.decode("utf-8").strip()
+        api, collection = RESOURCE_API_PATHS[resource]
+        params = dict(params or {})
+        if self.selector:
+            params["labelSelector"] = self.selector
+        uri = "/{}/namespaces/{}/{}".format(api, self.namespace, collection)
+        if params:
+            uri += "?" + urlencode(sorted(params.items()))
+        return uri
+
+    def _watch_list(self, resource):
+        """
+        List objects of resource type before watching it using
+        `oc get --raw` (or `oc get` if raw requests are not supported).
+        Objects are exported the same way as watched objects (see
+        _export_object), so object that didn't change is equal to its
+        previous version.
+
+        Args:
+            resource (str): resource type (eg. deploymentConfig)
+
+        Returns:
+            tuple (list of exported objects, version to watch from), version
+            is None if changes can't be watched
+        """
+        if self.can_watch:
+            args = ["get", "--raw", self._raw_uri(resource)]
+        else:
+            args = ["get", resource, "-o", "json"]
             if self.selector:
                 args.extend(["-l", self.selector])
 
-            ec, stdout, stderr = self._call_oc(args)
-            objects = anymarkup.parse(stdout, format="json", force_types=None)
+        with span("fetch resource", resource=resource) as fetch_span:
+            with utils.stream_cmd(self._oc_cmd(args),
+                                  self.timeout) as stdout:
+                objects = serializer.loads_json(stdout.read())
+            items = [self._export_object(resource, obj)
+                     for obj in objects.get("items") or []]
+            fetch_span["objects"] = len(items)
+        version = None
+        if self.can_watch:
+            version = (objects.get("metadata") or {}).get("resourceVersion")
+        return items, version
 
-            # convert OpenShift List to array
-            if objects["kind"] == "List":
-                artifacts = objects["items"]
-            else:
-                msg = "Output of `oc export` command is of diferent kind than 'List'"
-                logger.critical(msg)
-                raise Exception(msg)
+    def _watch_events(self, resource, version, stop):
+        """
+        Watch changes of one resource type since `version` using raw API
+        watch request of oc. Request is ended by server after WATCH_TIMEOUT
+        seconds. Objects are exported the same way as objects from REST API
+        (see _export_object).
 
-            all_artifacts[provider] = artifacts
+        Args:
+            resource (str): resource type (eg. deploymentConfig)
+            version (str): resourceVersion to watch from
+            stop (threading.Event): watch is stopped when event is set
 
-        ep = ExportedProject(artifacts=all_artifacts)
+        Yields:
+            tuples (event, exported object, resourceVersion of object)
+        """
+        uri = self._raw_uri(resource, {"watch": "true",
+                                       "resourceVersion": version,
+                                       "timeoutSeconds": WATCH_TIMEOUT})
+        cmd = self._oc_cmd(["get", "--raw", uri])
+        logger.debug("running cmd %s", cmd)
 
-        return ep
+        stderr = tempfile.TemporaryFile()
+        p = Popen(cmd, stdout=PIPE, stderr=stderr)
+        killer = threading.Thread(target=utils.kill_on_stop, args=(p, stop))
+        killer.daemon = True
+        killer.start()
+        try:
+            for event in utils.iter_json_values(p.stdout):
+                if stop.is_set():
+                    return
+                obj = event["object"]
+                if event["type"] == "ERROR":
+                    # eg. 410 Gone if version is too old
+                    raise Exception("Watch of {} failed: {}".format(
+                        resource, obj.get("message")))
+                version = obj["metadata"].get("resourceVersion")
+                yield (event["type"], self._export_object(resource, obj),
+                       version)
+            p.wait()
+        finally:
+            utils.kill_process(p)
+            p.stdout.close()
+            p.wait()
+            stderr.seek(0)
+            error = stderr.read().decode("utf-8", "replace")
+            stderr.close()
+        if p.returncode and not stop.is_set():
+            raise Exception("Watch of {} ended: {}".format(resource, error))
 
 
 class ExportedProject(object):
     artifacts = None
 
-    # all images from all artifacts, gets updated with every image operation
-    # like pull_images, push_images ...
+    # index of all images from all artifacts, key is original image name.
+    # Values are dicts with `image` (current name), `original_image`,
+    # `ref` (ImageRef of original image), `internal` and `references`.
+    # Values get updated with every image operation like pull_images,
+    # push_images ...
     images = None
 
-    def __init__(self, artifacts):
+    # backend used for image operations (see docker_backend)
+    docker = None
 
-        self.artifacts = artifacts
+    def __init__(self, artifacts=None, docker=None, registries=None):
+        """
+        Args:
+            artifacts (dict): artifacts of every provider to add
+            docker: backend used for image operations (see docker_backend)
+            registries (dict): registry clients to use, can be shared by
+                               more instances (see ExportSession)
+        """
+        if docker:
+            self.docker = docker
+        else:
+            self.docker = DockerCliBackend()
 
-        # get all images of all ReplicationControllers
-        self.images = []
-        for provider in NULECULE_PROVIDERS:
-            for artifact in self.artifacts[provider]:
-                # TODO: add support for other kinds (Pod, ....?)
-                if artifact["kind"] in ["ReplicationController",
-                                        "DeploymentConfig"]:
-                    self.images.extend(utils.get_image_info(artifact))
+        self.artifacts = {provider: [] for provider in NULECULE_PROVIDERS}
+        self.images = OrderedDict()
 
-        self._remove_imagestream_annotations()
-        self._remove_openshift_objects()
+        # registry clients (key is registry host and credentials)
+        if registries is None:
+            registries = {}
+        self._registries = registries
+        self._lock = threading.Lock()
 
-    def _remove_openshift_objects(self):
+        if artifacts:
+            for provider in NULECULE_PROVIDERS:
+                for artifact in artifacts[provider]:
+                    self.add_artifact(provider, artifact)
+
+    def add_artifact(self, provider, artifact):
         """
-        Remove objects from OpenShift artifacts that were created automaticaly by
-        other object.
-        eg.: Remove ReplicationControllers that were created by DeploymentConfig
+        Prepare artifact (see prepare_artifact), add it to artifacts of
+        provider and add its images to image index. Collecting images is
+        the last transform, so artifact is processed in one pass.
+
+        Args:
+            provider (str): provider of artifact
+            artifact (dict): OpenShift or Kubernetes object
+
+        Returns:
+            dict: prepared artifact, None if artifact was not added
+        """
+        return transforms.apply_transforms(
+            provider, artifact,
+            transforms.get_transforms() + [self._collect_artifact])
+
+    def index_artifact(self, provider, artifact):
+        """
+        Prepare artifact (see prepare_artifact) and add its images to image
+        index without keeping the artifact: it is not added to artifacts
+        of provider and its containers are not recorded in `references`
+        of images. Used when artifacts are written one by one, so memory
+        doesn't grow with size of project (see ExportPipeline).
+
+        Args:
+            provider (str): provider of artifact
+            artifact (dict): OpenShift or Kubernetes object
+
+        Returns:
+            dict: prepared artifact, None if artifact was removed
         """
-        for obj in list(self.artifacts["openshift"]):
-            if obj["kind"] == "ReplicationController":
-                # check if this RC has been created by DC by checking if
-                # openshift.io/deployment-config.name annotation exists
-                deployment_config_name = obj.get("metadata", {}).get("annotations",{}).get("openshift.io/deployment-config.name",{})
-                if deployment_config_name:
-                    self.artifacts["openshift"].remove(obj)
+        return transforms.apply_transforms(
+            provider, artifact,
+            transforms.get_transforms() + [self._index_artifact])
+
+    @staticmethod
+    def prepare_artifact(provider, artifact):
+        """
+        Prepare exported object to be used as Nulecule artifact by applying
+        registered transforms (see transforms module). By default objects
+        that were created automaticaly by other object are removed
+        (eg.: ReplicationControllers that were created by DeploymentConfig),
+        annotations are removed from ImageStreams and status and cluster
+        specific metadata are removed from all objects.
+
+        Args:
+            provider (str): provider of artifact
+            artifact (dict): OpenShift or Kubernetes object
+
+        Returns:
+            dict: prepared artifact, None if artifact should be removed
+        """
+        return transforms.apply_transforms(provider, artifact)
+
+    def _collect_artifact(self, provider, artifact):
+        """
+        Transform adding artifact to artifacts of provider and its images
+        to image index.
+        """
+        self.artifacts[provider].append(artifact)
+        self._add_images(provider, artifact)
+        return artifact
+
+    def _index_artifact(self, provider, artifact):
+        """
+        Transform adding images of artifact to image index (artifact is
+        not kept).
+        """
+        self._add_images(provider, artifact, keep_references=False)
+        return artifact
+
+    def _add_images(self, provider, artifact, keep_references=True):
+        """
+        Add images from all containers of artifact to image index.
+        Every image is in index only once, all containers that are using
+        image are recorded in its `references` list as tuples
+        (provider, artifact, container).
+
+        Args:
+            provider (str): provider of artifact
+            artifact (dict): OpenShift or Kubernetes object
+            keep_references (bool): record containers in `references`
+        """
+        for container in utils.get_containers(artifact):
+            image = container["image"]
+            image_info = self.images.get(image)
+            if image_info is None:
+                ref = ImageRef.parse(image)
+                image_info = {"image": image,
+                              "original_image": image,
+                              "ref": ref,
+                              "internal": ref.internal,
+                              "references": []}
+                self.images[image] = image_info
+            if keep_references:
+                image_info["references"].append((provider, artifact,
+                                                 container))
+
+    def merge_images(self, other):
+        """
+        Merge image index of other project to image index of this project.
+        Images used by both projects share one image info (it is replaced in
+        index of other project), so when image is exported through this
+        project, artifacts of other project get updated as well
+        (see update_artifacts_images).
+
+        Args:
+            other (ExportedProject): project whose images are merged
+        """
+        for original_image, image_info in other.images.items():
+            shared_info = self.images.get(original_image)
+            if shared_info is None:
+                self.images[original_image] = image_info
+            elif shared_info is not image_info:
+                shared_info["references"].extend(image_info["references"])
+                other.images[original_image] = shared_info
 
     def pull_images(self, registry, username, password, only_internal=True):
         """
@@ -210,25 +821,10 @@ class ExportedProject(object):
                      " login:{}:{})".format(only_internal, registry,
                                             username, password))
 
-        ec, stdout, stderr = utils.run_cmd(['docker', 'login',
-                                            '-u', username,
-                                            '-p', password,
-                                            '-e', "{}@{}".format(username,
-                                                                 registry),
-                                            registry])
-
-        for image_info in self.images:
-            if image_info["internal"]:
-                image_info["image"] = utils.replace_registry_host(
-                    image_info["image"], registry)
-            else:
-                if only_internal:
-                    # we are exporting only internal images, skip this
-                    continue
-            image = image_info["image"]
-            logger.info("Pulling image {}".format(image))
+        self._login(registry, username, password)
 
-            ec, stdout, stderr = utils.run_cmd(['docker', 'pull', image])
+        for image_info in self._images_to_export(only_internal):
+            self._pull_image(image_info, registry)
 
     def push_images(self, registry, username, password, only_internal=True):
         """
@@ -249,72 +845,474 @@ class ExportedProject(object):
                                                        username, password))
 
         if username and password:
-            ec, stdout, stderr = utils.run_cmd(['docker', 'login',
-                                                '-u', username,
-                                                '-p', password,
-                                                '-e', "{}@{}".format(username,
-                                                                     registry),
-                                                registry])
+            self._login(registry, username, password)
 
-        for image_info in self.images:
-            if only_internal and not image_info["internal"]:
-                # skip this image
-                continue
-            image = image_info["image"]
+        for image_info in self._images_to_export(only_internal):
+            self._push_image(image_info, registry)
 
-            # new name of image (only replace registry part)
-            name_new_registry = utils.replace_registry_host(image, registry)
+    def export_images(self, oc_registry, oc_username, oc_password,
+                      registry=None, username=None, password=None,
+                      only_internal=True, jobs=1, known_images=None,
+                      direct=False, throttle=None):
+        """
+        Pull images from OpenShift and push them to registry.
+        Every image is processed as separate pipeline (pull, tag, push),
+        up to `jobs` images are processed concurrently.
+        Failure of one image doesn't stop processing of other images.
 
-            (new_name, new_name_tag, new_name_digest) = utils.parse_image_name(
-                name_new_registry)
+        If more images are processed concurrently, size of every image is
+        looked up in source registry first and the largest images are
+        transferred first (see TransferScheduler).
+        Bytes transferred and throughput of every image are logged at the
+        end.
 
-            if new_name_digest:
-                # if this is image with define digest, use digest as tag
-                # docker cannot push image without tag, and if images
-                # is pulled with digest it doesn't have tag specified
+        If `direct` is True, images are copied directly from registry to
+        registry (without local Docker daemon), blobs that are already in
+        target registry are not copied.
 
-                # if this is going to be used as tag, it cannot contain ':'
-                tag = new_name_digest.replace(":", "")
-            else:
-                tag = new_name_tag
+        If `known_images` are given (images exported by previous run), digest
+        of every image is checked in source registry first and images that
+        were already exported to the same registry with the same digest are
+        not transferred again. Digest is stored in image info as `digest`.
 
-            new_full_name = "{}:{}".format(new_name, tag)
-            image_info["image"] = new_full_name
+        Args:
+            oc_registry (str): url of exposed OpenShift Docker registry
+            oc_username (str): username for OpenShift Docker registry
+            oc_password (str): password for OpenShift Docker registry
+            registry (str): url of registry where images are pushed,
+                            if None images are only pulled
+            username (str): username for docker registry. If None
+                            (don't autheticate to registry)
+            password (str): password for docker registry
+            only_internal (bool): if True only images that are in internal
+                                  OpenShift Docker registry, otherwise
+                                  exports all images (default is True)
+            jobs (int): number of images processed concurrently
+            known_images (dict): images exported by previous run, key is
+                                 original image, value is dict with `digest`,
+                                 `image` (new name) and `registry`
+            direct (bool): copy images directly between registries,
+                           requires `registry`
+            throttle (Throttle): bandwidth limit of all transfers (only
+                                 direct copies can be throttled)
+
+        Returns:
+            list of tuples (image, error) for images that failed to export
+        """
+        logger.debug("Exporting images (only_internal: {}, oc_registry: {}, "
+                     "registry: {}, jobs: {})".format(only_internal,
+                                                      oc_registry, registry,
+                                                      jobs))
+
+        transfer = self.image_exporter(oc_registry, oc_username, oc_password,
+                                       registry, username, password,
+                                       known_images, direct, throttle)
+
+        failed = []
+
+        def collect(result):
+            image, error = result
+            if error:
+                logger.error("Exporting image {} failed: {}".format(
+                    image, error))
+                failed.append((image, error))
+
+        def image_size(image_info):
+            return self.image_size(image_info, oc_registry, oc_username,
+                                   oc_password)
+
+        scheduler = TransferScheduler(transfer, image_size, jobs, collect)
+        try:
+            for image_info in self._images_to_export(only_internal):
+                scheduler.add(image_info)
+        except BaseException:
+            scheduler.terminate()
+            raise
+        finally:
+            scheduler.close()
+            scheduler.join()
+
+        scheduler.report()
+        return failed
+
+    def image_exporter(self, oc_registry, oc_username, oc_password,
+                       registry=None, username=None, password=None,
+                       known_images=None, direct=False, throttle=None,
+                       journal=None):
+        """
+        Login to registries and return function that exports one image
+        (see export_images for description of other arguments).
+
+        Returned function takes image info from image index, updates it
+        with new image name and returns tuple (image, error), error is None
+        if image was exported. It can be called from more threads.
+        Number of bytes transferred is stored in image info as `bytes`.
+
+        Only direct copies are throttled (as blobs are uploaded), transfers
+        done by Docker daemon can't be throttled.
+
+        With `journal` every completed step (pull, tag, export) is recorded
+        in it. Images exported by interrupted export (see
+        ExportJournal.resume) are not exported again and images that were
+        pulled or tagged by it are only tagged and pushed.
+
+        Args:
+            journal (ExportJournal): journal of export
+
+        Returns:
+            function
+        """
+        if direct and not registry:
+            msg = "Registry is required to copy images between registries"
+            logger.critical(msg)
+            raise Exception(msg)
+
+        if not direct:
+            self._login(oc_registry, oc_username, oc_password)
+            if registry and username and password:
+                self._login(registry, username, password)
+
+        def transfer(image_info):
+            original = image_info["original_image"]
+            step, entry = None, None
+            if journal is not None:
+                step, entry = journal.image_step(original, registry)
+            # True if pull of image is recorded in journal
+            pulled = step in (IMAGE_PULLED, IMAGE_TAGGED)
+            if step == IMAGE_EXPORTED:
+                logger.info("Image {} was exported by interrupted export, "
+                            "skipping".format(original))
+                image_info["image"] = entry["new_image"]
+                image_info["digest"] = entry["digest"]
+                image_info["bytes"] = 0
+                return original, None
+
+            try:
+                if known_images is not None:
+                    image_info["digest"] = self._source_digest(
+                        image_info, oc_registry, oc_username, oc_password)
+                    known = known_images.get(image_info["original_image"])
+                    if (known and image_info["digest"] and
+                            known.get("registry") == registry and
+                            known.get("digest") == image_info["digest"]):
+                        logger.info("Image {} has not changed since last "
+                                    "export, skipping".format(
+                                        image_info["original_image"]))
+                        image_info["image"] = known["image"]
+                        image_info["bytes"] = 0
+                        return image_info["original_image"], None
 
-            logger.info("Tagging image {} as {}".format(image, new_full_name))
+                if direct:
+                    self._copy_image(image_info, oc_registry, oc_username,
+                                     oc_password, registry, username,
+                                     password, throttle)
+                elif step in (IMAGE_PULLED, IMAGE_TAGGED):
+                    logger.info("Image {} was pulled by interrupted export, "
+                                "skipping pull".format(original))
+                    image_info["image"] = self._source_image(
+                        image_info, oc_registry).name
+                    image_info["bytes"] = 0
+                    if registry:
+                        self._push_image(image_info, registry, journal,
+                                         step == IMAGE_TAGGED)
+                else:
+                    # Docker doesn't report how much it pulled, size of
+                    # image is the best estimate
+                    image_info["bytes"] = image_info.get("size") or 0
+                    self._pull_image(image_info, oc_registry)
+                    if journal is not None:
+                        journal.add_image_step(original, IMAGE_PULLED,
+                                               registry)
+                        pulled = True
+                    if registry:
+                        self._push_image(image_info, registry, journal)
+            except Exception as e:
+                if pulled:
+                    # pulled image could be gone from Docker before export
+                    # is resumed, so it is exported from the beginning
+                    # next time
+                    journal.add_image_step(original, IMAGE_FAILED, registry)
+                # artifacts have to keep reference to the original image
+                image_info["image"] = image_info["original_image"]
+                return original, e
+            if journal is not None:
+                journal.add_image_step(original, IMAGE_EXPORTED, registry,
+                                       image_info["image"],
+                                       image_info.get("digest"))
+            return original, None
 
-            ec, stdout, stderr = utils.run_cmd(['docker', 'tag', '-f', image,
-                                                new_full_name])
+        return transfer
 
-            logger.info("Pushing image {}".format(new_full_name))
-            ec, stdout, stderr = utils.run_cmd(['docker', 'push', new_full_name])
+    def _source_digest(self, image_info, oc_registry, oc_username,
+                       oc_password):
+        """
+        Get digest of image in registry that image is exported from.
+
+        Args:
+            image_info (dict): image
+            oc_registry (str): url of exposed OpenShift Docker registry
+            oc_username (str): username for OpenShift Docker registry
+            oc_password (str): password for OpenShift Docker registry
+
+        Returns:
+            str: digest of image, None if digest can't be determined
+        """
+        ref = self._source_image(image_info, oc_registry)
+        host, repository, reference = ref.split()
+        if ref.digest:
+            return ref.digest
+
+        client = self._source_client(image_info, host, oc_username,
+                                     oc_password)
+        try:
+            with span("image digest", image=ref.name):
+                return client.get_manifest_digest(repository, reference)
+        except Exception as e:
+            logger.debug("Can't get digest of {}: {}".format(ref, e))
+            return None
+
+    def image_size(self, image_info, oc_registry, oc_username, oc_password):
+        """
+        Get size of image (sum of its compressed layers and config) from
+        manifest in registry that image is exported from. Requests time out
+        after SIZE_TIMEOUT seconds.
+
+        Args:
+            image_info (dict): image
+            oc_registry (str): url of exposed OpenShift Docker registry
+            oc_username (str): username for OpenShift Docker registry
+            oc_password (str): password for OpenShift Docker registry
+
+        Returns:
+            int: size of image in bytes, None if size can't be determined
+        """
+        ref = self._source_image(image_info, oc_registry)
+        host, repository, reference = ref.split()
+        client = self._source_client(image_info, host, oc_username,
+                                     oc_password)
+        try:
+            with span("image size", image=ref.name) as size_span:
+                size_span["bytes"] = client.get_image_size(repository,
+                                                           reference,
+                                                           SIZE_TIMEOUT)
+                return size_span["bytes"]
+        except Exception as e:
+            logger.debug("Can't get size of {}: {}".format(ref, e))
+            return None
+
+    def _source_client(self, image_info, host, oc_username, oc_password):
+        """
+        Return client for registry that image is exported from, credentials
+        are used only for internal OpenShift registry.
+
+        Args:
+            image_info (dict): image
+            host (str): registry host
+            oc_username (str): username for OpenShift Docker registry
+            oc_password (str): password for OpenShift Docker registry
+
+        Returns:
+            RegistryClient
+        """
+        if image_info["internal"]:
+            return self._registry_client(host, oc_username, oc_password)
+        return self._registry_client(host)
+
+    @staticmethod
+    def _source_image(image_info, oc_registry):
+        """
+        Return image that is exported. Images from internal OpenShift
+        registry are exported using exposed registry url.
+
+        Args:
+            image_info (dict): image
+            oc_registry (str): url of exposed OpenShift Docker registry
+
+        Returns:
+            ImageRef
+        """
+        if image_info["internal"]:
+            return image_info["ref"].with_registry(oc_registry)
+        return image_info["ref"]
+
+    def _registry_client(self, host, username=None, password=None):
+        """
+        Return client for registry. One client is created for every
+        registry host (and credentials) and reused.
+
+        Args:
+            host (str): registry host
+            username (str): username for registry
+            password (str): password for registry
+
+        Returns:
+            RegistryClient
+        """
+        with self._lock:
+            key = (host, username, password)
+            if key not in self._registries:
+                # dict can be shared with other instances, setdefault keeps
+                # client created first
+                self._registries.setdefault(
+                    key, RegistryClient(host, username, password))
+            return self._registries[key]
+
+    def _images_to_export(self, only_internal=True):
+        """
+        Return images that should be exported
+
+        Args:
+            only_internal (bool): if True return only images that are in
+                                  internal OpenShift Docker registry
+
+        Returns:
+            list of image info dicts
+        """
+        return [image_info for image_info in self.images.values()
+                if image_info["internal"] or not only_internal]
+
+    def _login(self, registry, username, password):
+        """
+        Login to docker registry
+
+        Args:
+            registry (str): url of registry
+            username (str): username for docker registry
+            password (str): password for docker registry
+        """
+        self.docker.login(registry, username, password)
+
+    def _pull_image(self, image_info, registry):
+        """
+        Pull image. If image is from internal OpenShift registry it is
+        pulled using exposed registry url.
+
+        Args:
+            image_info (dict): image to pull (gets updated with new name)
+            registry (str): url of exposed OpenShift Docker registry
+        """
+        image = self._source_image(image_info, registry).name
+        image_info["image"] = image
+        logger.info("Pulling image {}".format(image))
+
+        with span("pull image", image=image):
+            self.docker.pull(image)
+
+    def _push_image(self, image_info, registry, journal=None,
+                    tagged=False):
+        """
+        Tag image with new registry and push it there.
+
+        Args:
+            image_info (dict): image to push (gets updated with new name)
+            registry (str): url of registry
+            journal (ExportJournal): journal where tagging is recorded
+            tagged (bool): image is already tagged, only push it
+        """
+        image = image_info["image"]
+        new_full_name = self._target_name(image, registry)
+
+        if not tagged:
+            logger.info("Tagging image {} as {}".format(image,
+                                                        new_full_name))
+            with span("tag image", image=new_full_name):
+                self.docker.tag(image, new_full_name)
+            if journal is not None:
+                journal.add_image_step(image_info["original_image"],
+                                       IMAGE_TAGGED, registry)
+
+        logger.info("Pushing image {}".format(new_full_name))
+        with span("push image", image=new_full_name):
+            self.docker.push(new_full_name)
+
+        image_info["image"] = new_full_name
+
+    @staticmethod
+    def _target_name(image, registry):
+        """
+        Return name of image in registry where it is exported.
+        Images with digest get digest as tag, docker cannot push image
+        without tag.
+
+        Args:
+            image (str): image name
+            registry (str): url of registry
+
+        Returns:
+            str: new image name (with tag)
+        """
+        # new name of image (only replace registry part)
+        ref = ImageRef.parse(image).with_registry(registry)
+
+        if ref.digest:
+            # if this is image with define digest, use digest as tag
+            # docker cannot push image without tag, and if images
+            # is pulled with digest it doesn't have tag specified
+
+            # if this is going to be used as tag, it cannot contain ':'
+            tag = ref.digest.replace(":", "")
+        else:
+            tag = ref.tag or "latest"
+
+        return "{}:{}".format(ref.repository_name, tag)
+
+    def _copy_image(self, image_info, oc_registry, oc_username, oc_password,
+                    registry, username, password, throttle=None):
+        """
+        Copy image directly from source registry to registry (without
+        Docker daemon).
+
+        Args:
+            image_info (dict): image to copy (gets updated with new name)
+            oc_registry (str): url of exposed OpenShift Docker registry
+            oc_username (str): username for OpenShift Docker registry
+            oc_password (str): password for OpenShift Docker registry
+            registry (str): url of registry
+            username (str): username for registry
+            password (str): password for registry
+            throttle (Throttle): bandwidth limit of blob uploads
+        """
+        ref = self._source_image(image_info, oc_registry)
+        host, repository, reference = ref.split()
+        source = self._source_client(image_info, host, oc_username,
+                                     oc_password)
+        new_full_name = self._target_name(ref.name, registry)
+        target = self._registry_client(registry, username, password)
+
+        logger.info("Copying image {} to {}".format(ref, new_full_name))
+        new_host, new_repository, new_reference = \
+            ImageRef.parse(new_full_name).split()
+        with span("copy image", image=new_full_name) as copy_span:
+            copied = source.copy_image(repository, reference, target,
+                                       new_repository, new_reference,
+                                       throttle)
+            copy_span["bytes"] = copied
+        image_info["bytes"] = copied
+        logger.info("Image {} copied ({} bytes uploaded)".format(
+            new_full_name, copied))
+
+        image_info["image"] = new_full_name
 
     def update_artifacts_images(self):
         """
         Update artifact images. When pulling and pushing images
         are renamed (retagged). This updates image names in
-        all artifacts.
+        all artifacts (all containers and BuildConfig outputs).
         """
+        # mapping from original image name to new name
+        new_images = {original_image: image_info["image"]
+                      for original_image, image_info in self.images.items()
+                      if image_info["image"] != original_image}
+        if not new_images:
+            return
+
         for provider in NULECULE_PROVIDERS:
             for artifact in self.artifacts[provider]:
-                # TODO: add support for other kinds (Pod, ...?)
-                if artifact["kind"] in ["ReplicationController", "DeploymentConfig"]:
-                    for container in \
-                            artifact["spec"]["template"]["spec"]["containers"]:
-                        for image in self.images:
-                            if container["image"] == image["original_image"]:
-                                logger.info("Updating image {} for artifact {}:{}"
-                                            .format(container["image"],
-                                                    artifact["kind"],
-                                                    artifact["metadata"]["name"]))
-                                container["image"] = image["image"]
-
-    def _remove_imagestream_annotations(self):
-        """
-        Remove annotations from all imageStreams.
-        This is temporary workaround for https://github.com/openshift/origin/issues/8327
-        """
-        for obj in self.artifacts["openshift"]:
-            if obj["kind"] == "ImageStream":
-                if obj.get("metadata", {}).get("annotations", {}):
-                    del obj["metadata"]["annotations"]
+                for obj, key in utils.get_image_references(artifact):
+                    new_image = new_images.get(obj[key])
+                    if new_image:
+                        logger.info("Updating image {} for artifact {}:{}"
+                                    .format(obj[key],
+                                            artifact["kind"],
+                                            artifact["metadata"].get("name")))
+                        obj[key] = new_image
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Partitioning of objects of one project into more Nulecule applications.
+Project is fetched only once and label selectors are evaluated locally
+against `metadata.labels` of fetched objects.
+"""
+
+import copy
+import logging
+import re
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_KEY = r"[A-Za-z0-9][-A-Za-z0-9_./]*"
+# label value: empty or at most 63 characters that start and end with
+# alphanumeric character (values like `..` can't be names of directories)
+_VALUE = r"(?:[A-Za-z0-9](?:[-A-Za-z0-9_.]{0,61}[A-Za-z0-9])?)?"
+_EXISTS_RE = re.compile(r"^({})$".format(_KEY))
+_NOT_EXISTS_RE = re.compile(r"^!\s*({})$".format(_KEY))
+_EQUALITY_RE = re.compile(r"^({})\s*(==|=|!=)\s*({})$".format(_KEY, _VALUE))
+_SET_RE = re.compile(r"^({})\s+(in|notin)\s+\((.*)\)$".format(_KEY))
+
+
+class Selector(object):
+    """
+    Label selector (same syntax as `oc get -l`): comma separated
+    requirements `key=value`, `key==value`, `key!=value`, `key`, `!key`,
+    `key in (value1,value2)` and `key notin (value1,value2)`. Object matches
+    selector if it matches all requirements.
+    """
+
+    # selector as written by user
+    selector = None
+
+    # list of tuples (key, operator, set of values)
+    requirements = None
+
+    def __init__(self, selector):
+        """
+        Args:
+            selector (str): label selector
+
+        Raises:
+            ValueError: selector is invalid
+        """
+        self.selector = selector
+        self.requirements = [self._parse_requirement(requirement)
+                             for requirement in self._split(selector)]
+
+    @staticmethod
+    def _split(selector):
+        """
+        Split selector to requirements (commas in value sets don't split)
+        """
+        requirements = []
+        depth = 0
+        start = 0
+        for index, char in enumerate(selector):
+            if char == "(":
+                depth += 1
+            elif char == ")":
+                depth -= 1
+            elif char == "," and depth == 0:
+                requirements.append(selector[start:index])
+                start = index + 1
+        requirements.append(selector[start:])
+        return requirements
+
+    def _parse_requirement(self, requirement):
+        """
+        Return requirement as tuple (key, operator, set of values)
+        """
+        requirement = requirement.strip()
+        match = _EXISTS_RE.match(requirement)
+        if match:
+            return match.group(1), "exists", set()
+        match = _NOT_EXISTS_RE.match(requirement)
+        if match:
+            return match.group(1), "!", set()
+        match = _EQUALITY_RE.match(requirement)
+        if match:
+            operator = "!=" if match.group(2) == "!=" else "="
+            return match.group(1), operator, set([match.group(3)])
+        match = _SET_RE.match(requirement)
+        if match:
+            values = set(value.strip() for value in match.group(3).split(","))
+            if all(re.match(r"^{}$".format(_VALUE), value)
+                   for value in values):
+                return match.group(1), match.group(2), values
+        raise ValueError("Invalid label selector {}: can't parse "
+                         "'{}'".format(self.selector, requirement))
+
+    def matches(self, labels):
+        """
+        Return True if labels match selector
+
+        Args:
+            labels (dict): labels of object (None if object has no labels)
+
+        Returns:
+            bool
+        """
+        labels = labels or {}
+        for key, operator, values in self.requirements:
+            if operator == "exists":
+                matched = key in labels
+            elif operator == "!":
+                matched = key not in labels
+            elif operator in ("=", "in"):
+                matched = key in labels and labels[key] in values
+            else:
+                # != and notin match objects without the label too
+                matched = labels.get(key) not in values
+            if not matched:
+                return False
+        return True
+
+    def name(self):
+        """
+        Return name of application selected by selector: value of
+        selector `key=value`, otherwise selector with characters that
+        can't be used in application name replaced by `-`.
+
+        Returns:
+            str
+
+        Raises:
+            ValueError: selector doesn't give valid application name
+        """
+        name = None
+        if len(self.requirements) == 1:
+            key, operator, values = self.requirements[0]
+            if operator == "=" and list(values)[0]:
+                name = list(values)[0]
+        if name is None:
+            name = re.sub(r"[^-A-Za-z0-9_.]+", "-", self.selector).strip("-")
+        # application is written to directory with this name
+        if name in ("", ".", ".."):
+            raise ValueError("Label selector {} doesn't give valid "
+                             "application name".format(self.selector))
+        return name
+
+
+class PartitionClient(object):
+    """
+    Client that returns objects partitioned from objects fetched by other
+    client (it can be used instead of OpenshiftClient in ExportPipeline).
+    """
+
+    def __init__(self, artifacts):
+        """
+        Args:
+            artifacts (list): list of tuples (provider, artifact)
+        """
+        self.artifacts = artifacts
+
+    def iter_artifacts(self):
+        """
+        Yield partitioned objects
+
+        Yields:
+            tuple (provider, artifact)
+        """
+        for provider, artifact in self.artifacts:
+            yield provider, artifact
+
+
+def _labels(artifact):
+    return artifact.get("metadata", {}).get("labels")
+
+
+def partition_by_selectors(artifacts, selectors):
+    """
+    Partition objects by label selectors, object is added to every
+    partition whose selector it matches. Objects that don't match any
+    selector are dropped.
+
+    Args:
+        artifacts: iterable of tuples (provider, artifact)
+        selectors (list): list of Selector
+
+    Returns:
+        OrderedDict: name of application (see Selector.name): list of
+                     tuples (provider, artifact), in order of selectors
+    """
+    names = [selector.name() for selector in selectors]
+    partitions = OrderedDict((name, []) for name in names)
+    for provider, artifact in artifacts:
+        labels = _labels(artifact)
+        matched = [name for name, selector in zip(names, selectors)
+                   if selector.matches(labels)]
+        for index, name in enumerate(matched):
+            if index:
+                # object is changed when it is exported, every application
+                # gets its own copy
+                artifact = copy.deepcopy(artifact)
+            partitions[name].append((provider, artifact))
+    return partitions
+
+
+def partition_by_label(artifacts, key):
+    """
+    Partition objects by value of label, one partition is created for
+    every value. Objects without the label (or with empty value) are
+    dropped.
+
+    Args:
+        artifacts: iterable of tuples (provider, artifact)
+        key (str): label key
+
+    Returns:
+        OrderedDict: label value: list of tuples (provider, artifact), in
+                     order in which values were found
+    """
+    partitions = OrderedDict()
+    dropped = 0
+    for provider, artifact in artifacts:
+        value = (_labels(artifact) or {}).get(key)
+        if not value:
+            dropped += 1
+            continue
+        partitions.setdefault(value, []).append((provider, artifact))
+    if dropped:
+        logger.warning("{} object(s) without label {} are not exported".format(
+            dropped, key))
+    return partitions
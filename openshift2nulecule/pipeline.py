@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import sys
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+
+try:
+    from queue import Queue
+except ImportError:
+    # python 2
+    from Queue import Queue
+
+from openshift2nulecule import serializer, utils
+from openshift2nulecule.profiling import span
+from openshift2nulecule.scheduler import TransferScheduler
+
+logger = logging.getLogger(__name__)
+
+# state of image in pipeline
+IMAGE_PENDING = "pending"
+IMAGE_DONE = "done"
+
+
+def json_listener(stream=None):
+    """
+    Return progress listener that writes every event as one line of JSON
+
+    Args:
+        stream: file object events are written to (default stderr)
+
+    Returns:
+        function
+    """
+    stream = stream or sys.stderr
+
+    def listener(event):
+        stream.write(serializer.dumps_json(event, indent=False,
+                                           sort_keys=True).decode("utf-8") +
+                     "\n")
+        stream.flush()
+
+    return listener
+
+
+class ExportPipeline(object):
+    """
+    Export of projects with images in which fetching objects, transferring
+    images and writing artifacts overlap.
+
+    Objects of every project are fetched in separate thread. As soon as
+    an object is fetched, its new images are queued for transfer (up to
+    `jobs` images are transferred concurrently) and the object is written
+    as soon as all images it references are transferred (objects without
+    images are written right away). Nothing waits for the whole project
+    to be fetched or for all images to be transferred.
+
+    All bookkeeping and writing is done by one coordinating thread (the one
+    calling run), other threads only send events to it through a queue, so
+    writers and image index are never used concurrently. Image index keeps
+    only image info of every image, an artifact is kept only until it is
+    written, so memory doesn't grow with the number of fetched objects.
+    Images are transferred by TransferScheduler, if `image_size` is given
+    the largest waiting image is transferred first.
+    Writers get every artifact reserved in order it was fetched (see
+    BaseWriter.reserve_artifact), so written application is the same as if
+    stages were run one after another.
+
+    Progress is reported to listeners as events (dicts with `event`,
+    `time`, event specific fields and counters of the whole export).
+
+    If journal is given, fetched objects are recorded in it and projects
+    that were fetched by interrupted export are read from it instead of
+    OpenShift (see ExportJournal).
+    """
+
+    def __init__(self, projects, images, export_image, registry=None,
+                 only_internal=True, jobs=1, listeners=None,
+                 image_size=None, journal=None):
+        """
+        Args:
+            projects (OrderedDict): project name: tuple (client, writer)
+            images (ExportedProject): shared image index (its images are
+                                      filled by pipeline, artifacts are not
+                                      kept in it)
+            export_image: function exporting one image (see
+                          ExportedProject.image_exporter), None if images
+                          are not exported
+            registry (str): registry where images are pushed (recorded in
+                            manifest of every project)
+            only_internal (bool): export only images from internal OpenShift
+                                  registry
+            jobs (int): number of images transferred concurrently (and
+                        number of projects fetched concurrently)
+            listeners (list): functions called with every progress event
+            image_size: function returning size of image in bytes (see
+                        ExportedProject.image_size), if None images are
+                        transferred in order they were found
+            journal (ExportJournal): journal of export
+        """
+        self.projects = projects
+        self.images = images
+        self.export_image = export_image
+        self.registry = registry
+        self.only_internal = only_internal
+        self.jobs = max(jobs, 1)
+        self.listeners = listeners or []
+        self.image_size = image_size
+        self.journal = journal
+
+        self._queue = Queue()
+        # state of every image seen so far (IMAGE_PENDING or IMAGE_DONE)
+        self._image_state = {}
+        # artifacts waiting for image (original image: list of entries)
+        self._waiting = {}
+        # artifacts referencing unknown images, they wait until all
+        # projects are fetched (image can be used by later object)
+        self._deferred = []
+        # original images used by containers of every project
+        self._project_images = {project: set() for project in projects}
+        self._failed = []
+        self._scheduler = None
+        self._fetching = 0
+        self._transferring = 0
+        self._start = None
+        self.counters = {"objects": 0,
+                         "written": 0,
+                         "images": 0,
+                         "images_done": 0,
+                         "images_failed": 0}
+
+    def run(self):
+        """
+        Run export, write and close writers of all projects
+
+        Returns:
+            list of tuples (image, error) for images that failed to export
+        """
+        self._start = time.time()
+        fetch_pool = ThreadPool(min(self.jobs, len(self.projects)))
+        self._scheduler = TransferScheduler(self._transfer, self.image_size,
+                                            self.jobs, self._transferred)
+        try:
+            for project in self.projects:
+                fetch_pool.apply_async(self._fetch, (project,))
+                self._fetching += 1
+
+            while self._fetching or self._transferring:
+                event = self._queue.get()
+                getattr(self, "_on_" + event[0])(*event[1:])
+        except BaseException:
+            fetch_pool.terminate()
+            self._scheduler.terminate()
+            raise
+        else:
+            fetch_pool.close()
+            self._scheduler.close()
+        fetch_pool.join()
+        self._scheduler.join()
+        self._scheduler.report()
+
+        for project, (client, writer) in self.projects.items():
+            self._close_writer(project, writer)
+        return self._failed
+
+    def _emit(self, event, **data):
+        """
+        Send progress event to listeners
+        """
+        data["event"] = event
+        data["time"] = round(time.time() - self._start, 3)
+        data.update(self.counters)
+        for listener in self.listeners:
+            listener(data)
+
+    def _fetch(self, project):
+        """
+        Fetch objects of project and send them to coordinating thread
+        (runs in fetching thread).
+        """
+        client, writer = self.projects[project]
+        journal = self.journal
+        try:
+            with span("fetch project", project=project,
+                      objects=0) as fetch_span:
+                if journal is not None and journal.fetched(project):
+                    logger.info("Objects of project {} are read from "
+                                "journal".format(project))
+                    artifacts = journal.objects[project]
+                    # objects are already recorded
+                    journal = None
+                else:
+                    artifacts = client.iter_artifacts()
+                    if journal is not None:
+                        journal.fetch_started(project)
+                for provider, artifact in artifacts:
+                    if journal is not None:
+                        # recorded before coordinating thread changes it
+                        journal.add_object(project, provider, artifact)
+                    self._queue.put(("object", project, provider, artifact))
+                    fetch_span["objects"] += 1
+                if journal is not None:
+                    journal.fetch_finished(project)
+        except Exception as e:
+            logger.debug(traceback.format_exc())
+            self._queue.put(("fetch_failed", project, e))
+        else:
+            self._queue.put(("fetched", project))
+
+    def _transfer(self, image_info):
+        """
+        Export image (runs in transferring thread)
+        """
+        try:
+            return self.export_image(image_info)
+        except Exception as e:
+            # coordinating thread has to know about every finished transfer
+            return image_info["original_image"], e
+
+    def _transferred(self, result):
+        """
+        Send result of transfer to coordinating thread (runs in
+        transferring thread).
+        """
+        image, error = result
+        self._queue.put(("transferred", image, error))
+
+    def _on_object(self, project, provider, artifact):
+        artifact = self.images.index_artifact(provider, artifact)
+        if artifact is None:
+            return
+        self.counters["objects"] += 1
+        self._emit("object fetched", project=project, provider=provider,
+                   kind=artifact["kind"],
+                   name=artifact["metadata"].get("name"))
+
+        for container in utils.get_containers(artifact):
+            image = container["image"]
+            self._project_images[project].add(image)
+            if image not in self._image_state:
+                self._queue_image(self.images.images[image])
+
+        client, writer = self.projects[project]
+        entry = {"project": project,
+                 "provider": provider,
+                 "artifact": artifact,
+                 "relpath": writer.reserve_artifact(provider, artifact)}
+        self._schedule(entry)
+
+    def _queue_image(self, image_info):
+        """
+        Start transfer of image (if it should be exported)
+        """
+        image = image_info["original_image"]
+        if self.export_image is None or \
+                not (image_info["internal"] or not self.only_internal):
+            self._image_state[image] = IMAGE_DONE
+            return
+        self._image_state[image] = IMAGE_PENDING
+        self._transferring += 1
+        self.counters["images"] += 1
+        self._emit("image queued", image=image)
+        self._scheduler.add(image_info)
+
+    def _schedule(self, entry):
+        """
+        Write artifact if all images it references are exported, otherwise
+        let it wait for them.
+        """
+        references = set(obj[key] for obj, key in
+                         utils.get_image_references(entry["artifact"]))
+        waiting = set(image for image in references
+                      if self._image_state.get(image) == IMAGE_PENDING)
+        if waiting:
+            entry["waiting"] = waiting
+            for image in waiting:
+                self._waiting.setdefault(image, []).append(entry)
+        elif self._fetching and any(image not in self._image_state
+                                    for image in references):
+            self._deferred.append(entry)
+        else:
+            self._write(entry)
+
+    def _on_fetched(self, project):
+        self._fetching -= 1
+        self._emit("project fetched", project=project)
+        if not self._fetching:
+            deferred, self._deferred = self._deferred, []
+            for entry in deferred:
+                self._schedule(entry)
+
+    def _on_fetch_failed(self, project, error):
+        msg = "Fetching objects of project {} failed: {}".format(project,
+                                                                 error)
+        logger.critical(msg)
+        raise Exception(msg)
+
+    def _on_transferred(self, image, error):
+        self._transferring -= 1
+        self._image_state[image] = IMAGE_DONE
+        if error:
+            logger.error("Exporting image {} failed: {}".format(image, error))
+            self._failed.append((image, error))
+            self.counters["images_failed"] += 1
+            self._emit("image failed", image=image, error=str(error))
+        else:
+            self.counters["images_done"] += 1
+            image_info = self.images.images[image]
+            self._emit("image exported", image=image,
+                       new_image=image_info["image"],
+                       bytes=image_info.get("bytes"),
+                       duration=round(image_info.get("duration") or 0, 3))
+
+        for entry in self._waiting.pop(image, []):
+            entry["waiting"].discard(image)
+            if not entry["waiting"]:
+                self._schedule(entry)
+
+    def _write(self, entry):
+        """
+        Update image names in artifact and write it. Entry doesn't keep the
+        artifact after it is written.
+        """
+        artifact = entry.pop("artifact")
+        for obj, key in utils.get_image_references(artifact):
+            image_info = self.images.images.get(obj[key])
+            if image_info and image_info["image"] != obj[key]:
+                logger.info("Updating image {} for artifact {}:{}".format(
+                    obj[key], artifact["kind"],
+                    artifact["metadata"].get("name")))
+                obj[key] = image_info["image"]
+
+        client, writer = self.projects[entry["project"]]
+        writer.write_artifact(entry["provider"], artifact, entry["relpath"])
+        self.counters["written"] += 1
+        self._emit("artifact written", project=entry["project"],
+                   path=entry["relpath"])
+
+    def _close_writer(self, project, writer):
+        """
+        Record exported images of project in writer and close it
+        """
+        failed = set(image for image, error in self._failed)
+        for image in self._project_images[project]:
+            image_info = self.images.images[image]
+            if image_info.get("digest") and image not in failed:
+                writer.images[image] = {"digest": image_info["digest"],
+                                        "image": image_info["image"],
+                                        "registry": self.registry}
+        writer.close()
+        self._emit("project written", project=project)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import logging
+import os
+import threading
+import time
+
+from openshift2nulecule import serializer
+
+logger = logging.getLogger(__name__)
+
+
+class Tracer(object):
+    """
+    Records spans - named, timed operations (running a command, pulling
+    an image, writing an artifact ...) with their attributes like number
+    of bytes moved or number of objects processed.
+    Spans are recorded only when tracer is enabled, otherwise span() costs
+    almost nothing. Tracer can be used from more threads at once.
+    """
+
+    # spans are recorded only if tracer is enabled
+    enabled = False
+
+    # time when tracing was started (seconds since epoch)
+    start = None
+
+    def __init__(self):
+        self.spans = []
+        self.start = time.time()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        """
+        Start recording spans
+        """
+        self.enabled = True
+        self.start = time.time()
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """
+        Measure duration of code block.
+        Yields dict with attributes of span, code block can add attributes
+        to it (eg. bytes, objects) while it is running.
+
+        Example:
+            with tracer.span("write artifact", path=path) as span:
+                ...
+                span["bytes"] = len(data)
+
+        Args:
+            name (str): name of operation
+            attrs: attributes of span
+        """
+        if not self.enabled:
+            yield attrs
+            return
+
+        start = time.time()
+        try:
+            yield attrs
+        except Exception as e:
+            attrs["error"] = str(e)
+            raise
+        finally:
+            record = {"name": name,
+                      "start": start,
+                      "duration": time.time() - start,
+                      "pid": os.getpid(),
+                      "thread": threading.current_thread().name,
+                      "attrs": attrs}
+            with self._lock:
+                self.spans.append(record)
+
+    def pop_spans(self):
+        """
+        Return recorded spans and forget them.
+        Used to move spans from worker process to main process.
+
+        Returns:
+            list: spans
+        """
+        with self._lock:
+            spans, self.spans = self.spans, []
+        return spans
+
+    def add_spans(self, spans):
+        """
+        Add spans recorded by other tracer (eg. in worker process)
+
+        Args:
+            spans (list): spans returned by pop_spans
+        """
+        with self._lock:
+            self.spans.extend(spans)
+
+    def summary(self):
+        """
+        Aggregate spans by name.
+
+        Returns:
+            dict: for every span name number of spans (`count`), total and
+                  maximal duration, number of failed spans and sums of
+                  `bytes` and `objects` attributes
+        """
+        summary = {}
+        for record in self.spans:
+            item = summary.setdefault(record["name"], {"count": 0,
+                                                       "duration": 0.0,
+                                                       "max_duration": 0.0,
+                                                       "errors": 0,
+                                                       "bytes": 0,
+                                                       "objects": 0})
+            item["count"] += 1
+            item["duration"] += record["duration"]
+            item["max_duration"] = max(item["max_duration"],
+                                       record["duration"])
+            if "error" in record["attrs"]:
+                item["errors"] += 1
+            item["bytes"] += record["attrs"].get("bytes") or 0
+            item["objects"] += record["attrs"].get("objects") or 0
+        return summary
+
+    def write(self, path):
+        """
+        Write trace report to JSON file.
+        Report contains all spans (ordered by start, `start` is relative
+        to start of tracing) and summary of spans (see summary()).
+
+        Args:
+            path (str): path to report file
+        """
+        spans = []
+        for record in sorted(self.spans, key=lambda record: record["start"]):
+            record = dict(record)
+            record["start"] = record["start"] - self.start
+            spans.append(record)
+
+        report = {"duration": time.time() - self.start,
+                  "summary": self.summary(),
+                  "spans": spans}
+        with open(path, "wb") as f:
+            f.write(serializer.dumps_json(report, sort_keys=True))
+        logger.info("Profile written to {}".format(path))
+
+
+# tracer used by whole application
+tracer = Tracer()
+
+
+def span(name, **attrs):
+    """
+    Measure duration of code block using application tracer
+    (see Tracer.span).
+    """
+    return tracer.span(name, **attrs)
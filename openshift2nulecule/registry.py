@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import logging
+import re
+import threading
+
+try:
+    from urllib.parse import urljoin
+except ImportError:
+    from urlparse import urljoin
+
+from openshift2nulecule import serializer
+from openshift2nulecule.constants import DOCKER_HUB
+from openshift2nulecule.image import ImageRef
+
+logger = logging.getLogger(__name__)
+
+DOCKER_HUB_API = "registry-1.docker.io"
+
+# timeout of registry requests (seconds to connect and between received
+# data, so it doesn't limit duration of large blob transfers)
+REGISTRY_TIMEOUT = 60
+
+# timeout of requests looking up size of image (seconds), size is used only
+# to order transfers, so it's not worth waiting long for it
+SIZE_TIMEOUT = 10
+
+# size of chunks in which blobs are streamed between registries
+BLOB_CHUNK_SIZE = 1024 * 1024
+
+# manifest types we are able to work with (newest first)
+MANIFEST_LIST_TYPE = "application/vnd.docker.distribution.manifest.list.v2+json"
+MANIFEST_TYPES = ["application/vnd.docker.distribution.manifest.v2+json",
+                  "application/vnd.docker.distribution.manifest.list.v2+json",
+                  "application/vnd.docker.distribution.manifest.v1+prettyjws",
+                  "application/vnd.docker.distribution.manifest.v1+json"]
+
+
+def split_image(image):
+    """
+    Split Docker image name to registry, repository and reference.
+    Images without registry are from Docker Hub.
+    Example:
+      172.30.1.1:5000/foo/bar:1 -> ("172.30.1.1:5000", "foo/bar", "1")
+      centos -> ("docker.io", "library/centos", "latest")
+
+    Args:
+        image (str): image name
+
+    Returns:
+        tuple (registry, repository, reference), reference is tag or digest
+    """
+    return ImageRef.parse(image).split()
+
+
+class RegistryClient(object):
+    """
+    Client for Docker Registry HTTP API V2.
+    Supports basic and token authentication. If registry is not
+    available over https, http is used (same as docker does for insecure
+    registries).
+    """
+
+    def __init__(self, host, username=None, password=None, verify=True,
+                 timeout=REGISTRY_TIMEOUT):
+        """
+        Args:
+            host (str): registry host (with port), can be prefixed with
+                        http:// or https://
+            username (str): username for registry
+            password (str): password for registry
+            verify (bool): verify TLS certificates
+            timeout (float): timeout of requests (seconds)
+        """
+        self.scheme = None
+        if "://" in host:
+            self.scheme, host = host.split("://", 1)
+        if host == DOCKER_HUB:
+            host = DOCKER_HUB_API
+        self.host = host
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+
+        # requests is imported only when registry client is used
+        import requests
+
+        self.session = requests.Session()
+        self.session.verify = verify
+
+        # authorization header values for each scope
+        self._authorization = {}
+        # repository where blob is known to exist (key is blob digest),
+        # used for cross-repository blob mounts
+        self._blob_repositories = {}
+        self._lock = threading.Lock()
+
+    def _send(self, method, path, headers, **kwargs):
+        """
+        Send request to registry, detect scheme on first request.
+        Path can be also absolute url (eg. upload location).
+        """
+        import requests
+
+        kwargs.setdefault("timeout", self.timeout)
+        if "://" in path:
+            return self.session.request(method, path, headers=headers,
+                                        **kwargs)
+
+        if self.scheme is None:
+            try:
+                response = self.session.request(
+                    method, "https://{}/v2/{}".format(self.host, path),
+                    headers=headers, **kwargs)
+                self.scheme = "https"
+                return response
+            except requests.exceptions.SSLError:
+                logger.debug("Registry {} is not using https".format(
+                    self.host))
+                self.scheme = "http"
+
+        url = "{}://{}/v2/{}".format(self.scheme, self.host, path)
+        return self.session.request(method, url, headers=headers, **kwargs)
+
+    def request(self, method, path, scope=None, headers=None, **kwargs):
+        """
+        Send request to registry, authenticate if registry requires it.
+
+        Args:
+            method (str): http method
+            path (str): path relative to /v2/
+            scope (str): scope of token authentication
+                         (eg. repository:foo/bar:pull), more scopes are
+                         separated by space
+            headers (dict): http headers
+
+        Returns:
+            requests.Response
+        """
+        headers = dict(headers or {})
+        authorization = self._authorization.get(scope)
+        if authorization:
+            headers["Authorization"] = authorization
+
+        response = self._send(method, path, headers, **kwargs)
+        if response.status_code == 401:
+            authorization = self._authorize(response, scope)
+            if authorization:
+                headers["Authorization"] = authorization
+                response = self._send(method, path, headers, **kwargs)
+        return response
+
+    def _authorize(self, response, scope):
+        """
+        Get authorization for scope based on WWW-Authenticate challenge.
+
+        Args:
+            response (requests.Response): 401 response
+            scope (str): requested scope
+
+        Returns:
+            str: value of Authorization header, None if not possible
+        """
+        challenge = response.headers.get("WWW-Authenticate", "")
+        auth_type = challenge.split(" ", 1)[0].lower()
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+
+        credentials = None
+        if self.username and self.password:
+            credentials = (self.username, self.password)
+
+        authorization = None
+        if auth_type == "basic" and credentials:
+            authorization = "Basic {}".format(base64.b64encode(
+                "{}:{}".format(*credentials).encode("utf-8")).decode("ascii"))
+        elif auth_type == "bearer" and "realm" in params:
+            token_params = {"service": params.get("service")}
+            if scope:
+                # more scopes can be requested at once (separated by space)
+                token_params["scope"] = scope.split(" ")
+            token_response = self.session.get(params["realm"],
+                                              params=token_params,
+                                              auth=credentials,
+                                              timeout=self.timeout)
+            if token_response.status_code == 200:
+                token = token_response.json()
+                authorization = "Bearer {}".format(
+                    token.get("token") or token.get("access_token"))
+            else:
+                logger.debug("Getting token from {} failed ({})".format(
+                    params["realm"], token_response.status_code))
+
+        if authorization:
+            with self._lock:
+                self._authorization[scope] = authorization
+        return authorization
+
+    def get_manifest_digest(self, repository, reference):
+        """
+        Get digest of image manifest.
+
+        Args:
+            repository (str): repository name (eg. foo/bar)
+            reference (str): tag or digest
+
+        Returns:
+            str: digest of manifest, None if image or digest is not available
+        """
+        response = self.request(
+            "HEAD", "{}/manifests/{}".format(repository, reference),
+            scope="repository:{}:pull".format(repository),
+            headers={"Accept": ", ".join(MANIFEST_TYPES)})
+        if response.status_code != 200:
+            logger.debug("Can't get manifest for {}:{} from {} ({})".format(
+                repository, reference, self.host, response.status_code))
+            return None
+        return response.headers.get("Docker-Content-Digest")
+
+    def get_manifest(self, repository, reference, timeout=None):
+        """
+        Get image manifest.
+
+        Args:
+            repository (str): repository name (eg. foo/bar)
+            reference (str): tag or digest
+            timeout (float): timeout of request (seconds), default is
+                             timeout of client
+
+        Returns:
+            tuple (manifest, media type), manifest is raw content (bytes)
+        """
+        response = self.request(
+            "GET", "{}/manifests/{}".format(repository, reference),
+            scope="repository:{}:pull".format(repository),
+            headers={"Accept": ", ".join(MANIFEST_TYPES)},
+            timeout=timeout or self.timeout)
+        self._check(response, "Getting manifest {}:{}".format(repository,
+                                                              reference))
+        media_type = response.headers.get("Content-Type", "").split(";")[0]
+        return response.content, media_type
+
+    def get_image_size(self, repository, reference, timeout=None):
+        """
+        Get size of image (sum of compressed sizes of its blobs) from its
+        manifest. Size of manifest list is size of images of all platforms.
+
+        Args:
+            repository (str): repository name (eg. foo/bar)
+            reference (str): tag or digest
+            timeout (float): timeout of every request (seconds), default
+                             is timeout of client
+
+        Returns:
+            int: size in bytes, None if manifest doesn't contain sizes
+                 (schema 1)
+        """
+        manifest, media_type = self.get_manifest(repository, reference,
+                                                 timeout)
+        content = serializer.loads_json(manifest)
+
+        if media_type == MANIFEST_LIST_TYPE:
+            size = 0
+            for platform_manifest in content.get("manifests", []):
+                platform_size = self.get_image_size(
+                    repository, platform_manifest["digest"], timeout)
+                if platform_size is None:
+                    return None
+                size += platform_size
+            return size
+
+        if "layers" not in content:
+            # schema 1 manifest doesn't have sizes of layers
+            return None
+        return content["config"].get("size", 0) + \
+            sum(layer.get("size", 0) for layer in content["layers"])
+
+    def put_manifest(self, repository, reference, manifest, media_type):
+        """
+        Upload image manifest.
+
+        Args:
+            repository (str): repository name (eg. foo/bar)
+            reference (str): tag or digest
+            manifest (bytes): raw manifest
+            media_type (str): media type of manifest
+        """
+        response = self.request(
+            "PUT", "{}/manifests/{}".format(repository, reference),
+            scope="repository:{}:pull,push".format(repository),
+            headers={"Content-Type": media_type}, data=manifest)
+        self._check(response, "Uploading manifest {}:{}".format(repository,
+                                                               reference))
+
+    def blob_exists(self, repository, digest):
+        """
+        Check if blob exists in repository.
+
+        Args:
+            repository (str): repository name (eg. foo/bar)
+            digest (str): digest of blob
+
+        Returns:
+            bool: True if blob exists
+        """
+        response = self.request(
+            "HEAD", "{}/blobs/{}".format(repository, digest),
+            scope="repository:{}:pull,push".format(repository))
+        if response.status_code == 200:
+            self._blob_repositories[digest] = repository
+            return True
+        return False
+
+    def copy_image(self, repository, reference, target, target_repository,
+                   target_reference, throttle=None):
+        """
+        Copy image from this registry to target registry without Docker
+        daemon. Manifests and blobs are streamed directly between
+        registries. Blobs that already exist in target repository are
+        skipped, blobs that exist in other repository in target registry are
+        mounted (if target registry supports it).
+
+        Args:
+            repository (str): source repository name (eg. foo/bar)
+            reference (str): source tag or digest
+            target (RegistryClient): target registry
+            target_repository (str): target repository name
+            target_reference (str): target tag
+            throttle (Throttle): bandwidth limit of blob uploads
+
+        Returns:
+            int: number of bytes uploaded to target registry
+        """
+        manifest, media_type = self.get_manifest(repository, reference)
+        content = serializer.loads_json(manifest)
+
+        copied = 0
+        if media_type == MANIFEST_LIST_TYPE:
+            # copy image for every platform (referenced by digest)
+            for platform_manifest in content.get("manifests", []):
+                copied += self.copy_image(repository,
+                                          platform_manifest["digest"],
+                                          target, target_repository,
+                                          platform_manifest["digest"],
+                                          throttle)
+        else:
+            if "layers" in content:
+                # schema 2
+                blobs = [content["config"]["digest"]] + \
+                    [layer["digest"] for layer in content["layers"]]
+            else:
+                # schema 1
+                blobs = [layer["blobSum"]
+                         for layer in content.get("fsLayers", [])]
+
+            for digest in sorted(set(blobs), key=blobs.index):
+                copied += self._copy_blob(repository, digest, target,
+                                          target_repository, throttle)
+
+        target.put_manifest(target_repository, target_reference, manifest,
+                            media_type)
+        return copied
+
+    def _copy_blob(self, repository, digest, target, target_repository,
+                   throttle=None):
+        """
+        Copy one blob to target registry (if it is not already there).
+
+        Returns:
+            int: number of bytes uploaded
+        """
+        if target.blob_exists(target_repository, digest):
+            logger.debug("Blob {} already exists in {}/{}".format(
+                digest, target.host, target_repository))
+            return 0
+
+        upload_params = {}
+        source_repository = target._blob_repositories.get(digest)
+        scope = "repository:{}:pull,push".format(target_repository)
+        if source_repository:
+            upload_params = {"mount": digest, "from": source_repository}
+            scope = "{} repository:{}:pull".format(scope, source_repository)
+
+        response = target.request(
+            "POST", "{}/blobs/uploads/".format(target_repository),
+            scope=scope, params=upload_params)
+        if response.status_code == 201:
+            logger.debug("Blob {} mounted from {}/{}".format(
+                digest, target.host, source_repository))
+            target._blob_repositories[digest] = target_repository
+            return 0
+        target._check(response, "Starting upload of {}".format(digest))
+        location = urljoin("{}://{}/".format(target.scheme, target.host),
+                           response.headers["Location"])
+
+        body = _BlobBody(self, repository, digest, throttle)
+        logger.debug("Uploading blob {} to {}/{}".format(
+            digest, target.host, target_repository))
+        separator = "&" if "?" in location else "?"
+        response = target.request(
+            "PUT", "{}{}digest={}".format(location, separator, digest),
+            scope=scope,
+            headers={"Content-Type": "application/octet-stream"},
+            data=body)
+        target._check(response, "Uploading blob {}".format(digest))
+        target._blob_repositories[digest] = target_repository
+        return body.bytes
+
+    def _check(self, response, action):
+        """
+        Raise exception if request was not successful.
+        """
+        if response.status_code >= 300:
+            msg = "{} in {} failed ({}): {}".format(
+                action, self.host, response.status_code, response.text[:500])
+            logger.error(msg)
+            raise Exception(msg)
+
+
+class _BlobBody(object):
+    """
+    Body of blob upload streamed from source registry. Blob is requested
+    again every time the body is iterated, so upload request can be sent
+    again (eg. when target registry asks for authentication).
+    """
+
+    def __init__(self, registry, repository, digest, throttle=None):
+        """
+        Args:
+            registry (RegistryClient): source registry
+            repository (str): source repository name
+            digest (str): digest of blob
+            throttle (Throttle): bandwidth limit
+        """
+        self.registry = registry
+        self.repository = repository
+        self.digest = digest
+        self.throttle = throttle
+        # number of bytes sent by last attempt
+        self.bytes = 0
+
+    def __iter__(self):
+        blob = self.registry.request(
+            "GET", "{}/blobs/{}".format(self.repository, self.digest),
+            scope="repository:{}:pull".format(self.repository), stream=True)
+        try:
+            self.registry._check(blob, "Getting blob {}".format(self.digest))
+            self.bytes = 0
+            for chunk in blob.iter_content(chunk_size=BLOB_CHUNK_SIZE):
+                if self.throttle is not None:
+                    self.throttle.consume(len(chunk))
+                self.bytes += len(chunk)
+                yield chunk
+        finally:
+            blob.close()
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from openshift2nulecule import utils
+
+logger = logging.getLogger(__name__)
+
+# seconds transfers wait for pending size lookups (counted from start of
+# the first of them), so the largest image can be picked first
+LOOKUP_WAIT = 5
+
+
+class Throttle(object):
+    """
+    Bandwidth limit shared by all transfers (token bucket).
+
+    Every transfer consumes every chunk of bytes before it moves it, if
+    budget is exhausted it sleeps until enough budget is renewed. Unused
+    budget accumulates for at most one second. Only transfers whose byte
+    stream goes through this process can be throttled (direct copies
+    between registries, see RegistryClient.copy_image).
+    """
+
+    # bytes per second
+    rate = None
+
+    def __init__(self, rate):
+        """
+        Args:
+            rate (int): bytes per second
+        """
+        self.rate = float(rate)
+        self._available = 0.0
+        self._time = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """
+        Wait until `amount` bytes can be moved without exceeding rate.
+
+        Args:
+            amount (int): number of bytes
+        """
+        with self._lock:
+            now = time.time()
+            self._available = min(self._available +
+                                  (now - self._time) * self.rate, self.rate)
+            self._time = now
+            # budget can go negative, following consumers wait for it too
+            self._available -= amount
+            wait = -self._available / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class TransferScheduler(object):
+    """
+    Transfers images in `jobs` threads, largest images first.
+
+    Size of every added image is looked up (see ExportedProject.image_size)
+    as soon as image is added, lookups run concurrently. Image is waiting
+    for transfer once its size is known and transfer threads always take
+    the largest waiting image, so one big image doesn't start last and
+    stretch the whole run. While lookups are pending, transfers don't
+    start until all of them finish or LOOKUP_WAIT seconds pass since the
+    first of them started, so slow lookups hold back transfers only for a
+    short time (and the ordering is best-effort then - large image whose
+    lookup finishes later can start after smaller ones). Images whose size
+    can't be determined are transferred after waiting images with known
+    size, in order they were added.
+
+    Sizes are looked up only if more images are transferred concurrently,
+    with one transfer thread order of images doesn't change duration of
+    the run.
+
+    Duration of every transfer is stored in image info as `duration`, size
+    as `size`.
+    """
+
+    def __init__(self, transfer, image_size=None, jobs=1, callback=None):
+        """
+        Args:
+            transfer: function exporting one image, returns tuple
+                      (image, error) (see ExportedProject.image_exporter)
+            image_size: function returning size of image (bytes or None),
+                        if None (or if `jobs` is 1) sizes are not looked up
+            jobs (int): number of concurrent transfers
+            callback: function called with result of every transfer
+        """
+        self.transfer = transfer
+        self.image_size = image_size
+        self.jobs = max(jobs, 1)
+        self.callback = callback
+        # infos of successfully transferred images (in order in which their
+        # transfer finished)
+        self.transferred = []
+
+        self._cond = threading.Condition()
+        self._heap = []
+        self._sequence = itertools.count()
+        # number of images whose size is being looked up
+        self._sizing = 0
+        # time when lookups started (since there were none pending)
+        self._sizing_since = None
+        self._closed = False
+        self._stopped = False
+
+        self._lookup_pool = None
+        if image_size is not None and self.jobs > 1:
+            self._lookup_pool = ThreadPool(self.jobs)
+        self._threads = []
+        for _ in range(self.jobs):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def add(self, image_info):
+        """
+        Schedule transfer of image
+
+        Args:
+            image_info (dict): image from image index
+        """
+        if self._lookup_pool is None:
+            with self._cond:
+                self._push(image_info)
+            return
+        with self._cond:
+            if not self._sizing:
+                self._sizing_since = time.time()
+            self._sizing += 1
+        self._lookup_pool.apply_async(self._lookup, (image_info,))
+
+    def _lookup(self, image_info):
+        """
+        Look up size of image (runs in lookup thread)
+        """
+        try:
+            image_info["size"] = self.image_size(image_info)
+        except Exception as e:
+            logger.debug("Can't get size of {}: {}".format(
+                image_info["original_image"], e))
+            image_info["size"] = None
+        with self._cond:
+            self._sizing -= 1
+            self._push(image_info)
+
+    def _push(self, image_info):
+        """
+        Add image to waiting images (lock has to be held)
+        """
+        size = image_info.get("size")
+        if size is None:
+            priority = (1, 0)
+        else:
+            priority = (0, -size)
+        heapq.heappush(self._heap, (priority, next(self._sequence),
+                                    image_info))
+        self._cond.notify_all()
+
+    def _next(self):
+        """
+        Return next image to transfer, None if there won't be any.
+        """
+        with self._cond:
+            while not self._stopped:
+                if self._heap:
+                    wait = self._lookup_wait()
+                    if wait <= 0:
+                        return heapq.heappop(self._heap)[-1]
+                    self._cond.wait(wait)
+                    continue
+                if self._closed and not self._heap and not self._sizing:
+                    return None
+                self._cond.wait()
+            return None
+
+    def _lookup_wait(self):
+        """
+        Return seconds transfers still wait for pending lookups, 0 if they
+        don't wait (lock has to be held)
+        """
+        if not self._sizing:
+            return 0
+        return self._sizing_since + LOOKUP_WAIT - time.time()
+
+    def _work(self):
+        """
+        Transfer images (runs in transfer thread)
+        """
+        while True:
+            image_info = self._next()
+            if image_info is None:
+                return
+            start = time.time()
+            result = self.transfer(image_info)
+            image_info["duration"] = time.time() - start
+            image, error = result
+            if not error:
+                with self._cond:
+                    self.transferred.append(image_info)
+            if self.callback is not None:
+                self.callback(result)
+
+    def close(self):
+        """
+        No more images will be added, threads finish when all images are
+        transferred.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._lookup_pool is not None:
+            self._lookup_pool.close()
+
+    def terminate(self):
+        """
+        Stop threads, images that are being transferred are finished.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._lookup_pool is not None:
+            self._lookup_pool.terminate()
+
+    def join(self):
+        """
+        Wait for all threads
+        """
+        for thread in self._threads:
+            thread.join()
+        if self._lookup_pool is not None:
+            self._lookup_pool.join()
+
+    def report(self):
+        """
+        Log bytes moved and throughput of every transferred image (largest
+        first) and totals.
+        """
+        if not self.transferred:
+            return
+        total_bytes = 0
+        for image_info in sorted(self.transferred,
+                                 key=lambda info: -(info.get("bytes") or 0)):
+            moved = image_info.get("bytes") or 0
+            duration = image_info.get("duration") or 0
+            total_bytes += moved
+            throughput = moved / duration if duration else 0
+            logger.info("Image {}: {} in {:.1f}s ({}/s)".format(
+                image_info["original_image"], utils.format_size(moved),
+                duration, utils.format_size(int(throughput))))
+        logger.info("Transferred {} image(s), {} in total".format(
+            len(self.transferred), utils.format_size(total_bytes)))
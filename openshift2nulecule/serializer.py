@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Serialization of artifacts and configuration files.
+
+JSON engine is chosen on first use, the fastest available library is used
+(orjson, falling back to json from standard library). YAML library is
+imported only when YAML is actually read or written.
+Output is the same with every engine: JSON indented by 2 spaces without
+trailing whitespace, non-ascii characters are not escaped, utf-8 encoded
+(only floats in exponent notation are written differently, eg. 1e16 and
+1e+16).
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# JSON engine (name, dumps, loads), chosen by _json_engine()
+_engine = None
+
+
+def _orjson_engine():
+    import orjson
+
+    def dumps(obj, indent=True, sort_keys=False):
+        option = 0
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option)
+
+    return "orjson", dumps, orjson.loads
+
+
+def _stdlib_engine():
+    import json
+
+    def dumps(obj, indent=True, sort_keys=False):
+        if not indent:
+            return json.dumps(obj, separators=(',', ':'), ensure_ascii=False,
+                              sort_keys=sort_keys).encode("utf-8")
+        # specify separators to get rid of trailing whitespace
+        return json.dumps(obj, indent=2, separators=(',', ': '),
+                          ensure_ascii=False,
+                          sort_keys=sort_keys).encode("utf-8")
+
+    def loads(data):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8")
+        return json.loads(data)
+
+    return "json", dumps, loads
+
+
+# JSON engines in order of preference
+JSON_ENGINES = [_orjson_engine, _stdlib_engine]
+
+
+def _json_engine():
+    """
+    Return first available JSON engine.
+
+    Returns:
+        tuple (name, dumps, loads)
+    """
+    global _engine
+    if _engine is None:
+        for engine in JSON_ENGINES:
+            try:
+                _engine = engine()
+                break
+            except ImportError:
+                continue
+        logger.debug("Using {} for JSON serialization".format(_engine[0]))
+    return _engine
+
+
+def dumps_json(obj, indent=True, sort_keys=False):
+    """
+    Serialize object to JSON
+
+    Args:
+        obj: object to serialize
+        indent (bool): indent JSON, otherwise it is written on one line
+        sort_keys (bool): sort keys of objects
+
+    Returns:
+        bytes: utf-8 encoded JSON
+    """
+    name, dumps, loads = _json_engine()
+    try:
+        return dumps(obj, indent, sort_keys)
+    except TypeError:
+        if name == "json":
+            raise
+        # object that faster engine can't handle (eg. integer larger than
+        # 64 bits), standard library can serialize everything JSON can
+        # represent
+        return _stdlib_engine()[1](obj, indent, sort_keys)
+
+
+def loads_json(data):
+    """
+    Parse JSON document
+
+    Args:
+        data (bytes or str): JSON document
+
+    Returns:
+        parsed object
+    """
+    return _json_engine()[2](data)
+
+
+def dumps_yaml(obj):
+    """
+    Serialize object to YAML (block style)
+
+    Args:
+        obj: object to serialize
+
+    Returns:
+        bytes: utf-8 encoded YAML
+    """
+    import yaml
+    return yaml.safe_dump(obj, encoding="utf-8", default_flow_style=False)
+
+
+def load_yaml_file(path):
+    """
+    Parse YAML file (JSON is valid YAML as well)
+
+    Args:
+        path (str): path to file
+
+    Returns:
+        parsed object
+    """
+    import yaml
+    with open(path, "rb") as f:
+        return yaml.safe_load(f)
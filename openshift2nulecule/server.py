@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Export server - long running process that runs exports requested over
+HTTP API. Exports share one ExportSession, so OpenShift clients, registry
+connections and digests of exported images stay warm between exports.
+
+API (request and response bodies are JSON):
+
+    POST /jobs         queue export, body is {"args": [command line
+                       arguments]}, returns job (202). --output is a path
+                       inside root directory of server.
+    GET  /jobs         list of all jobs (only last FINISHED_JOBS finished
+                       jobs are kept)
+    GET  /jobs/<id>    job with `id`, `state` (queued, running, done or
+                       failed), `args`, `error` and times when job was
+                       created, started and finished
+"""
+
+import argparse
+import copy
+import itertools
+import logging
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from openshift2nulecule import serializer
+from openshift2nulecule.export import ExportSession
+
+logger = logging.getLogger(__name__)
+
+# states of job
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# options that are set for the whole server (they change global state of
+# process, or they choose programs, files and daemons server uses), jobs
+# can't change them
+SERVER_OPTIONS = ["serve", "server_jobs", "server_root", "internal_registry",
+                  "transform", "debug", "profile", "oc", "oc_config",
+                  "docker_url", "docker_backend", "cache_dir"]
+
+# number of finished jobs kept by server (oldest are forgotten)
+FINISHED_JOBS = 100
+
+
+class ExportJob(object):
+    """
+    One export requested by client
+    """
+
+    def __init__(self, job_id, args, options):
+        """
+        Args:
+            job_id (int): id of job
+            args (list): command line arguments of export
+            options (argparse.Namespace): parsed arguments
+        """
+        self.id = job_id
+        self.args = args
+        self.options = options
+        self.state = JOB_QUEUED
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        """
+        Return job as dict (for JSON response)
+        """
+        return OrderedDict([("id", self.id),
+                            ("state", self.state),
+                            ("args", self.args),
+                            ("error", self.error),
+                            ("created", self.created),
+                            ("started", self.started),
+                            ("finished", self.finished)])
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ExportServer(object):
+    """
+    Runs exports requested over HTTP API, up to `jobs` exports run
+    concurrently, others wait in queue. Only last FINISHED_JOBS finished
+    jobs are kept. Exports are written only inside `root` directory.
+    """
+
+    def __init__(self, cli, options, host="127.0.0.1", port=8080, jobs=1,
+                 root="."):
+        """
+        Args:
+            cli (CLI): command line interface used to parse arguments of
+                       jobs and run exports
+            options (argparse.Namespace): arguments of server, they are
+                                          defaults for arguments of jobs
+            host (str): address to listen on
+            port (int): port to listen on
+            jobs (int): number of exports that run concurrently
+            root (str): directory --output of every job has to be in
+                        (relative --output is relative to it)
+        """
+        self.cli = cli
+        self.options = options
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.session = ExportSession()
+        self.jobs = OrderedDict()
+
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._pool = ThreadPool(max(jobs, 1))
+        self._httpd = _ThreadingHTTPServer((host, port), _handler(self))
+
+    @property
+    def address(self):
+        """
+        Address (host, port) server is listening on
+        """
+        return self._httpd.server_address
+
+    def submit(self, args):
+        """
+        Queue export
+
+        Args:
+            args (list): command line arguments of export (arguments of
+                         server are used as defaults)
+
+        Returns:
+            ExportJob
+        """
+        if not isinstance(args, list) or \
+                not all(isinstance(arg, type(u"")) or isinstance(arg, str)
+                        for arg in args):
+            raise ValueError("args has to be list of strings")
+
+        options = self._parse(args)
+        for name in SERVER_OPTIONS:
+            if getattr(options, name) != getattr(self.options, name):
+                raise ValueError("--{} can be set only for whole server".format(
+                    name.replace("_", "-")))
+        if not options.output or options.output == "-":
+            raise ValueError("--output has to be set to a path")
+        options.output = self._output_path(options.output)
+        if options.watch:
+            raise ValueError("--watch can't be used with export server")
+
+        with self._lock:
+            job = ExportJob(next(self._ids), args, options)
+            self.jobs[job.id] = job
+        logger.info("Job {} queued: {}".format(job.id, " ".join(args)))
+        self._pool.apply_async(self._run, (job,))
+        return job
+
+    def _parse(self, args):
+        """
+        Parse arguments of job, arguments of server are defaults.
+        Values of options that can be repeated (like --project) replace
+        values of server, they are not appended to them.
+        """
+        namespace = copy.deepcopy(self.options)
+        appended = [action.dest for action in self.cli.parser._actions
+                    if isinstance(action, argparse._AppendAction)]
+        for name in appended:
+            setattr(namespace, name, None)
+        try:
+            options = self.cli.parser.parse_args(args, namespace=namespace)
+        except SystemExit:
+            # argparse already printed the error
+            raise ValueError("Invalid arguments: {}".format(" ".join(args)))
+        for name in appended:
+            if getattr(options, name) is None:
+                setattr(options, name, copy.deepcopy(getattr(self.options,
+                                                             name)))
+        return options
+
+    def _output_path(self, output):
+        """
+        Return absolute path of --output of job, raise ValueError if it is
+        not inside root directory
+        """
+        path = os.path.normpath(os.path.join(self.root, output))
+        if path == self.root or \
+                not path.startswith(self.root.rstrip(os.sep) + os.sep):
+            raise ValueError("--output has to be a path inside {}".format(
+                self.root))
+        return path
+
+    def get_job(self, job_id):
+        """
+        Return job with `job_id`, None if there is no such job
+        """
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        """
+        Return all jobs (in order they were submitted)
+        """
+        with self._lock:
+            return list(self.jobs.values())
+
+    def _evict(self):
+        """
+        Forget oldest finished jobs over FINISHED_JOBS (lock has to be held)
+        """
+        finished = [job.id for job in self.jobs.values()
+                    if job.state in (JOB_DONE, JOB_FAILED)]
+        for job_id in finished[:max(len(finished) - FINISHED_JOBS, 0)]:
+            del self.jobs[job_id]
+
+    def _run(self, job):
+        """
+        Run export of job (runs in worker thread)
+        """
+        job.state = JOB_RUNNING
+        job.started = time.time()
+        logger.info("Job {} started".format(job.id))
+        try:
+            self.cli.export(job.options, self.session)
+        except Exception as e:
+            logger.debug(traceback.format_exc())
+            job.error = str(e)
+            job.state = JOB_FAILED
+            logger.error("Job {} failed: {}".format(job.id, e))
+        else:
+            job.state = JOB_DONE
+            logger.info("Job {} done".format(job.id))
+        with self._lock:
+            job.finished = time.time()
+            self._evict()
+
+    def serve_forever(self):
+        """
+        Handle requests until shutdown is called
+        """
+        logger.info("Export server listening on {}:{}".format(
+            *self.address))
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+
+    def shutdown(self):
+        """
+        Stop serving requests and wait until queued jobs are finished.
+        """
+        self._httpd.shutdown()
+        self._pool.close()
+        self._pool.join()
+
+
+def _handler(server):
+    """
+    Return request handler class for export server
+    """
+
+    class ExportRequestHandler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            logger.debug("{} - {}".format(self.address_string(),
+                                          format % args))
+
+        def _send(self, code, body):
+            data = serializer.dumps_json(body, indent=False)
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _error(self, code, message):
+            self._send(code, {"error": message})
+
+        def do_GET(self):
+            path = self.path.rstrip("/")
+            if path == "/jobs":
+                return self._send(200, [job.to_dict()
+                                        for job in server.list_jobs()])
+            if path.startswith("/jobs/"):
+                job_id = path[len("/jobs/"):]
+                job = server.get_job(int(job_id)) if job_id.isdigit() \
+                    else None
+                if job is None:
+                    return self._error(404, "Job {} not found".format(job_id))
+                return self._send(200, job.to_dict())
+            self._error(404, "Not found")
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/jobs":
+                return self._error(404, "Not found")
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = serializer.loads_json(self.rfile.read(length))
+                if not isinstance(body, dict) or "args" not in body:
+                    raise ValueError('Body has to be {"args": [...]}')
+                job = server.submit(body["args"])
+            except ValueError as e:
+                return self._error(400, str(e))
+            self._send(202, job.to_dict())
+
+    return ExportRequestHandler
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Transforms of exported objects.
+
+Every exported object goes through the list of registered transforms once,
+in order of registration. Transform is a function called with provider
+and artifact (object) that returns artifact (modified in place or a new
+one) or None if artifact should be dropped. Following transforms are not
+called for dropped artifacts.
+
+Example of custom transform:
+
+    from openshift2nulecule.transforms import register_transform
+
+    @register_transform
+    def drop_annotations(provider, artifact):
+        artifact["metadata"].pop("annotations", None)
+        return artifact
+
+Custom transforms can be loaded from command line with
+`--transform module:function`.
+"""
+
+import importlib
+import logging
+
+from openshift2nulecule.constants import CLUSTER_METADATA
+
+logger = logging.getLogger(__name__)
+
+# registered transforms (in order in which they are applied)
+_transforms = []
+
+
+def register_transform(func):
+    """
+    Register transform, it is applied after already registered transforms.
+    Transform that is already registered is not added again.
+    Can be used as decorator.
+
+    Args:
+        func: function (provider, artifact) -> artifact or None
+
+    Returns:
+        func
+    """
+    if func not in _transforms:
+        _transforms.append(func)
+    return func
+
+
+def unregister_transform(func):
+    """
+    Remove transform from registered transforms
+
+    Args:
+        func: registered transform
+    """
+    _transforms.remove(func)
+
+
+def get_transforms():
+    """
+    Return registered transforms
+
+    Returns:
+        list of functions (copy)
+    """
+    return list(_transforms)
+
+
+def load_transforms(names):
+    """
+    Import and register transforms given by name
+
+    Args:
+        names (list): transforms as `module:function`
+                      (eg. mypackage.transforms:drop_secrets)
+    """
+    for name in names or []:
+        if ":" not in name:
+            msg = "Invalid transform {}, use module:function".format(name)
+            logger.critical(msg)
+            raise Exception(msg)
+        module_name, func_name = name.split(":", 1)
+        try:
+            func = getattr(importlib.import_module(module_name), func_name)
+        except (ImportError, AttributeError) as e:
+            msg = "Can't load transform {}: {}".format(name, e)
+            logger.critical(msg)
+            raise Exception(msg)
+        register_transform(func)
+
+
+def apply_transforms(provider, artifact, transforms=None):
+    """
+    Apply transforms to artifact
+
+    Args:
+        provider (str): provider of artifact
+        artifact (dict): OpenShift or Kubernetes object
+        transforms (list): transforms to apply, registered transforms if
+                           None
+
+    Returns:
+        dict: transformed artifact, None if artifact was dropped
+    """
+    if transforms is None:
+        transforms = _transforms
+    for transform in transforms:
+        artifact = transform(provider, artifact)
+        if artifact is None:
+            break
+    return artifact
+
+
+@register_transform
+def drop_deployment_rcs(provider, artifact):
+    """
+    Drop ReplicationControllers that were created by DeploymentConfig from
+    OpenShift artifacts (DeploymentConfig creates them again).
+    """
+    if provider == "openshift" and \
+            artifact["kind"] == "ReplicationController":
+        # check if this RC has been created by DC by checking if
+        # openshift.io/deployment-config.name annotation exists
+        annotations = artifact.get("metadata", {}).get("annotations", {})
+        if annotations.get("openshift.io/deployment-config.name"):
+            return None
+    return artifact
+
+
+@register_transform
+def strip_imagestream_annotations(provider, artifact):
+    """
+    Remove annotations from all OpenShift ImageStreams. This is temporary
+    workaround for https://github.com/openshift/origin/issues/8327
+    """
+    if provider == "openshift" and artifact["kind"] == "ImageStream":
+        metadata = artifact.get("metadata", {})
+        if metadata.get("annotations", {}):
+            del metadata["annotations"]
+    return artifact
+
+
+@register_transform
+def strip_runtime_metadata(provider, artifact):
+    """
+    Remove status and metadata that are specific to running cluster
+    (see CLUSTER_METADATA).
+    """
+    metadata = artifact.get("metadata")
+    if metadata:
+        for key in CLUSTER_METADATA:
+            metadata.pop(key, None)
+    if artifact.get("status"):
+        artifact["status"] = {}
+    return artifact
@@ -2,11 +2,20 @@
 import os
 from subprocess import Popen, PIPE
 import logging
-import itertools
+import codecs
+import contextlib
+import json
+import re
+import tempfile
+import threading
+import time
 from openshift2nulecule.constants import (HOST_DIR,
                                           NULECULE_SPECVERSION,
-                                          NULECULE_PROVIDERS)
-import ipaddress
+                                          NULECULE_PROVIDERS,
+                                          POD_TEMPLATE_KINDS,
+                                          PROVIDER_RESOURCES)
+from openshift2nulecule.image import ImageRef
+from openshift2nulecule.profiling import span
 
 logger = logging.getLogger(__name__)
 
@@ -77,11 +86,27 @@ def generate_dockerfile(nulecule_dir, atomicapp_version):
         None
     """
     files = [file for file in os.listdir(nulecule_dir)
-             if os.path.isfile(os.path.join(nulecule_dir, file))]
+             if os.path.isfile(os.path.join(nulecule_dir, file)) and
+             not file.startswith(".") and file != "Dockerfile"]
     files.append('Dockerfile')
     dockerfile = open(os.path.join(nulecule_dir, 'Dockerfile'), 'w')
+    dockerfile.write(dockerfile_content(files, atomicapp_version))
+    dockerfile.close()
+
+
+def dockerfile_content(files, atomicapp_version):
+    """
+    Return content of Dockerfile for an exported application.
 
-    dockerfile.writelines([
+    Args:
+        files (list): files in root of application directory (including
+                      Dockerfile)
+        atomicapp_version (str): Atomic App version to be used in Dockerfile.
+
+    Returns:
+        str: Dockerfile
+    """
+    return "".join([
         'FROM projectatomic/atomicapp:{}\n'.format(atomicapp_version),
         '\n',
         'LABEL io.projectatomic.nulecule.providers="{}" \\\n'.format(
@@ -92,7 +117,40 @@ def generate_dockerfile(nulecule_dir, atomicapp_version):
         'ADD {} /application-entity/\n'.format(" ".join(files)),
         'ADD /artifacts /application-entity/artifacts'
     ])
-    dockerfile.close()
+
+
+def resource_kind(resource):
+    """
+    Convert resource type as used on oc command line to object kind.
+    Example:
+      persistentVolumeClaim -> PersistentVolumeClaim
+
+    Args:
+        resource (str): resource type (eg. deploymentConfig)
+
+    Returns:
+        str: kind of object
+    """
+    return resource[0].upper() + resource[1:]
+
+
+def kind_order(provider, kind):
+    """
+    Return position of kind in resource list of provider.
+    Artifacts are sorted by this in Nulecule file.
+
+    Args:
+        provider (str): provider name
+        kind (str): kind of object
+
+    Returns:
+        int: position of kind (kinds not exported for provider are last)
+    """
+    resources = PROVIDER_RESOURCES[provider]
+    for index, resource in enumerate(resources):
+        if resource_kind(resource) == kind:
+            return index
+    return len(resources)
 
 
 def parse_image_name(image):
@@ -109,23 +167,14 @@ def parse_image_name(image):
                                            None if there is no digest in image
                                            name
     """
-    tag = None
-    image_digest = None
-    if "@" not in image:
-        # only if images has not defined digest @sha256:aaaaa...
-        tag = image.split(":")[-1]
-        image_name = ":".join(image.split(":")[:-1])
-    else:
-        # image with digest
-        image_digest = image.split("@")[-1]
-        image_name = image.split("@")[0]
-
-    return image_name, tag, image_digest
+    ref = ImageRef.parse(image)
+    return ref.repository_name, ref.tag, ref.digest
 
 
 def replace_registry_host(image_name, new_registry):
     """
-    Replaces registry host in image name
+    Replaces registry host in image name (registry is added if image name
+    doesn't contain registry)
 
     Args:
         image_name: image name
@@ -134,51 +183,67 @@ def replace_registry_host(image_name, new_registry):
     Return:
         str: new image name with replaced registry part
     """
-    return "{}/{}".format(new_registry, "/".join(image_name.split("/")[1:]))
+    return ImageRef.parse(image_name).with_registry(new_registry).name
 
 
-def get_image_info(obj):
+def get_pod_spec(obj):
     """
-    Checks if image specified in ReplicationController or DeploymentConfig
-    is from internal OpenShift registry.
-    TODO: support for Pod
+    Return pod spec of object.
+    Works for Pod and all objects that have pod template (POD_TEMPLATE_KINDS)
 
     Args:
-       obj (dict): ReplicationController or DeploymentConfig
+       obj (dict): OpenShift or Kubernetes object
 
     Returns:
-        list of dicts example:
-                [{"image":"172.17.42.145:5000/foo/bar",
-                  "original_image":"172.17.42.145:5000/foo/bar",
-                  "internal": "True"}]
+        dict: pod spec, None if object doesn't have pod spec
+    """
+    kind = obj.get("kind")
+    spec = obj.get("spec") or {}
+    if kind == "Pod":
+        return spec
+    if kind in POD_TEMPLATE_KINDS:
+        return (spec.get("template") or {}).get("spec")
+    return None
+
 
-                `original_image` shouldn't be ever modified,
-                `image` can be modified when pulling and pushing
-                images between registries
+def get_containers(obj):
     """
+    Return all containers (including init containers) of object
 
-    results = []
+    Args:
+       obj (dict): OpenShift or Kubernetes object
 
-    for container in obj["spec"]["template"]["spec"]["containers"]:
-        # get registry name from image
-        registry = container["image"].split("/")[0]
-        # get host/ip of registry (remove port)
-        host = registry.split(":")[0]
+    Returns:
+        list of container dicts, empty list if object doesn't have pod spec
+    """
+    pod_spec = get_pod_spec(obj)
+    if not pod_spec:
+        return []
+    return ((pod_spec.get("initContainers") or []) +
+            (pod_spec.get("containers") or []))
 
-        info = {"image": container["image"],
-                "original_image": container["image"],
-                "internal": None}
-        try:
-            ip = ipaddress.ip_address(host)
-            info["internal"] = ip.is_private
-            # TODO: that ip address is private doesn't mean that this
-            # is internal OpenShift registry
-        except ValueError:
-            # host is not an ip address
-            info["internal"] = False
 
-        results.append(info)
-    return results
+def get_image_references(obj):
+    """
+    Find all places in object that are referencing Docker image.
+    Those are containers and init containers in pod spec and output image
+    of BuildConfig.
+
+    Args:
+       obj (dict): OpenShift or Kubernetes object
+
+    Returns:
+        list of tuples (dict, key), where dict[key] is image name
+    """
+    references = [(container, "image") for container in get_containers(obj)
+                  if "image" in container]
+
+    if obj.get("kind") == "BuildConfig":
+        output_to = ((obj.get("spec") or {}).get("output") or {}).get("to")
+        if output_to and output_to.get("kind") == "DockerImage":
+            references.append((output_to, "name"))
+
+    return references
 
 
 def run_cmd(cmd, checkexitcode=True, stdin=None):
@@ -197,9 +262,13 @@ def run_cmd(cmd, checkexitcode=True, stdin=None):
         stderr: stderr from the command
     """
     logger.debug("running cmd %s", cmd)
-    p = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    stdout, stderr = p.communicate(stdin)
-    ec = p.returncode
+    # only command name is recorded, arguments can contain passwords
+    with span("cmd", command=os.path.basename(cmd[0])) as cmd_span:
+        p = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        stdout, stderr = p.communicate(stdin)
+        ec = p.returncode
+        cmd_span["exit_code"] = ec
+        cmd_span["bytes"] = len(stdout or b"") + len(stderr or b"")
     logger.debug("\n<<< stdout >>>\n%s<<< end >>>\n", stdout)
     logger.debug("\n<<< stderr >>>\n%s<<< end >>>\n", stderr)
 
@@ -213,24 +282,390 @@ def run_cmd(cmd, checkexitcode=True, stdin=None):
     return ec, stdout, stderr
 
 
-def get_new_name(filepath):
+@contextlib.contextmanager
+def stream_cmd(cmd, timeout=None, stop=None):
     """
-    If filepath exists get new one that doesn't.
-    Changes filename of file in path.
+    Runs a command and provides its stdout as a stream, so output can be
+    processed while command is still running.
+    If the command gives a bad exit code exception is raised (after
+    stdout is consumed). Command is killed if processing of its output
+    fails or is abandoned (eg. generator reading it is closed).
+
     Example:
-      if /foo/bar.json exists retruns /foo/bar_1.json
+        with stream_cmd(["oc", "export", "service"]) as stdout:
+            for line in stdout:
+                ...
 
     Args:
-      filepath - existing filepath
+        cmd (list): command with arguments
+        timeout (float): kill command if it doesn't finish in this number
+                         of seconds (None means no timeout)
+        stop (threading.Event): kill command when event is set
 
     Returns:
-      str - new filepath that is not existing.
+        file object with stdout of command
+    """
+    logger.debug("running cmd %s", cmd)
+    # stderr goes to file, so command can't block on full stderr pipe
+    stderr = tempfile.TemporaryFile()
+    timed_out = threading.Event()
+    with span("cmd", command=os.path.basename(cmd[0])) as cmd_span:
+        p = Popen(cmd, stdout=PIPE, stderr=stderr)
+        stdout = _CountingReader(p.stdout)
+
+        def kill():
+            timed_out.set()
+            kill_process(p)
+
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, kill)
+            timer.daemon = True
+            timer.start()
+        if stop is not None:
+            killer = threading.Thread(target=kill_on_stop, args=(p, stop))
+            killer.daemon = True
+            killer.start()
+        try:
+            yield stdout
+            # read rest of the output so command can finish
+            while stdout.read(65536):
+                pass
+        except BaseException as e:
+            # if whole output was read, command has finished and its error
+            # (reported below) is more useful than error of output parsing
+            failed = stdout.eof and p.wait() != 0
+            if not stdout.eof:
+                kill_process(p)
+            if not isinstance(e, Exception) or \
+                    not (timed_out.is_set() or failed):
+                # output is not needed anymore (or processing failed)
+                raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            p.stdout.close()
+            ec = p.wait()
+            stderr.seek(0)
+            error = stderr.read()
+            stderr.close()
+            cmd_span["exit_code"] = ec
+            cmd_span["bytes"] = stdout.bytes_read + len(error)
+            logger.debug("\n<<< stderr >>>\n%s<<< end >>>\n", error)
+
+    if stop is not None and stop.is_set():
+        raise Exception("cmd: %s was stopped" % str(cmd))
+    if timed_out.is_set():
+        logger.debug("cmd timed out: %s" % str(cmd))
+        raise Exception("cmd: %s timed out after %s seconds" % (str(cmd),
+                                                              timeout))
+    if ec != 0:
+        logger.debug("cmd failed: %s" % str(cmd))
+        raise Exception("cmd: %s failed: \n%s" % (str(cmd), error))
+
+
+def kill_process(p):
+    """
+    Kill process, ignore error if it has already finished.
+    """
+    try:
+        p.kill()
+    except OSError:
+        pass
+
+
+def kill_on_stop(p, stop):
+    """
+    Kill process when stop is set (or return when process finishes)
 
+    Args:
+        p (Popen): process
+        stop (threading.Event): event
     """
-    base, ext = os.path.splitext(filepath)
-    new_filepath = filepath
-    i = itertools.count(1)
-    while os.path.exists(new_filepath):
-        #  create new path with index /foo/bar_1.json
-        new_filepath = "{}_{}{}".format(base, i.next(), ext)
-    return new_filepath
+    while not stop.wait(1.0):
+        if p.poll() is not None:
+            return
+    kill_process(p)
+
+
+def retry(func, args=(), retries=0, delay=1.0, backoff=2.0,
+          description="operation", stop=None):
+    """
+    Call function, if it raises exception call it again (up to `retries`
+    more times). Delay between attempts grows exponentially.
+    Function is not called again once `stop` is set.
+
+    Args:
+        func: function to call
+        args (tuple): arguments for function
+        retries (int): number of retries after first failed attempt
+        delay (float): seconds to wait before first retry
+        backoff (float): multiplier of delay for every next retry
+        description (str): what is being done (for logging)
+        stop (threading.Event): stop retrying when event is set
+
+    Returns:
+        return value of function
+    """
+    attempt = 0
+    while True:
+        try:
+            return func(*args)
+        except Exception as e:
+            if attempt >= retries or (stop is not None and stop.is_set()):
+                raise
+            wait = delay * backoff ** attempt
+            attempt += 1
+            logger.warning("{} failed ({}), retrying in {:.1f}s "
+                           "(attempt {}/{})".format(description, e, wait,
+                                                    attempt, retries))
+            if stop is None:
+                time.sleep(wait)
+            elif stop.wait(wait):
+                raise
+
+
+class _CountingReader(object):
+    """
+    File object wrapper that counts bytes read from file.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.bytes_read = 0
+        # True when end of file was reached
+        self.eof = False
+
+    def read(self, size=-1):
+        # return output as soon as command prints it, don't wait for whole
+        # `size` bytes (file objects of python 2 don't have read1)
+        if size > 0 and hasattr(self.f, "read1"):
+            data = self.f.read1(size)
+        else:
+            data = self.f.read(size)
+        self.bytes_read += len(data)
+        if not data and size != 0:
+            self.eof = True
+        return data
+
+    def readline(self, size=-1):
+        line = self.f.readline(size)
+        self.bytes_read += len(line)
+        if not line and size != 0:
+            self.eof = True
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+
+# multipliers of size units (see parse_size)
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(size):
+    """
+    Parse number of bytes with optional unit suffix.
+    Example:
+      10M -> 10485760
+
+    Args:
+        size (str): size (eg. 512K, 10M, 1.5G)
+
+    Returns:
+        int: number of bytes
+    """
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMG]?)i?B?\s*$", size,
+                     re.IGNORECASE)
+    if not match:
+        raise ValueError("Invalid size {}".format(size))
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.upper()])
+
+
+def format_size(size):
+    """
+    Format number of bytes for humans
+    Example:
+      10485760 -> 10.0 MB
+
+    Args:
+        size (int): number of bytes
+
+    Returns:
+        str: formatted size
+    """
+    if abs(size) < 1024:
+        return "{} B".format(size)
+    for unit in ["KB", "MB"]:
+        size /= 1024.0
+        if abs(size) < 1024:
+            return "{:.1f} {}".format(size, unit)
+    return "{:.1f} GB".format(size / 1024.0)
+
+
+def iter_list_items(stream, kind="List"):
+    """
+    Incrementally parse JSON document of kind List from stream and yield
+    objects from its `items` one by one. Only one item at a time is kept in
+    memory.
+
+    Args:
+        stream: file object with JSON document
+        kind (str): expected kind of document
+
+    Yields:
+        dict: items of List
+    """
+    return _JSONListParser(stream, kind).items()
+
+
+def iter_json_values(stream):
+    """
+    Incrementally parse stream of concatenated JSON documents (like output
+    of `oc get --watch -o json`) and yield every document as soon as it is
+    complete. Stream is read with os.read, so it doesn't wait for full
+    chunk of data (works with pipes of running commands).
+
+    Args:
+        stream: file object with file descriptor
+
+    Yields:
+        decoded JSON documents
+    """
+    return _JSONListParser(_RawReader(stream), None).values()
+
+
+class _RawReader(object):
+    """
+    File object that returns data as soon as any are available.
+    """
+
+    def __init__(self, f):
+        self.fd = f.fileno()
+
+    def read(self, size=-1):
+        return os.read(self.fd, size if size > 0 else 65536)
+
+
+class _JSONListParser(object):
+    """
+    Incremental parser of JSON document with `items` array.
+    Everything except `items` is parsed as a whole (it is small),
+    items are decoded and returned one by one.
+    """
+
+    _whitespace = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, stream, kind, chunk_size=65536):
+        self.stream = stream
+        self.kind = kind
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _read(self):
+        """
+        Read next chunk from stream to buffer.
+        Already parsed part of buffer is dropped.
+
+        Returns:
+            bool: False if there is nothing more to read
+        """
+        if self.eof:
+            return False
+        # read at least as much as is already in buffer, so parsing
+        # of big objects is not quadratic
+        chunk = self.stream.read(max(self.chunk_size,
+                                     len(self.buffer) - self.pos))
+        if not chunk:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(
+            chunk, final=self.eof)
+        self.pos = 0
+        return True
+
+    def _next_char(self):
+        """
+        Skip whitespace and return next character (without consuming it).
+        """
+        while True:
+            self.pos = self._whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                raise ValueError("Unexpected end of JSON document")
+
+    def _expect(self, chars):
+        char = self._next_char()
+        if char not in chars:
+            raise ValueError("Expecting one of '{}' at position {}, "
+                             "got '{}'".format(chars, self.pos, char))
+        self.pos += 1
+        return char
+
+    def _value(self):
+        """
+        Decode one complete JSON value from buffer
+        """
+        self._next_char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                # value is probably not complete yet
+                if not self._read():
+                    raise
+                continue
+            if end == len(self.buffer) and not self.eof and \
+                    not isinstance(value, (dict, list)):
+                # numbers and literals might continue in next chunk
+                self._read()
+                continue
+            self.pos = end
+            return value
+
+    def values(self):
+        """
+        Decode JSON documents from stream until its end
+        """
+        while True:
+            self.pos = self._whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                yield self._value()
+            elif not self._read():
+                return
+
+    def items(self):
+        self._expect("{")
+        if self._next_char() == "}":
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            if key == "items" and self._next_char() != "[":
+                # empty list can be encoded as null
+                if self._value() is not None:
+                    raise ValueError("Expecting array of items at position "
+                                     "{}".format(self.pos))
+            elif key == "items":
+                self._expect("[")
+                if self._next_char() == "]":
+                    self.pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(",]") == "]":
+                            break
+            else:
+                value = self._value()
+                if key == "kind" and value != self.kind:
+                    msg = "Document is of diferent kind than '{}'".format(
+                        self.kind)
+                    logger.critical(msg)
+                    raise Exception(msg)
+            if self._expect(",}") == "}":
+                return
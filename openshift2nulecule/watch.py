@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+import copy
+import logging
+import os
+import threading
+import time
+
+try:
+    from queue import Empty, Queue
+except ImportError:
+    # python 2
+    from Queue import Empty, Queue
+
+from openshift2nulecule import utils
+from openshift2nulecule.openshift import OpenshiftClient, ExportedProject
+from openshift2nulecule.profiling import span
+from openshift2nulecule.scheduler import TransferScheduler
+from openshift2nulecule.writer import NuleculeWriter, load_manifest
+
+logger = logging.getLogger(__name__)
+
+
+class WatchExport(object):
+    """
+    Keeps Nulecule application in directory in sync with OpenShift project.
+
+    Objects of project are watched (see OpenshiftClient.watch) and kept in
+    memory together with artifacts generated from them. After every batch
+    of changes application is written again as incremental update (see
+    NuleculeWriter): artifacts are generated again only for changed
+    objects, only artifacts whose content changed are written, artifacts
+    of deleted objects are removed and Nulecule file is updated. Changes
+    that don't change exported object (like status updates) don't cause
+    update.
+
+    Every image is exported only once, when it is referenced for the first
+    time (images exported by previous export to the same registry are
+    skipped if their digest hasn't changed, same as with --incremental).
+    Images that failed to export are tried again with next update.
+    """
+
+    # seconds to wait for more changes before application is updated
+    delay = 1.0
+
+    def __init__(self, client, nulecule_dir, name, export_image=None,
+                 image_size=None, registry=None, only_internal=True,
+                 atomicapp_version=None, jobs=1):
+        """
+        Args:
+            client (OpenshiftClient): client of watched project
+            nulecule_dir (str): directory with application (created or
+                                updated)
+            name (str): name of application
+            export_image: function exporting one image (see
+                          ExportedProject.image_exporter), None if images
+                          are not exported
+            image_size: function returning size of image (see
+                        ExportedProject.image_size)
+            registry (str): registry where images are pushed
+            only_internal (bool): export only images from internal
+                                  OpenShift registry
+            atomicapp_version (str): Atomic App version used in Dockerfile
+            jobs (int): number of images exported concurrently and number
+                        of threads writing artifacts
+        """
+        self.client = client
+        self.nulecule_dir = nulecule_dir
+        self.name = name
+        self.export_image = export_image
+        self.image_size = image_size
+        self.registry = registry
+        self.only_internal = only_internal
+        self.atomicapp_version = atomicapp_version
+        self.jobs = jobs
+
+        self.resources = OpenshiftClient._resources()
+        # watched objects, resource: {name: exported object}
+        self.objects = {}
+        # images exported so far, original image: image info
+        self.exported = {}
+        # image index of all objects (artifacts are not kept in it)
+        self.index = ExportedProject()
+        # artifacts generated from every object, (resource, name): list of
+        # entries (see _generate)
+        self._entries = {}
+        # objects changed since last update, (resource, name)
+        self._dirty = set()
+        # manifest of application (see load_manifest), None if application
+        # doesn't exist yet
+        self.manifest = None
+        if os.path.exists(nulecule_dir):
+            self.manifest = load_manifest(nulecule_dir)
+        self._changed = False
+
+    def run(self, updates=None):
+        """
+        Watch project and update application after every change.
+        First update is done as soon as all resource types are listed.
+
+        Args:
+            updates (int): stop after this number of updates (None means
+                           never stop)
+        """
+        logger.info("Watching project {} for changes".format(self.name))
+        events = Queue()
+        stop = threading.Event()
+        self.client.watch(events, stop, self.resources)
+        try:
+            while updates is None or updates > 0:
+                self._apply(events.get())
+                # collect changes that come shortly after the first one
+                deadline = time.time() + self.delay
+                while True:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        self._apply(events.get(timeout=timeout))
+                    except Empty:
+                        break
+
+                if not self._changed or \
+                        len(self.objects) < len(self.resources):
+                    # nothing changed or some resource types are not
+                    # listed yet
+                    continue
+                self.update()
+                if updates is not None:
+                    updates -= 1
+        finally:
+            stop.set()
+
+    def _apply(self, event):
+        """
+        Apply watch event to objects
+        """
+        resource, event_type, obj = event
+        objects = self.objects.get(resource)
+        if event_type == "SYNC":
+            synced = dict((item["metadata"]["name"], item) for item in obj)
+            if synced != objects:
+                objects = objects or {}
+                for name in set(synced) | set(objects):
+                    if synced.get(name) != objects.get(name):
+                        self._dirty.add((resource, name))
+                self.objects[resource] = synced
+                self._changed = True
+            return
+
+        logger.debug("{} {} {}".format(event_type, obj["kind"],
+                                       obj["metadata"].get("name")))
+        name = obj["metadata"]["name"]
+        if event_type == "DELETED":
+            if objects.pop(name, None) is not None:
+                self._dirty.add((resource, name))
+                self._changed = True
+        elif objects.get(name) != obj:
+            objects[name] = obj
+            self._dirty.add((resource, name))
+            self._changed = True
+
+    def _generate(self, obj):
+        """
+        Generate artifacts of object and add its images to image index
+
+        Returns:
+            list of entries (dicts with `provider`, `artifact` with original
+            images, `images` it references, `rendered` artifact with new
+            image names and its `digest`)
+        """
+        entries = []
+        for provider, artifact in OpenshiftClient.provider_artifacts(
+                copy.deepcopy(obj)):
+            artifact = self.index.index_artifact(provider, artifact)
+            if artifact is None:
+                continue
+            images = set(obj[key] for obj, key in
+                         utils.get_image_references(artifact)
+                         if obj[key] in self.index.images)
+            entries.append({"provider": provider,
+                            "artifact": artifact,
+                            "images": images,
+                            "new_images": None,
+                            "rendered": None,
+                            "digest": None})
+        return entries
+
+    def _render(self, entry):
+        """
+        Return artifact of entry with new image names, artifact is
+        rendered again only if new names of its images changed.
+        """
+        new_images = dict((image, self.index.images[image]["image"])
+                          for image in entry["images"])
+        if entry["new_images"] != new_images:
+            artifact = entry["artifact"]
+            if any(new_image != image
+                   for image, new_image in new_images.items()):
+                artifact = copy.deepcopy(artifact)
+                for obj, key in utils.get_image_references(artifact):
+                    if obj[key] in new_images:
+                        obj[key] = new_images[obj[key]]
+            entry["new_images"] = new_images
+            entry["rendered"] = artifact
+            entry["digest"] = None
+        return entry["rendered"]
+
+    def update(self):
+        """
+        Write application from current objects. Artifacts are generated
+        again only for objects that changed since previous update, other
+        artifacts are written only if new names of their images changed.
+        """
+        self._changed = False
+        with span("watch update", project=self.name) as update_span:
+            dirty, self._dirty = self._dirty, set()
+            for resource, name in dirty:
+                obj = self.objects[resource].get(name)
+                if obj is None:
+                    self._entries.pop((resource, name), None)
+                else:
+                    self._entries[(resource, name)] = self._generate(obj)
+            update_span["generated"] = len(dirty)
+
+            # same order as objects are listed by OpenShift
+            entries = [entry for resource in self.resources
+                       for name in sorted(self.objects[resource])
+                       for entry in self._entries[(resource, name)]]
+            used_images = set()
+            for entry in entries:
+                used_images.update(entry["images"])
+            self._export_images(used_images)
+
+            writer = NuleculeWriter(self.nulecule_dir, self.name,
+                                    self.atomicapp_version, self.jobs,
+                                    self.manifest)
+            for entry in entries:
+                entry["relpath"] = writer.write_artifact(
+                    entry["provider"], self._render(entry),
+                    digest=entry["digest"])
+            for image in used_images:
+                if image in self.exported and \
+                        self.exported[image].get("digest"):
+                    writer.images[image] = {
+                        "digest": self.exported[image]["digest"],
+                        "image": self.exported[image]["image"],
+                        "registry": self.registry}
+            writer.close()
+            for entry in entries:
+                entry["digest"] = writer.hashes[entry["relpath"]]
+
+            previous = (self.manifest or {}).get("artifacts", {})
+            written = [path for path, digest in writer.hashes.items()
+                       if previous.get(path) != digest]
+            removed = [path for path in previous
+                       if path not in writer.hashes]
+            self.manifest = {"artifacts": dict(writer.hashes),
+                             "images": dict(writer.images)}
+            update_span["written"] = len(written)
+            update_span["removed"] = len(removed)
+
+        logger.info("Application {} updated: {} artifact(s) written, {} "
+                    "removed".format(utils.remove_path(self.nulecule_dir),
+                                     len(written), len(removed)))
+
+    def _export_images(self, images):
+        """
+        Export images (original names) that were not exported yet, new
+        names are set in image index.
+        """
+        new_images = []
+        for image in sorted(images):
+            image_info = self.index.images[image]
+            if image not in self.exported and \
+                    self.export_image is not None and \
+                    (image_info["internal"] or not self.only_internal):
+                new_images.append(image_info)
+        if not new_images:
+            return
+
+        failed = set()
+
+        def collect(result):
+            image, error = result
+            if error:
+                logger.error("Exporting image {} failed: {}".format(image,
+                                                                    error))
+                failed.add(image)
+
+        scheduler = TransferScheduler(self.export_image, self.image_size,
+                                      self.jobs, collect)
+        try:
+            for image_info in new_images:
+                scheduler.add(image_info)
+        except BaseException:
+            scheduler.terminate()
+            raise
+        finally:
+            scheduler.close()
+            scheduler.join()
+        scheduler.report()
+
+        for image_info in new_images:
+            if image_info["original_image"] not in failed:
+                self.exported[image_info["original_image"]] = image_info
@@ -0,0 +1,461 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import io
+import logging
+import os
+import sys
+import tarfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from openshift2nulecule import serializer, utils
+from openshift2nulecule.profiling import span
+from openshift2nulecule.constants import (NULECULE_PROVIDERS,
+                                          NULECULE_SPECVERSION,
+                                          ATOMICAPP_VERSION,
+                                          MANIFEST_FILE)
+
+logger = logging.getLogger(__name__)
+
+
+def load_manifest(nulecule_dir):
+    """
+    Load manifest of previously exported application
+
+    Args:
+        nulecule_dir (str): directory with Nulecule application
+
+    Returns:
+        dict: manifest with `artifacts` (path: hash) and `images`
+              (original image: {digest, image, registry}), empty manifest
+              if application doesn't have manifest
+    """
+    manifest = {"artifacts": {}, "images": {}}
+    path = os.path.join(nulecule_dir, MANIFEST_FILE)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            manifest.update(serializer.loads_json(f.read()))
+    return manifest
+
+
+class BaseWriter(object):
+    """
+    Common part of writers of Nulecule application: naming of artifact
+    files and content of Nulecule file.
+    """
+
+    # artifact files for every provider, list of tuples
+    # (kind order, sequence number, path relative to application root)
+    artifacts = None
+
+    # ImageBuild that gets application as build context (None if image is
+    # not built)
+    build = None
+
+    def __init__(self, name, atomicapp_version=ATOMICAPP_VERSION,
+                 build=None):
+        """
+        Args:
+            name (str): name (id) of application
+            atomicapp_version (str): Atomic App version used in Dockerfile
+            build (ImageBuild): build of Atomic App image from application
+                                (see DockerCliBackend.start_build)
+        """
+        self.name = name
+        self.atomicapp_version = atomicapp_version
+        self.build = build
+        # hashes of written artifacts (path: hash)
+        self.hashes = {}
+        # exported images, stored in manifest
+        self.images = {}
+
+        # used filenames (relative to application root, lower case)
+        self._filenames = set()
+        # next index to try for each filename (lower case), used when name
+        # is taken
+        self._filename_index = {}
+
+        self.artifacts = {provider: [] for provider in NULECULE_PROVIDERS}
+
+    def reserve_artifact(self, provider, artifact):
+        """
+        Reserve file for artifact that is written later (see
+        write_artifact). Filenames and order of artifacts in Nulecule file
+        are given by order in which artifacts are reserved, not by order in
+        which they are written.
+
+        Args:
+            provider (str): provider of artifact
+            artifact (dict): artifact to write
+
+        Returns:
+            str: path of artifact (relative to application root)
+        """
+        return self._add_artifact(provider, artifact)
+
+    def _add_artifact(self, provider, artifact):
+        """
+        Register artifact and return path of its file
+
+        Args:
+            provider (str): provider of artifact
+            artifact (dict): artifact to write
+
+        Returns:
+            str: path relative to application root
+        """
+        if "name" in artifact["metadata"]:
+            name = artifact["metadata"]["name"]
+        else:
+            name = "unknown"
+        kind = artifact["kind"]
+        filename = "{}-{}.json".format(name, kind)
+        relpath = self._unique_name(os.path.join("artifacts", provider,
+                                                 filename))
+
+        entries = self.artifacts[provider]
+        entries.append((utils.kind_order(provider, kind), len(entries),
+                        relpath))
+        return relpath
+
+    def _unique_name(self, filename):
+        """
+        Return filename that is not used yet and register it as used.
+        Filenames are compared without case, so files of application don't
+        overwrite each other on case insensitive filesystems.
+        Example:
+          if artifacts/foo.json was already used returns artifacts/foo_1.json
+
+        Args:
+            filename (str): requested filename
+
+        Returns:
+            str: unused filename
+        """
+        new_filename = filename
+        key = filename.lower()
+        if key in self._filenames:
+            base, ext = os.path.splitext(filename)
+            index = self._filename_index.get(key, 1)
+            while new_filename.lower() in self._filenames:
+                new_filename = "{}_{}{}".format(base, index, ext)
+                index += 1
+            self._filename_index[key] = index
+        self._filenames.add(new_filename.lower())
+        return new_filename
+
+    def _nulecule(self):
+        """
+        Return Nulecule file.
+        Artifacts in Nulecule file are ordered by kind (see
+        PROVIDER_RESOURCES)
+
+        Returns:
+            bytes: Nulecule file (YAML)
+        """
+        provider_artifacts = {}
+        for provider, entries in self.artifacts.items():
+            provider_artifacts[provider] = ["file://{}".format(path)
+                                            for _, _, path in sorted(entries)]
+
+        nulecule = {"specversion": NULECULE_SPECVERSION,
+                    "id": self.name,
+                    "metadata": {"name": self.name},
+                    "graph": [{"name": self.name,
+                               "artifacts": provider_artifacts}]}
+        return serializer.dumps_yaml(nulecule)
+
+    def _finish_build(self):
+        """
+        Wait until image is built from application
+        """
+        with span("build image", image=self.build.tag) as build_span:
+            self.build.close()
+            build_span["bytes"] = self.build.bytes_written
+
+
+class NuleculeWriter(BaseWriter):
+    """
+    Writes Nulecule application to directory.
+    Every artifact is written as soon as it is added (in one of `jobs`
+    writer threads), Nulecule file and Dockerfile are written when writer
+    is closed.
+    Filenames are assigned from in-memory registry of already used names,
+    there are no checks on disk (directory is always created by writer).
+
+    If manifest of previous export is given, existing application is
+    updated. Only artifacts whose content changed are written and
+    artifacts that are not part of application anymore are removed.
+    Manifest with hashes of artifacts and exported images (`images`)
+    is written to application directory when writer is closed.
+
+    If build is given, application directory (without manifest) is sent as
+    build context to it when writer is closed.
+
+    If journal is given, every artifact file is recorded in it as soon as
+    it is written (see ExportJournal).
+    """
+
+    # directory with Nulecule application
+    nulecule_dir = None
+
+    def __init__(self, nulecule_dir, name,
+                 atomicapp_version=ATOMICAPP_VERSION, jobs=1, manifest=None,
+                 build=None, journal=None):
+        """
+        Args:
+            nulecule_dir (str): directory where application is created
+            name (str): name (id) of application
+            atomicapp_version (str): Atomic App version used in Dockerfile
+            jobs (int): number of threads writing artifacts
+            manifest (dict): manifest of previous export (see load_manifest),
+                             if None new application is created
+            build (ImageBuild): build of Atomic App image from application
+            journal (ExportJournal): journal where written artifacts are
+                                     recorded
+        """
+        super(NuleculeWriter, self).__init__(name, atomicapp_version, build)
+        self.nulecule_dir = nulecule_dir
+        self.journal = journal
+
+        self.previous = manifest
+        if manifest:
+            self.images.update(manifest["images"])
+
+        jobs = max(jobs, 1)
+        self._pool = ThreadPool(jobs)
+        # limit number of artifacts waiting to be written, so they don't
+        # accumulate in memory if writing is slower than exporting
+        self._pending = threading.BoundedSemaphore(jobs * 2)
+        self._errors = []
+
+        self.provider_paths = {provider: os.path.join(nulecule_dir,
+                                                      "artifacts", provider)
+                               for provider in NULECULE_PROVIDERS}
+        for path in self.provider_paths.values():
+            if not (self.previous and os.path.isdir(path)):
+                os.makedirs(path)
+
+    def write_artifact(self, provider, artifact, relpath=None, digest=None):
+        """
+        Write artifact file
+
+        Args:
+            provider (str): provider of artifact
+            artifact (dict): artifact to write
+            relpath (str): path returned by reserve_artifact, if None new
+                           path is assigned
+            digest (str): hash of artifact if it is already known (see
+                          `hashes`), artifact that has not changed since
+                          previous export is then not serialized again
+
+        Returns:
+            str: path of artifact (relative to application root)
+        """
+        if relpath is None:
+            relpath = self._add_artifact(provider, artifact)
+        self._pending.acquire()
+        self._pool.apply_async(self._write_file, (artifact, relpath, digest))
+        return relpath
+
+    def _unchanged(self, relpath, digest):
+        """
+        Return True if artifact file of previous export has given hash
+        """
+        return bool(self.previous and
+                    self.previous["artifacts"].get(relpath) == digest and
+                    os.path.exists(os.path.join(self.nulecule_dir, relpath)))
+
+    def _write_file(self, artifact, relpath, digest=None):
+        """
+        Serialize artifact to file (runs in writer thread).
+        When updating existing application, file is written only if its
+        content changed.
+        """
+        filepath = os.path.join(self.nulecule_dir, relpath)
+        try:
+            with span("write artifact", path=relpath) as write_span:
+                data = None
+                if digest is None or not self._unchanged(relpath, digest):
+                    data = serializer.dumps_json(artifact)
+                    digest = hashlib.sha256(data).hexdigest()
+                self.hashes[relpath] = digest
+                if self._unchanged(relpath, digest):
+                    logger.debug("{} has not changed".format(relpath))
+                    write_span["unchanged"] = True
+                else:
+                    with open(filepath, "wb") as f:
+                        f.write(data)
+                    write_span["bytes"] = len(data)
+                if self.journal is not None:
+                    self.journal.add_written(self.name, relpath, digest)
+        except Exception as e:
+            logger.error("Writing {} failed: {}".format(filepath, e))
+            self._errors.append(e)
+        finally:
+            self._pending.release()
+
+    def _remove_stale_files(self):
+        """
+        Remove artifacts of previous export that were not written now.
+        """
+        for relpath in self.previous["artifacts"]:
+            if relpath not in self.hashes:
+                filepath = os.path.join(self.nulecule_dir, relpath)
+                if os.path.exists(filepath):
+                    logger.info("Removing {}".format(relpath))
+                    os.remove(filepath)
+
+    def close(self):
+        """
+        Write Nulecule file and Dockerfile (and build image if build is
+        set).
+        """
+        # wait for all artifacts to be written
+        with span("wait for writers"):
+            self._pool.close()
+            self._pool.join()
+        if self._errors:
+            msg = "Failed to write {} artifact(s)".format(len(self._errors))
+            logger.critical(msg)
+            raise Exception(msg)
+
+        if self.previous:
+            self._remove_stale_files()
+
+        with span("write nulecule", objects=len(self.hashes)):
+            with open(os.path.join(self.nulecule_dir, "Nulecule"), "wb") as f:
+                f.write(self._nulecule())
+
+        utils.generate_dockerfile(self.nulecule_dir, self.atomicapp_version)
+
+        with open(os.path.join(self.nulecule_dir, MANIFEST_FILE), "wb") as f:
+            f.write(serializer.dumps_json({"artifacts": self.hashes,
+                                           "images": self.images},
+                                          sort_keys=True))
+
+        if self.build:
+            # hidden files (manifest) are not part of image
+            tar = tarfile.open(fileobj=self.build, mode="w|")
+            for filename in sorted(os.listdir(self.nulecule_dir)):
+                if not filename.startswith("."):
+                    tar.add(os.path.join(self.nulecule_dir, filename),
+                            arcname=filename)
+            tar.close()
+            self._finish_build()
+
+
+class _Tee(object):
+    """
+    Write-only file object that writes data to more file objects.
+    """
+
+    def __init__(self, files):
+        self.files = files
+
+    def write(self, data):
+        for f in self.files:
+            f.write(data)
+
+
+class TarWriter(BaseWriter):
+    """
+    Writes Nulecule application directly to tar archive (optionally gzip
+    compressed), no files are created on disk.
+
+    Archive is written as a stream, so it can be written to stdout or pipe.
+    Every artifact is added to archive as soon as it is written, Nulecule
+    file and Dockerfile (generated from list of written files) are added
+    when writer is closed. Archive has the same layout as application
+    directory created by NuleculeWriter, so it can be used as build
+    context - if build is given, archive is streamed to it as well.
+
+    Existing archive can't be updated, so manifest is not written.
+    """
+
+    # path to archive ("-" for stdout)
+    path = None
+
+    def __init__(self, path, name, atomicapp_version=ATOMICAPP_VERSION,
+                 compress=False, build=None):
+        """
+        Args:
+            path (str): path to archive, "-" for stdout
+            name (str): name (id) of application
+            atomicapp_version (str): Atomic App version used in Dockerfile
+            compress (bool): gzip compress archive
+            build (ImageBuild): build of Atomic App image from application
+        """
+        super(TarWriter, self).__init__(name, atomicapp_version, build)
+        self.path = path
+        if path == "-":
+            # binary stdout (python 3) or stdout itself (python 2)
+            self._file = getattr(sys.stdout, "buffer", sys.stdout)
+        else:
+            self._file = open(path, "wb")
+
+        outputs = [self._file]
+        if build:
+            outputs.append(build)
+        self._tar = tarfile.open(fileobj=_Tee(outputs),
+                                 mode="w|gz" if compress else "w|")
+        # all entries get the same modification time
+        self._mtime = int(time.time())
+
+        self._add_directory("artifacts")
+        for provider in NULECULE_PROVIDERS:
+            self._add_directory(os.path.join("artifacts", provider))
+
+    def _add_directory(self, relpath):
+        info = tarfile.TarInfo(relpath)
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        info.mtime = self._mtime
+        self._tar.addfile(info)
+
+    def _add_file(self, relpath, data):
+        info = tarfile.TarInfo(relpath)
+        info.size = len(data)
+        info.mode = 0o644
+        info.mtime = self._mtime
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def write_artifact(self, provider, artifact, relpath=None):
+        """
+        Add artifact to archive
+
+        Args:
+            provider (str): provider of artifact
+            artifact (dict): artifact to write
+            relpath (str): path returned by reserve_artifact, if None new
+                           path is assigned
+        """
+        if relpath is None:
+            relpath = self._add_artifact(provider, artifact)
+        with span("write artifact", path=relpath) as write_span:
+            data = serializer.dumps_json(artifact)
+            self.hashes[relpath] = hashlib.sha256(data).hexdigest()
+            self._add_file(relpath, data)
+            write_span["bytes"] = len(data)
+
+    def close(self):
+        """
+        Add Nulecule file and Dockerfile and finish archive (and build image
+        if build is set).
+        """
+        with span("write nulecule", objects=len(self.hashes)):
+            self._add_file("Nulecule", self._nulecule())
+        self._add_file("Dockerfile", utils.dockerfile_content(
+            ["Nulecule", "Dockerfile"],
+            self.atomicapp_version).encode("utf-8"))
+        self._tar.close()
+
+        if self.path == "-":
+            self._file.flush()
+        else:
+            self._file.close()
+
+        if self.build:
+            self._finish_build()
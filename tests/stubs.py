@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Stub HTTP servers used by unit tests instead of Docker daemon, registries
+and OpenShift API. Every server runs in its own thread, records received
+requests and answers them with function given by test.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn, UnixStreamServer
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    # python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+    from urlparse import urlparse, parse_qs
+
+
+class StubRequest(object):
+    """
+    Request received by stub server
+    """
+
+    def __init__(self, method, path, headers, body):
+        url = urlparse(path)
+        self.method = method
+        self.path = url.path
+        self.query = dict((key, values[-1]) for key, values in
+                          parse_qs(url.query, keep_blank_values=True).items())
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body.decode("utf-8"))
+
+
+class StubResponse(object):
+    """
+    Response of stub server. Body is bytes, dict/list (sent as JSON) or
+    list of bytes chunks (sent with chunked transfer encoding).
+    """
+
+    def __init__(self, status=200, body=b"", headers=None, chunked=False):
+        self.status = status
+        self.headers = headers or {}
+        self.chunked = chunked
+        if isinstance(body, (dict, list)) and not chunked:
+            body = json.dumps(body).encode("utf-8")
+            self.headers.setdefault("Content-Type", "application/json")
+        self.body = body
+
+
+def _handler_class(server):
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def address_string(self):
+            return "stub"
+
+        def _read_body(self):
+            if self.headers.get("Transfer-Encoding") == "chunked":
+                data = b""
+                while True:
+                    size = int(self.rfile.readline().strip(), 16)
+                    chunk = self.rfile.read(size)
+                    self.rfile.readline()
+                    if not size:
+                        return data
+                    data += chunk
+            length = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(length)
+
+        def _handle(self):
+            request = StubRequest(self.command, self.path,
+                                  dict(self.headers.items()),
+                                  self._read_body())
+            with server.lock:
+                server.requests.append(request)
+            response = server.respond(request)
+            if response is None:
+                response = StubResponse(404, {"message": "not found"})
+            if isinstance(response, StubDrop):
+                # close connection without response
+                self.close_connection = True
+                return
+            self.send_response(response.status)
+            for name, value in response.headers.items():
+                self.send_header(name, value)
+            if response.chunked:
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for chunk in response.body:
+                    self.wfile.write("{:x}\r\n".format(len(chunk))
+                                     .encode("ascii") + chunk + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+            else:
+                self.send_header("Content-Length", str(len(response.body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(response.body)
+
+        do_GET = do_POST = do_PUT = do_PATCH = do_HEAD = do_DELETE = _handle
+
+    return StubHandler
+
+
+class StubDrop(object):
+    """
+    Response that closes connection without answering
+    """
+
+
+class _ThreadingTCPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingUnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class StubServer(object):
+    """
+    HTTP server answering requests with `respond(request)` (returns
+    StubResponse, None for 404). Listens on localhost or on unix socket.
+    """
+
+    def __init__(self, respond, unix=False):
+        self.respond = respond
+        self.requests = []
+        self.lock = threading.Lock()
+        self._tmpdir = None
+        if unix:
+            self._tmpdir = tempfile.mkdtemp()
+            self.socket_path = os.path.join(self._tmpdir, "stub.sock")
+            self._server = _ThreadingUnixServer(self.socket_path,
+                                                _handler_class(self))
+            self.url = "unix://" + self.socket_path
+        else:
+            self._server = _ThreadingTCPServer(("127.0.0.1", 0),
+                                               _handler_class(self))
+            self.url = "http://127.0.0.1:{}".format(
+                self._server.server_address[1])
+        self.host = self.url.split("://", 1)[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={"poll_interval": 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+
+    def paths(self, method=None):
+        """
+        Return paths of received requests (with given method)
+        """
+        return [request.path for request in self.requests
+                if method is None or request.method == method]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._tmpdir:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from stubs import StubResponse, StubServer
+
+from openshift2nulecule.api import OpenshiftApiClient
+from openshift2nulecule.openshift import OpenshiftClient
+
+
+def _service(name, version):
+    return {"metadata": {"name": name, "namespace": "myproject",
+                         "uid": "uid-" + name,
+                         "resourceVersion": str(version)},
+            "spec": {"clusterIP": "172.30.0.1", "ports": [{"port": 80}]},
+            "status": {"loadBalancer": {}}}
+
+
+class StubApi(object):
+    """
+    OpenShift API stub: paginated list of services (continue token is
+    offset of next chunk), other resources are empty
+    """
+
+    def __init__(self, services):
+        self.services = services
+        # list resourceVersion, changes with any change in cluster
+        self.version = 100
+        # number of continue requests answered with 410 Gone
+        self.expire = 0
+
+    def __call__(self, request):
+        if not request.path.startswith("/api/v1/namespaces/myproject/") and \
+                not request.path.startswith("/oapi/v1/namespaces/myproject/"):
+            return None
+        if not request.path.endswith("/services"):
+            items = []
+        else:
+            items = self.services
+        limit = int(request.query.get("limit", len(items) or 1))
+        offset = 0
+        if request.query.get("continue"):
+            if self.expire:
+                self.expire -= 1
+                return StubResponse(410, {"kind": "Status",
+                                          "reason": "Expired",
+                                          "message": "too old"})
+            offset = int(request.query["continue"])
+        metadata = {"resourceVersion": str(self.version)}
+        if offset + limit < len(items):
+            metadata["continue"] = str(offset + limit)
+        return StubResponse(200, {"kind": "ServiceList",
+                                  "metadata": metadata,
+                                  "items": items[offset:offset + limit]})
+
+
+class OpenshiftApiClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.api = StubApi([_service("web{}".format(i), i)
+                            for i in range(5)])
+        self.server = StubServer(self.api)
+        self.tmpdir = tempfile.mkdtemp()
+        self.kubeconfig = os.path.join(self.tmpdir, "config")
+        with open(self.kubeconfig, "w") as f:
+            f.write("current-context: dev\n"
+                    "contexts:\n"
+                    "- name: dev\n"
+                    "  context: {cluster: stub, user: dev,"
+                    " namespace: myproject}\n"
+                    "clusters:\n"
+                    "- name: stub\n"
+                    "  cluster: {server: '" + self.server.url + "'}\n"
+                    "users:\n"
+                    "- name: dev\n"
+                    "  user: {token: secret}\n")
+        self.client = OpenshiftApiClient(oc_config=self.kubeconfig,
+                                         chunk_size=2)
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _list_requests(self):
+        return [request for request in self.server.requests
+                if request.path.endswith("/services")]
+
+    def test_config(self):
+        self.assertEqual(self.client.namespace, "myproject")
+        list(self.client._iter_resource("service"))
+        request = self.server.requests[-1]
+        self.assertEqual(request.headers.get("Authorization"),
+                         "Bearer secret")
+
+    def test_pagination(self):
+        objects = list(self.client._iter_resource("service"))
+        self.assertEqual([obj["metadata"]["name"] for obj in objects],
+                         ["web0", "web1", "web2", "web3", "web4"])
+        self.assertEqual(objects[0]["kind"], "Service")
+        self.assertNotIn("resourceVersion", objects[0]["metadata"])
+        self.assertNotIn("clusterIP", objects[0]["spec"])
+
+        requests = self._list_requests()
+        self.assertEqual(len(requests), 3)
+        self.assertEqual([request.query["limit"] for request in requests],
+                         ["2", "2", "2"])
+        self.assertEqual([request.query.get("continue")
+                          for request in requests], [None, "2", "4"])
+
+    def test_selector(self):
+        client = OpenshiftApiClient(oc_config=self.kubeconfig,
+                                    selector="app=web")
+        list(client._iter_resource("service"))
+        request, = self._list_requests()
+        self.assertEqual(request.query["labelSelector"], "app=web")
+
+    def test_expired_continue_token(self):
+        self.api.expire = 1
+        objects = list(self.client._iter_resource("service"))
+        # listing was started again, no object is lost or duplicated
+        self.assertEqual([obj["metadata"]["name"] for obj in objects],
+                         ["web0", "web1", "web2", "web3", "web4"])
+        self.assertEqual([request.query.get("continue")
+                          for request in self._list_requests()],
+                         [None, "2", None, "2", "4"])
+
+    def test_expired_continue_token_repeatedly(self):
+        self.api.expire = 10
+        with self.assertRaises(Exception) as cm:
+            list(self.client._iter_resource("service"))
+        self.assertIn("410", str(cm.exception))
+
+    def test_error(self):
+        self.server.respond = lambda request: StubResponse(
+            403, {"message": "forbidden"})
+        with self.assertRaises(Exception) as cm:
+            list(self.client._iter_resource("service"))
+        self.assertIn("403", str(cm.exception))
+
+    def test_fingerprint_requests_metadata(self):
+        self.client.fingerprint(["service"])
+        for request in self._list_requests():
+            self.assertIn("PartialObjectMetadataList",
+                          request.headers.get("Accept"))
+
+    def test_fingerprint_ignores_unrelated_changes(self):
+        fingerprint = self.client.fingerprint(["service", "deploymentConfig"])
+        # something else changed in cluster
+        self.api.version += 1
+        self.assertEqual(
+            self.client.fingerprint(["service", "deploymentConfig"]),
+            fingerprint)
+
+    def test_fingerprint_changes(self):
+        fingerprint = self.client.fingerprint(["service"])
+        self.api.services[3] = _service("web3", 10)
+        modified = self.client.fingerprint(["service"])
+        self.assertNotEqual(modified, fingerprint)
+        del self.api.services[0]
+        self.assertNotEqual(self.client.fingerprint(["service"]), modified)
+
+    def test_oc_client_fingerprint(self):
+        # oc is not run, objects are listed through REST API
+        client = OpenshiftClient(oc=os.path.join(self.tmpdir, "oc"),
+                                 oc_config=self.kubeconfig)
+        self.assertEqual(client.fingerprint(["service"]),
+                         self.client.fingerprint(["service"]))
+        for request in self._list_requests():
+            self.assertIn("PartialObjectMetadataList",
+                          request.headers.get("Accept"))
+
+    def test_oc_client_fingerprint_unavailable(self):
+        self.server.respond = lambda request: StubResponse(
+            401, {"kind": "Status", "message": "Unauthorized"})
+        client = OpenshiftClient(oc=os.path.join(self.tmpdir, "oc"),
+                                 oc_config=self.kubeconfig)
+        self.assertIsNone(client.fingerprint(["service"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
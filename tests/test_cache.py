@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from openshift2nulecule.cache import ExportCache
+
+
+class StubClient(object):
+    """
+    Client with objects and fingerprint set by test
+    """
+
+    def __init__(self, objects, fingerprint):
+        self.objects = objects
+        self.fingerprint_value = fingerprint
+        # number of exports
+        self.exports = 0
+
+    def cache_key(self):
+        return "https://openshift.example.com:8443", "myproject", None
+
+    def fingerprint(self, resources):
+        return self.fingerprint_value
+
+    def _iter_resources(self, resources):
+        self.exports += 1
+        for obj in self.objects:
+            yield obj
+
+
+def _service(name):
+    return {"kind": "Service", "apiVersion": "v1",
+            "metadata": {"name": name}, "spec": {"ports": [{"port": 80}]}}
+
+
+class ExportCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ExportCache(os.path.join(self.tmpdir, "cache"))
+        self.client = StubClient([_service("web"), _service(u"démo")], "f1")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _objects(self, cache=None, resources=("service",)):
+        return list((cache or self.cache).iter_objects(self.client,
+                                                       list(resources)))
+
+    def test_write_and_read(self):
+        self.assertEqual(self._objects(), self.client.objects)
+        self.assertEqual(self.client.exports, 1)
+        meta = self.cache.load_meta(*self.client.cache_key())
+        self.assertEqual(meta["fingerprint"], "f1")
+        self.assertEqual(meta["resources"], ["service"])
+
+        self.assertEqual(self._objects(), self.client.objects)
+        self.assertEqual(self.client.exports, 1)
+
+    def test_fingerprint_mismatch(self):
+        self._objects()
+        self.client.objects = [_service("db")]
+        self.client.fingerprint_value = "f2"
+        self.assertEqual(self._objects(), [_service("db")])
+        self.assertEqual(self.client.exports, 2)
+        self.assertEqual(
+            self.cache.load_meta(*self.client.cache_key())["fingerprint"],
+            "f2")
+        # other resource types are exported again
+        self._objects(resources=["service", "route"])
+        self.assertEqual(self.client.exports, 3)
+
+    def test_no_fingerprint(self):
+        self.client.fingerprint_value = None
+        self._objects()
+        self._objects()
+        self.assertEqual(self.client.exports, 2)
+        # objects are still cached for offline use
+        offline = ExportCache(os.path.join(self.tmpdir, "cache"),
+                              offline=True)
+        self.assertEqual(self._objects(offline), self.client.objects)
+        self.assertEqual(self.client.exports, 2)
+
+    def test_interrupted_export_not_cached(self):
+        objects = self.cache.iter_objects(self.client, ["service"])
+        next(objects)
+        objects.close()
+        self.assertIsNone(self.cache.load_meta(*self.client.cache_key()))
+
+    def test_offline_without_entry(self):
+        offline = ExportCache(os.path.join(self.tmpdir, "cache"),
+                              offline=True)
+        with self.assertRaises(Exception):
+            self._objects(offline)
+
+
+if __name__ == "__main__":
+    unittest.main()
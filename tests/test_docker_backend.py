@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import json
+import unittest
+
+from stubs import StubResponse, StubServer
+
+try:
+    import docker
+except ImportError:
+    docker = None
+
+from openshift2nulecule.docker_backend import DockerApiBackend
+
+
+def _stream(*messages):
+    return [json.dumps(message).encode("utf-8") + b"\r\n"
+            for message in messages]
+
+
+class StubDocker(object):
+    """
+    Docker daemon stub: pull, tag, push and auth endpoints of Engine API
+    """
+
+    def __init__(self):
+        self.pull_messages = [{"status": "Pulling from p/web"},
+                              {"id": "abc", "status": "Downloading",
+                               "progress": "[==>   ]"},
+                              {"status": "Downloaded newer image"}]
+        self.push_messages = [{"status": "Pushed"}]
+        self.tag_status = 201
+        self.auth_status = 200
+
+    def __call__(self, request):
+        path = request.path
+        if path.endswith("/version"):
+            return StubResponse(200, {"ApiVersion": "1.41",
+                                      "Version": "20.10.0"})
+        if path.endswith("/auth"):
+            return StubResponse(self.auth_status,
+                                {"Status": "Login Succeeded"}
+                                if self.auth_status == 200
+                                else {"message": "unauthorized"})
+        if path.endswith("/images/create"):
+            return StubResponse(200, _stream(*self.pull_messages),
+                                chunked=True)
+        if path.endswith("/tag"):
+            return StubResponse(self.tag_status, b"")
+        if path.endswith("/push"):
+            return StubResponse(200, _stream(*self.push_messages),
+                                chunked=True)
+        return None
+
+
+@unittest.skipIf(docker is None, "docker-py is not installed")
+class DockerApiBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.daemon = StubDocker()
+        self.server = StubServer(self.daemon, unix=True)
+        self.backend = DockerApiBackend(self.server.url, timeout=10)
+
+    def tearDown(self):
+        self.server.close()
+
+    def _requests(self, suffix):
+        return [request for request in self.server.requests
+                if request.path.endswith(suffix)]
+
+    def test_pull(self):
+        self.backend.pull("registry.example.com:5000/p/web:1.0")
+        request, = self._requests("/images/create")
+        self.assertEqual(request.query["fromImage"],
+                         "registry.example.com:5000/p/web")
+        self.assertEqual(request.query["tag"], "1.0")
+
+    def test_pull_digest(self):
+        self.backend.pull("registry.example.com/p/web@sha256:abc")
+        request, = self._requests("/images/create")
+        self.assertEqual(request.query["fromImage"],
+                         "registry.example.com/p/web")
+        self.assertEqual(request.query["tag"], "sha256:abc")
+
+    def test_pull_error(self):
+        self.daemon.pull_messages.append({"error": "manifest unknown"})
+        with self.assertRaises(Exception) as cm:
+            self.backend.pull("registry.example.com/p/web:1.0")
+        self.assertIn("manifest unknown", str(cm.exception))
+        self.assertIn("registry.example.com/p/web:1.0", str(cm.exception))
+
+    def test_tag(self):
+        self.backend.tag("registry.example.com/p/web:1.0",
+                         "localhost:5000/p/web:1.0")
+        request, = self._requests("/tag")
+        self.assertIn("/images/registry.example.com/p/web:1.0/tag",
+                      request.path)
+        self.assertEqual(request.query["repo"], "localhost:5000/p/web")
+        self.assertEqual(request.query["tag"], "1.0")
+        self.assertEqual(request.query["force"], "1")
+
+    def test_tag_not_created(self):
+        # daemon answers without 201 Created
+        self.daemon.tag_status = 200
+        with self.assertRaises(Exception) as cm:
+            self.backend.tag("p/web:1.0", "localhost:5000/p/web:1.0")
+        self.assertIn("Tagging image p/web:1.0", str(cm.exception))
+
+    def test_tag_missing_image(self):
+        self.daemon.tag_status = 404
+        with self.assertRaises(docker.errors.APIError):
+            self.backend.tag("p/web:1.0", "localhost:5000/p/web:1.0")
+
+    def test_push(self):
+        self.backend.push("localhost:5000/p/web:1.0")
+        request, = self._requests("/push")
+        self.assertIn("/images/localhost:5000/p/web/push", request.path)
+        self.assertEqual(request.query["tag"], "1.0")
+
+    def test_push_error(self):
+        self.daemon.push_messages.append({"error": "denied: access"})
+        with self.assertRaises(Exception) as cm:
+            self.backend.push("localhost:5000/p/web:1.0")
+        self.assertIn("denied: access", str(cm.exception))
+
+    def test_login_credentials_used_for_push(self):
+        self.backend.login("localhost:5000", "dev", "secret")
+        auth, = self._requests("/auth")
+        self.assertEqual(auth.json()["username"], "dev")
+        self.assertEqual(auth.json()["serveraddress"], "localhost:5000")
+
+        self.backend.push("localhost:5000/p/web:1.0")
+        push, = self._requests("/push")
+        header = push.headers.get("X-Registry-Auth")
+        self.assertTrue(header)
+        padding = "=" * (-len(header) % 4)
+        credentials = json.loads(base64.urlsafe_b64decode(
+            (header + padding).encode("ascii")).decode("utf-8"))
+        self.assertEqual(credentials["username"], "dev")
+        self.assertEqual(credentials["password"], "secret")
+
+    def test_login_failed(self):
+        self.daemon.auth_status = 401
+        with self.assertRaises(docker.errors.APIError):
+            self.backend.login("localhost:5000", "dev", "wrong")
+
+    def test_connection_reused(self):
+        self.backend.pull("p/web:1.0")
+        self.backend.tag("p/web:1.0", "localhost:5000/p/web:1.0")
+        self.backend.push("localhost:5000/p/web:1.0")
+        self.assertEqual(len(self._requests("/version")), 1)
+
+    def test_message_split_between_chunks(self):
+        data = b"".join(_stream(*self.daemon.pull_messages))
+        # every message is split in the middle
+        self.daemon.pull_messages = []
+        chunks = [data[i:i + 7] for i in range(0, len(data), 7)]
+        self.server.respond = lambda request: (
+            StubResponse(200, chunks, chunked=True)
+            if request.path.endswith("/images/create")
+            else self.daemon(request))
+        self.backend.pull("p/web:1.0")
+
+
+class ConsumeStreamTest(unittest.TestCase):
+
+    def test_split_messages(self):
+        data = b"".join(_stream({"status": "Pulling"},
+                                {"id": "abc", "status": "Downloading"}))
+        DockerApiBackend._consume_stream(
+            [data[i:i + 5] for i in range(0, len(data), 5)], "p/web")
+
+    def test_split_error(self):
+        data = json.dumps({"error": "manifest unknown"}).encode("utf-8")
+        with self.assertRaises(Exception) as cm:
+            DockerApiBackend._consume_stream([data[:10], data[10:]],
+                                             "p/web")
+        self.assertIn("manifest unknown", str(cm.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()
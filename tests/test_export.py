@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from openshift2nulecule.cli.main import CLI
+from openshift2nulecule.export import export_partitions
+from openshift2nulecule.journal import ExportJournal
+
+
+def _service(name):
+    return {"kind": "Service", "apiVersion": "v1",
+            "metadata": {"name": name, "labels": {"app": name}},
+            "spec": {"ports": [{"port": 80}]}}
+
+
+class ExportPartitionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.journal_path = os.path.join(self.tmpdir, "journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_resume_reads_journal(self):
+        journal = ExportJournal(self.journal_path)
+        journal.start(["web", "db"])
+        for name in ["web", "db"]:
+            journal.fetch_started(name)
+            journal.add_object(name, "openshift", _service(name))
+            journal.fetch_finished(name)
+        journal.close()
+
+        # oc doesn't exist, project can't be fetched
+        options = CLI().parser.parse_args(
+            ["--project", "myproject", "--group-by", "app",
+             "--output", self.tmpdir, "--output-format", "dir",
+             "--oc", os.path.join(self.tmpdir, "oc"), "--resume"])
+        failed = export_partitions(options, "myproject", self.tmpdir,
+                                   journal=ExportJournal(self.journal_path,
+                                                         True))
+        self.assertEqual(failed, [])
+        for name in ["web", "db"]:
+            with open(os.path.join(self.tmpdir, name, "artifacts",
+                                   "openshift",
+                                   "{}-Service.json".format(name))) as f:
+                self.assertEqual(json.load(f)["metadata"]["name"], name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import pickle
+import unittest
+
+from openshift2nulecule.image import ImageRef
+
+
+class ImageRefTest(unittest.TestCase):
+
+    def tearDown(self):
+        ImageRef.set_internal_registries(None)
+
+    def _parts(self, name):
+        ref = ImageRef.parse(name)
+        return ref.registry, ref.path, ref.tag, ref.digest
+
+    def test_parse(self):
+        self.assertEqual(self._parts("centos"),
+                         (None, "centos", None, None))
+        self.assertEqual(self._parts("centos/mysql-56:5.6"),
+                         (None, "centos/mysql-56", "5.6", None))
+        self.assertEqual(self._parts("docker.io/centos/mysql"),
+                         ("docker.io", "centos/mysql", None, None))
+        self.assertEqual(self._parts("localhost/web"),
+                         ("localhost", "web", None, None))
+
+    def test_parse_port(self):
+        self.assertEqual(self._parts("172.30.1.1:5000/p/web"),
+                         ("172.30.1.1:5000", "p/web", None, None))
+        self.assertEqual(self._parts("localhost:5000/p/web:1.0"),
+                         ("localhost:5000", "p/web", "1.0", None))
+
+    def test_parse_digest(self):
+        digest = "sha256:" + "a" * 64
+        self.assertEqual(self._parts("centos@" + digest),
+                         (None, "centos", None, digest))
+        self.assertEqual(self._parts("reg.example.com:5000/p/web@" + digest),
+                         ("reg.example.com:5000", "p/web", None, digest))
+
+    def test_names(self):
+        ref = ImageRef.parse("centos")
+        self.assertEqual(ref.repository, "library/centos")
+        self.assertEqual(ref.reference, "latest")
+        self.assertEqual(ref.split(),
+                         ("docker.io", "library/centos", "latest"))
+
+        ref = ImageRef.parse("172.30.1.1:5000/p/web:1.0")
+        self.assertEqual(ref.repository, "p/web")
+        self.assertEqual(ref.repository_name, "172.30.1.1:5000/p/web")
+        self.assertEqual(ref.split(), ("172.30.1.1:5000", "p/web", "1.0"))
+
+    def test_with_registry(self):
+        self.assertEqual(
+            ImageRef.parse("172.30.1.1:5000/p/web:1.0").with_registry(
+                "reg.example.com").name, "reg.example.com/p/web:1.0")
+        self.assertEqual(
+            ImageRef.parse("p/web@sha256:abc").with_registry(
+                "localhost:5000").name, "localhost:5000/p/web@sha256:abc")
+        self.assertEqual(ImageRef.parse("centos").with_registry("r.io").name,
+                         "r.io/centos")
+
+    def test_pickle(self):
+        ref = ImageRef.parse("reg.example.com/p/web:1.0")
+        self.assertIs(pickle.loads(pickle.dumps(ref)), ref)
+
+    def test_internal_registry_guessed(self):
+        for registry in ["172.30.1.1:5000", "10.0.0.1", "192.168.1.1:5000",
+                         "docker-registry.default.svc:5000",
+                         "docker-registry.default.svc.cluster.local"]:
+            self.assertTrue(ImageRef.is_internal_registry(registry),
+                            registry)
+        for registry in [None, "docker.io", "8.8.8.8:5000",
+                         "reg.example.com:5000", "localhost:5000"]:
+            self.assertFalse(ImageRef.is_internal_registry(registry),
+                             registry)
+        self.assertTrue(ImageRef.parse("172.30.1.1:5000/p/web").internal)
+        self.assertFalse(ImageRef.parse("centos").internal)
+
+    def test_internal_registry_configured(self):
+        ImageRef.set_internal_registries(["reg.example.com",
+                                          "other.example.com:5000"])
+        self.assertTrue(ImageRef.is_internal_registry("reg.example.com:443"))
+        self.assertTrue(ImageRef.is_internal_registry(
+            "other.example.com:5000"))
+        self.assertFalse(ImageRef.is_internal_registry(
+            "other.example.com:6000"))
+        # guessing is not used
+        self.assertFalse(ImageRef.is_internal_registry("172.30.1.1:5000"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from openshift2nulecule.image import ImageRef
+from openshift2nulecule.journal import (IMAGE_EXPORTED, IMAGE_PULLED,
+                                        ExportJournal)
+from openshift2nulecule.openshift import ExportedProject
+
+IMAGE = "172.30.1.1:5000/myproject/web:latest"
+REGISTRY = "localhost:5000"
+
+
+class StubProject(ExportedProject):
+    """
+    Project with image operations that only record what was done
+    """
+
+    def __init__(self):
+        ExportedProject.__init__(self, docker=object())
+        self.operations = []
+        self.push_error = None
+
+    def _login(self, registry, username, password):
+        pass
+
+    def _pull_image(self, image_info, oc_registry):
+        self.operations.append("pull")
+        image_info["image"] = image_info["original_image"]
+
+    def _push_image(self, image_info, registry, journal=None, tagged=False):
+        self.operations.append("push")
+        if self.push_error:
+            raise self.push_error
+        image_info["image"] = "{}/myproject/web:latest".format(registry)
+
+
+class ImageJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _export(self, resume=False, push_error=None):
+        journal = ExportJournal(self.path, resume)
+        journal.start(["myproject"])
+        project = StubProject()
+        project.push_error = push_error
+        transfer = project.image_exporter("172.30.1.1:5000", "dev", "tok",
+                                          REGISTRY, journal=journal)
+        ref = ImageRef.parse(IMAGE)
+        image_info = {"image": IMAGE, "original_image": IMAGE, "ref": ref,
+                      "internal": ref.internal}
+        image, error = transfer(image_info)
+        journal.close()
+        return project.operations, error
+
+    def test_failed_push_after_pull_not_resumed(self):
+        operations, error = self._export(push_error=Exception("push failed"))
+        self.assertEqual(operations, ["pull", "push"])
+        self.assertIsNotNone(error)
+        # local image could be gone, image is pulled again
+        step, entry = ExportJournal(self.path, True).image_step(IMAGE,
+                                                                REGISTRY)
+        self.assertIsNone(step)
+        operations, error = self._export(resume=True)
+        self.assertEqual(operations, ["pull", "push"])
+        self.assertIsNone(error)
+
+    def test_pulled_image_resumed(self):
+        journal = ExportJournal(self.path)
+        journal.start(["myproject"])
+        journal.add_image_step(IMAGE, IMAGE_PULLED, REGISTRY)
+        journal.close()
+        operations, error = self._export(resume=True)
+        self.assertEqual(operations, ["push"])
+        self.assertIsNone(error)
+        step, entry = ExportJournal(self.path, True).image_step(IMAGE,
+                                                                REGISTRY)
+        self.assertEqual(step, IMAGE_EXPORTED)
+        self.assertEqual(entry["new_image"], REGISTRY + "/myproject/web:latest")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import errno
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+import unittest
+
+from openshift2nulecule.openshift import OpenshiftClient
+
+# oc stub: `oc export <resource>` prints list of objects from
+# <resource>.json, fails with "no resources found" if there is no such file.
+# Export of resource fails if <resource>.fail exists (every call removes one
+# line of it). If <resource>.hang exists, export prints first object and
+# hangs (pid of hanging process is written to <resource>.pid), if
+# <resource>.broken exists it prints first object and fails.
+OC_SCRIPT = """#!{python}
+import json, os, sys, time
+root = os.path.dirname(os.path.abspath(__file__))
+resource = sys.argv[sys.argv.index("export") + 1]
+path = os.path.join(root, resource)
+if os.path.exists(path + ".fail"):
+    with open(path + ".fail") as f:
+        lines = f.readlines()
+    if lines:
+        with open(path + ".fail", "w") as f:
+            f.writelines(lines[1:])
+        sys.stderr.write("error: connection refused\\n")
+        sys.exit(1)
+if not os.path.exists(path + ".json"):
+    sys.stderr.write("error: no resources found\\n")
+    sys.exit(1)
+with open(path + ".json") as f:
+    items = json.load(f)
+if os.path.exists(path + ".hang"):
+    sys.stdout.write('{{"kind": "List", "items": [' + json.dumps(items[0]))
+    sys.stdout.flush()
+    with open(path + ".pid", "w") as f:
+        f.write(str(os.getpid()))
+    time.sleep(60)
+if os.path.exists(path + ".broken"):
+    sys.stdout.write('{{"kind": "List", "items": [' + json.dumps(items[0]))
+    sys.stdout.write(', {{"broken')
+    sys.exit(1)
+json.dump({{"kind": "List", "items": items}}, sys.stdout)
+"""
+
+
+def _object(kind, name):
+    return {"kind": kind, "apiVersion": "v1", "metadata": {"name": name}}
+
+
+class OpenshiftClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        oc = os.path.join(self.tmpdir, "oc")
+        with open(oc, "w") as f:
+            f.write(OC_SCRIPT.format(python=sys.executable))
+        os.chmod(oc, os.stat(oc).st_mode | stat.S_IEXEC)
+        self.client = OpenshiftClient(oc=oc)
+        self._write("service.json", [_object("Service", "web"),
+                                     _object("Service", "db")])
+        self._write("deploymentConfig.json",
+                    [_object("DeploymentConfig", "web")])
+        self._write("route.json", [_object("Route", "web")])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _write(self, filename, data):
+        with open(os.path.join(self.tmpdir, filename), "w") as f:
+            json.dump(data, f)
+
+    def _names(self, objects):
+        return [(obj["kind"], obj["metadata"]["name"]) for obj in objects]
+
+    def _hanging_pid(self, resource):
+        path = os.path.join(self.tmpdir, resource + ".pid")
+        deadline = time.time() + 10
+        while not os.path.exists(path) or not os.path.getsize(path):
+            if time.time() > deadline:
+                self.fail("{} export didn't start".format(resource))
+            time.sleep(0.05)
+        with open(path) as f:
+            return int(f.read())
+
+    def _assert_killed(self, pid):
+        with self.assertRaises(OSError) as cm:
+            os.kill(pid, 0)
+        self.assertEqual(cm.exception.errno, errno.ESRCH)
+
+    def test_order(self):
+        objects = self.client._iter_resources(["service", "deploymentConfig",
+                                               "route"])
+        self.assertEqual(self._names(objects),
+                         [("Service", "web"), ("Service", "db"),
+                          ("DeploymentConfig", "web"), ("Route", "web")])
+
+    def test_no_resources(self):
+        objects = self.client._iter_resources(["imageStream", "service",
+                                               "buildConfig"])
+        self.assertEqual(self._names(objects),
+                         [("Service", "web"), ("Service", "db")])
+
+    def test_retry(self):
+        self.client.retries = 1
+        for resource in ["service", "route"]:
+            self._write(resource + ".fail", ["1"])
+        objects = self.client._iter_resources(["service", "route"])
+        self.assertEqual(self._names(objects),
+                         [("Service", "web"), ("Service", "db"),
+                          ("Route", "web")])
+
+    def test_error(self):
+        self._write("route.fail", ["1"])
+        with self.assertRaises(Exception) as cm:
+            list(self.client._iter_resources(["service", "route"]))
+        self.assertIn("connection refused", str(cm.exception))
+
+    def test_abandoned_export_is_killed(self):
+        self._write("service.hang", [])
+        self._write("route.hang", [])
+        objects = self.client._iter_resources(["service", "route"])
+        self.assertEqual(self._names([next(objects)]), [("Service", "web")])
+        pids = [self._hanging_pid("service"), self._hanging_pid("route")]
+        start = time.time()
+        objects.close()
+        self.assertLess(time.time() - start, 10)
+        for pid in pids:
+            self._assert_killed(pid)
+
+    def test_failed_export_stops_others(self):
+        self._write("service.broken", [])
+        self._write("route.hang", [])
+        objects = self.client._iter_resources(["service", "route"])
+        self.assertEqual(self._names([next(objects)]), [("Service", "web")])
+        pid = self._hanging_pid("route")
+        with self.assertRaises(Exception):
+            list(objects)
+        self._assert_killed(pid)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from openshift2nulecule.partition import (Selector, partition_by_label,
+                                          partition_by_selectors)
+
+
+def _artifact(name, labels=None):
+    metadata = {"name": name}
+    if labels is not None:
+        metadata["labels"] = labels
+    return "openshift", {"kind": "Service", "metadata": metadata}
+
+
+class SelectorTest(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(Selector("app=web").requirements,
+                         [("app", "=", set(["web"]))])
+        self.assertEqual(
+            Selector("app == web, tier!=db,env,!debug").requirements,
+            [("app", "=", set(["web"])), ("tier", "!=", set(["db"])),
+             ("env", "exists", set()), ("debug", "!", set())])
+        self.assertEqual(
+            Selector("app in (web, api),tier notin (db)").requirements,
+            [("app", "in", set(["web", "api"])),
+             ("tier", "notin", set(["db"]))])
+        self.assertEqual(Selector("example.com/app=a-1.b_2").requirements,
+                         [("example.com/app", "=", set(["a-1.b_2"]))])
+        self.assertEqual(Selector("app=").requirements,
+                         [("app", "=", set([""]))])
+
+    def test_invalid(self):
+        for selector in ["app=..", "app=.", "app=-web", "app=web.",
+                         "app=w/b", "app=" + "a" * 64, "app in (web,..)",
+                         "app in web", "=web", "app=web,", "-app"]:
+            with self.assertRaises(ValueError, msg=selector):
+                Selector(selector)
+        Selector("app=" + "a" * 63)
+
+    def test_matches(self):
+        labels = {"app": "web", "tier": "frontend"}
+        for selector, matched in [("app=web", True), ("app=db", False),
+                                  ("app!=db", True), ("env!=prod", True),
+                                  ("app", True), ("env", False),
+                                  ("!env", True), ("!app", False),
+                                  ("app in (db,web)", True),
+                                  ("app notin (db,web)", False),
+                                  ("env notin (prod)", True),
+                                  ("app=web,tier=frontend", True),
+                                  ("app=web,tier=backend", False)]:
+            self.assertEqual(Selector(selector).matches(labels), matched,
+                             selector)
+        self.assertFalse(Selector("app=web").matches(None))
+        self.assertTrue(Selector("!app").matches(None))
+
+    def test_name(self):
+        self.assertEqual(Selector("app=web").name(), "web")
+        self.assertEqual(Selector("app==web").name(), "web")
+        self.assertEqual(Selector("app").name(), "app")
+        self.assertEqual(Selector("app=").name(), "app")
+        self.assertEqual(Selector("app=web,tier!=db").name(),
+                         "app-web-tier-db")
+        self.assertEqual(Selector("app in (web, api)").name(),
+                         "app-in-web-api")
+        self.assertEqual(Selector("!example.com/debug").name(),
+                         "example.com-debug")
+
+
+class PartitionTest(unittest.TestCase):
+
+    def test_by_selectors(self):
+        web = _artifact("web", {"app": "web"})
+        db = _artifact("db", {"app": "db"})
+        other = _artifact("other")
+        partitions = partition_by_selectors(
+            [web, db, other],
+            [Selector("app=web"), Selector("app in (web,db)")])
+        self.assertEqual(list(partitions), ["web", "app-in-web-db"])
+        self.assertEqual(partitions["web"], [web])
+        self.assertEqual(partitions["app-in-web-db"], [web, db])
+        # every application has its own copy of shared object
+        self.assertIsNot(partitions["app-in-web-db"][0][1], web[1])
+
+    def test_by_label(self):
+        web = _artifact("web", {"app": "web"})
+        db = _artifact("db", {"app": "db"})
+        web2 = _artifact("web2", {"app": "web"})
+        partitions = partition_by_label(
+            [web, db, _artifact("other", {"app": ""}), web2,
+             _artifact("unlabeled")], "app")
+        self.assertEqual(list(partitions.items()),
+                         [("web", [web, web2]), ("db", [db])])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from collections import OrderedDict
+
+from openshift2nulecule.openshift import ExportedProject
+from openshift2nulecule.partition import PartitionClient
+from openshift2nulecule.pipeline import ExportPipeline
+from openshift2nulecule.writer import NuleculeWriter
+
+
+def _deployment(name, image):
+    return {"kind": "DeploymentConfig", "apiVersion": "v1",
+            "metadata": {"name": name},
+            "spec": {"template": {"spec": {"containers": [
+                {"name": name, "image": image}]}}}}
+
+
+def _service(name):
+    return {"kind": "Service", "apiVersion": "v1",
+            "metadata": {"name": name},
+            "spec": {"ports": [{"port": 80}]}}
+
+
+class ExportPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.exported = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _export_image(self, image_info):
+        self.exported.append(image_info["original_image"])
+        image_info["image"] = "localhost:5000/" + \
+            image_info["original_image"].split("/", 1)[1]
+        return image_info["original_image"], None
+
+    def _run(self, projects):
+        pipeline_projects = OrderedDict()
+        for project, artifacts in projects.items():
+            writer = NuleculeWriter(os.path.join(self.tmpdir, project),
+                                    project)
+            pipeline_projects[project] = (PartitionClient(artifacts), writer)
+        images = ExportedProject(docker=object())
+        pipeline = ExportPipeline(pipeline_projects, images,
+                                  self._export_image, only_internal=False,
+                                  jobs=2)
+        self.assertEqual(pipeline.run(), [])
+        return pipeline, images
+
+    def _artifact(self, project, provider, filename):
+        path = os.path.join(self.tmpdir, project, "artifacts", provider,
+                            filename)
+        with open(path) as f:
+            return json.load(f)
+
+    def test_export(self):
+        projects = OrderedDict([
+            ("p1", [("openshift", _deployment("web", "reg.example.com/p/web")),
+                    ("openshift", _service("web"))]),
+            ("p2", [("openshift", _deployment("web", "reg.example.com/p/web")),
+                    ("openshift", _deployment("db", "docker.io/mysql"))])])
+        pipeline, images = self._run(projects)
+
+        # shared image is exported once
+        self.assertEqual(sorted(self.exported),
+                         ["docker.io/mysql", "reg.example.com/p/web"])
+        self.assertEqual(pipeline.counters["written"], 4)
+        for project in projects:
+            web = self._artifact(project, "openshift",
+                                 "web-DeploymentConfig.json")
+            self.assertEqual(
+                web["spec"]["template"]["spec"]["containers"][0]["image"],
+                "localhost:5000/p/web")
+        self.assertTrue(os.path.exists(os.path.join(
+            self.tmpdir, "p1", "artifacts", "openshift", "web-Service.json")))
+
+    def test_image_index_doesnt_keep_artifacts(self):
+        projects = OrderedDict([
+            ("p1", [("openshift", _deployment("web{}".format(i),
+                                              "reg.example.com/p/web"))
+                    for i in range(10)])])
+        pipeline, images = self._run(projects)
+        self.assertEqual(pipeline.counters["written"], 10)
+        self.assertEqual(list(images.images), ["reg.example.com/p/web"])
+        self.assertEqual(images.images["reg.example.com/p/web"]["references"],
+                         [])
+        for artifacts in images.artifacts.values():
+            self.assertEqual(artifacts, [])
+        self.assertEqual(pipeline._waiting, {})
+        self.assertEqual(pipeline._deferred, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import hashlib
+import json
+import re
+import unittest
+
+from stubs import StubResponse, StubServer
+
+from openshift2nulecule.registry import RegistryClient
+
+MANIFEST_TYPE = "application/vnd.docker.distribution.manifest.v2+json"
+
+_PATH_RE = re.compile(r"^/v2/(.+)/(manifests|blobs)/(.+)$")
+_UPLOAD_RE = re.compile(r"^/v2/(.+)/blobs/uploads/(.*)$")
+
+
+def _digest(data):
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+class StubRegistry(object):
+    """
+    Docker registry stub (API V2): manifests, blobs, monolithic uploads,
+    cross-repository mounts and optional token authentication
+    """
+
+    def __init__(self, token_auth=False, mount=True):
+        # repository: {reference: (manifest, media type)}
+        self.manifests = {}
+        # repository: {digest: data}
+        self.blobs = {}
+        self.token_auth = token_auth
+        self.mount = mount
+        # tokens accepted by registry
+        self.tokens = set()
+        # scopes requested from token service
+        self.scopes = []
+        self.url = None
+        self._uploads = 0
+
+    def add_image(self, repository, tag, layers):
+        """
+        Add image with given layers (list of bytes), return its blobs
+        """
+        config = json.dumps({"architecture": "amd64"}).encode("utf-8")
+        blobs = [config] + layers
+        for blob in blobs:
+            self.blobs.setdefault(repository, {})[_digest(blob)] = blob
+        manifest = {"schemaVersion": 2, "mediaType": MANIFEST_TYPE,
+                    "config": {"digest": _digest(config),
+                               "size": len(config)},
+                    "layers": [{"digest": _digest(layer),
+                                "size": len(layer)} for layer in layers]}
+        self.manifests.setdefault(repository, {})[tag] = (
+            json.dumps(manifest).encode("utf-8"), MANIFEST_TYPE)
+        return blobs
+
+    def _token(self, request):
+        self.scopes.append(request.query.get("scope"))
+        token = "token{}".format(len(self.scopes))
+        self.tokens.add(token)
+        return StubResponse(200, {"token": token})
+
+    def _authorized(self, request):
+        if not self.token_auth:
+            return True
+        authorization = request.headers.get("Authorization", "")
+        return authorization.startswith("Bearer ") and \
+            authorization.split(" ", 1)[1] in self.tokens
+
+    def __call__(self, request):
+        if request.path == "/token":
+            return self._token(request)
+        if not self._authorized(request):
+            return StubResponse(401, {"errors": []}, headers={
+                "WWW-Authenticate": 'Bearer realm="{}/token",'
+                                    'service="stub"'.format(self.url)})
+
+        match = _UPLOAD_RE.match(request.path)
+        if match:
+            return self._upload(request, match.group(1))
+
+        match = _PATH_RE.match(request.path)
+        if not match:
+            return None
+        repository, kind, reference = match.groups()
+        if kind == "manifests":
+            if request.method == "PUT":
+                self.manifests.setdefault(repository, {})[reference] = (
+                    request.body, request.headers["Content-Type"])
+                return StubResponse(201, headers={
+                    "Docker-Content-Digest": _digest(request.body)})
+            manifest = self.manifests.get(repository, {}).get(reference)
+            if manifest is None:
+                return StubResponse(404, {"errors": []})
+            return StubResponse(200, manifest[0], headers={
+                "Content-Type": manifest[1],
+                "Docker-Content-Digest": _digest(manifest[0])})
+
+        blob = self.blobs.get(repository, {}).get(reference)
+        if blob is None:
+            return StubResponse(404, {"errors": []})
+        return StubResponse(200, blob)
+
+    def _upload(self, request, repository):
+        if request.method == "POST":
+            source = request.query.get("from")
+            digest = request.query.get("mount")
+            if self.mount and source and \
+                    digest in self.blobs.get(source, {}):
+                self.blobs.setdefault(repository, {})[digest] = \
+                    self.blobs[source][digest]
+                return StubResponse(201)
+            self._uploads += 1
+            return StubResponse(202, headers={
+                "Location": "/v2/{}/blobs/uploads/{}".format(
+                    repository, self._uploads)})
+
+        digest = request.query["digest"]
+        if _digest(request.body) != digest:
+            return StubResponse(400, {"errors": [{"code": "DIGEST_INVALID"}]})
+        self.blobs.setdefault(repository, {})[digest] = request.body
+        return StubResponse(201)
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.source = StubRegistry(token_auth=True)
+        self.target = StubRegistry()
+        self.source_server = StubServer(self.source)
+        self.target_server = StubServer(self.target)
+        self.source.url = self.source_server.url
+        self.target.url = self.target_server.url
+        self.layers = [b"layer one" * 1000, b"layer two" * 1000]
+        self.blobs = self.source.add_image("p/web", "1.0", self.layers)
+
+        self.source_client = RegistryClient(self.source_server.url,
+                                            "dev", "secret")
+        self.target_client = RegistryClient(self.target_server.url)
+
+    def tearDown(self):
+        self.source_server.close()
+        self.target_server.close()
+
+    def _copy(self, repository="p/web"):
+        return self.source_client.copy_image("p/web", "1.0",
+                                             self.target_client,
+                                             repository, "1.0")
+
+    def test_token_auth(self):
+        digest = self.source_client.get_manifest_digest("p/web", "1.0")
+        self.assertEqual(digest,
+                         _digest(self.source.manifests["p/web"]["1.0"][0]))
+        self.assertEqual(self.source.scopes, ["repository:p/web:pull"])
+
+        # token service got credentials
+        token_request, = [request for request in self.source_server.requests
+                          if request.path == "/token"]
+        self.assertEqual(token_request.headers["Authorization"],
+                         "Basic " + base64.b64encode(b"dev:secret")
+                         .decode("ascii"))
+
+        # token is reused for next requests with the same scope
+        self.source_client.get_manifest("p/web", "1.0")
+        self.assertEqual(len(self.source.scopes), 1)
+
+    def test_token_auth_failed(self):
+        self.source.tokens = set()
+        self.source._token = lambda request: StubResponse(
+            401, {"errors": []})
+        self.assertIsNone(self.source_client.get_manifest_digest("p/web",
+                                                                 "1.0"))
+        with self.assertRaises(Exception) as cm:
+            self.source_client.get_manifest("p/web", "1.0")
+        self.assertIn("401", str(cm.exception))
+
+    def test_copy_image(self):
+        copied = self._copy()
+        self.assertEqual(copied, sum(len(blob) for blob in self.blobs))
+        self.assertEqual(self.target.blobs["p/web"],
+                         self.source.blobs["p/web"])
+        self.assertEqual(self.target.manifests["p/web"]["1.0"],
+                         self.source.manifests["p/web"]["1.0"])
+
+    def test_chunked_upload(self):
+        self._copy()
+        uploads = [request for request in self.target_server.requests
+                   if request.method == "PUT" and "/blobs/" in request.path]
+        self.assertEqual(len(uploads), len(self.blobs))
+        for upload in uploads:
+            # blob is streamed from source registry, not buffered
+            self.assertEqual(upload.headers.get("Transfer-Encoding"),
+                             "chunked")
+
+    def test_existing_blobs_skipped(self):
+        self._copy()
+        self.assertEqual(self._copy(), 0)
+        uploads = [request for request in self.target_server.requests
+                   if request.method == "POST"]
+        self.assertEqual(len(uploads), len(self.blobs))
+
+    def test_cross_repository_mount(self):
+        self._copy()
+        self.assertEqual(self._copy("q/web"), 0)
+        self.assertEqual(self.target.blobs["q/web"],
+                         self.source.blobs["p/web"])
+        mounts = [request for request in self.target_server.requests
+                  if request.method == "POST" and "q/web" in request.path]
+        self.assertEqual([request.query for request in mounts],
+                         [{"mount": _digest(blob), "from": "p/web"}
+                          for blob in self.blobs])
+
+    def test_cross_repository_mount_not_supported(self):
+        self.target.mount = False
+        self._copy()
+        self.assertEqual(self._copy("q/web"),
+                         sum(len(blob) for blob in self.blobs))
+        self.assertEqual(self.target.blobs["q/web"],
+                         self.source.blobs["p/web"])
+
+    def test_upload_resent_after_authentication(self):
+        self.target.token_auth = True
+        self.target_client.username = "dev"
+        self.target_client.password = "secret"
+        self.target_server.respond = self._expire_token(self.target)
+        self._copy()
+        # whole blob was uploaded again after token expired
+        self.assertEqual(self.target.blobs["p/web"],
+                         self.source.blobs["p/web"])
+
+    @staticmethod
+    def _expire_token(registry):
+        """
+        Invalidate tokens when first blob upload is received
+        """
+        expired = []
+
+        def respond(request):
+            if request.method == "PUT" and "/uploads/" in request.path and \
+                    not expired:
+                expired.append(request)
+                registry.tokens = set()
+            return registry(request)
+        return respond
+
+    def test_missing_blob(self):
+        del self.source.blobs["p/web"][_digest(self.layers[1])]
+        with self.assertRaises(Exception) as cm:
+            self._copy()
+        self.assertIn("Getting blob", str(cm.exception))
+        self.assertNotIn("1.0", self.target.manifests.get("p/web", {}))
+
+
+if __name__ == "__main__":
+    unittest.main()
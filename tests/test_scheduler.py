@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+from openshift2nulecule import scheduler as scheduler_module
+from openshift2nulecule.scheduler import Throttle, TransferScheduler
+
+
+def _image(name, size=None):
+    return {"original_image": name, "image": name, "test_size": size}
+
+
+class TransferSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.order = []
+        self.lookups = []
+        self.release = threading.Event()
+        # transfers of these images wait for release
+        self.blocking = set()
+        self.lookup_wait = scheduler_module.LOOKUP_WAIT
+
+    def tearDown(self):
+        scheduler_module.LOOKUP_WAIT = self.lookup_wait
+
+    def _transfer(self, image_info):
+        image = image_info["original_image"]
+        self.order.append(image)
+        if image in self.blocking:
+            self.release.wait(5)
+        return image, None
+
+    def _image_size(self, image_info):
+        self.lookups.append(image_info["original_image"])
+        return image_info["test_size"]
+
+    def _wait(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_largest_first(self):
+        scheduler = TransferScheduler(self._transfer, self._image_size, 2)
+        self.blocking = set(["busy1", "busy2"])
+        scheduler.add(_image("busy1", 1000))
+        scheduler.add(_image("busy2", 1000))
+        self._wait(lambda: len(self.order) == 2)
+
+        for image, size in [("small", 1), ("unknown", None),
+                            ("large", 100), ("medium", 10)]:
+            scheduler.add(_image(image, size))
+        self._wait(lambda: len(self.lookups) == 6 and
+                   not scheduler._sizing)
+        self.release.set()
+        scheduler.close()
+        scheduler.join()
+        self.assertEqual(self.order[2:],
+                         ["large", "medium", "small", "unknown"])
+        self.assertEqual(len(scheduler.transferred), 6)
+
+    def test_waits_for_lookups(self):
+        delays = {"small": 0, "medium": 0.1, "large": 0.3}
+
+        def image_size(image_info):
+            time.sleep(delays[image_info["original_image"]])
+            return image_info["test_size"]
+
+        scheduler = TransferScheduler(self._transfer, image_size, 2)
+        for image, size in [("small", 1), ("medium", 10), ("large", 100)]:
+            scheduler.add(_image(image, size))
+        scheduler.close()
+        scheduler.join()
+        # transfers started after all sizes were known
+        self.assertEqual(sorted(self.order[:2]), ["large", "medium"])
+        self.assertEqual(self.order[2], "small")
+
+    def test_slow_lookup_doesnt_block_transfers(self):
+        scheduler_module.LOOKUP_WAIT = 0.2
+        slow = threading.Event()
+
+        def image_size(image_info):
+            if image_info["original_image"] == "slow":
+                slow.wait(5)
+            return image_info["test_size"]
+
+        scheduler = TransferScheduler(self._transfer, image_size, 2)
+        scheduler.add(_image("slow", 100))
+        scheduler.add(_image("fast", 1))
+        try:
+            self._wait(lambda: self.order == ["fast"])
+        finally:
+            slow.set()
+        scheduler.close()
+        scheduler.join()
+        self.assertEqual(self.order, ["fast", "slow"])
+
+    def test_failed_lookup(self):
+        def image_size(image_info):
+            raise Exception("registry is not available")
+
+        scheduler = TransferScheduler(self._transfer, image_size, 2)
+        scheduler.add(_image("web"))
+        scheduler.close()
+        scheduler.join()
+        self.assertEqual(self.order, ["web"])
+        self.assertIsNone(scheduler.transferred[0]["size"])
+
+    def test_no_lookups_with_one_job(self):
+        scheduler = TransferScheduler(self._transfer, self._image_size, 1)
+        for image, size in [("small", 1), ("large", 100)]:
+            scheduler.add(_image(image, size))
+        scheduler.close()
+        scheduler.join()
+        self.assertEqual(self.lookups, [])
+        self.assertEqual(self.order, ["small", "large"])
+
+    def test_callback(self):
+        results = []
+
+        def transfer(image_info):
+            return image_info["original_image"], Exception("failed")
+
+        scheduler = TransferScheduler(transfer, None, 2, results.append)
+        scheduler.add(_image("web"))
+        scheduler.close()
+        scheduler.join()
+        self.assertEqual([image for image, error in results], ["web"])
+        self.assertEqual(scheduler.transferred, [])
+
+
+class ThrottleTest(unittest.TestCase):
+
+    def test_rate(self):
+        throttle = Throttle(10000)
+        start = time.time()
+        for _ in range(5):
+            throttle.consume(1000)
+        self.assertGreaterEqual(time.time() - start, 0.45)
+
+    def test_shared_by_threads(self):
+        throttle = Throttle(10000)
+        threads = [threading.Thread(target=throttle.consume, args=(2500,))
+                   for _ in range(2)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertGreaterEqual(time.time() - start, 0.45)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import anymarkup
+except ImportError:
+    anymarkup = None
+
+from openshift2nulecule import serializer
+
+ARTIFACT = {"kind": "DeploymentConfig", "apiVersion": "v1",
+            "metadata": {"name": u"démo", "labels": {"app": "web"},
+                         "creationTimestamp": None},
+            "spec": {"replicas": 2, "paused": False, "ratio": 1.5,
+                     "template": {"spec": {"containers": [
+                         {"name": "web", "image": "reg/p/web:1",
+                          "args": ["a", "b\"c"], "env": []}]}},
+                     "empty": {}}}
+
+# artifact as it was written by anymarkup
+ARTIFACT_JSON = u"""{
+  "kind": "DeploymentConfig",
+  "apiVersion": "v1",
+  "metadata": {
+    "name": "démo",
+    "labels": {
+      "app": "web"
+    },
+    "creationTimestamp": null
+  },
+  "spec": {
+    "replicas": 2,
+    "paused": false,
+    "ratio": 1.5,
+    "template": {
+      "spec": {
+        "containers": [
+          {
+            "name": "web",
+            "image": "reg/p/web:1",
+            "args": [
+              "a",
+              "b\\"c"
+            ],
+            "env": []
+          }
+        ]
+      }
+    },
+    "empty": {}
+  }
+}""".encode("utf-8")
+
+NULECULE = {"specversion": "0.0.2", "id": "app",
+            "metadata": {"name": "app"},
+            "graph": [{"name": "app", "artifacts": {
+                "kubernetes": ["file://artifacts/kubernetes/web-Service.json"],
+                "openshift": []}}]}
+
+NULECULE_YAML = b"""graph:
+- artifacts:
+    kubernetes:
+    - file://artifacts/kubernetes/web-Service.json
+    openshift: []
+  name: app
+id: app
+metadata:
+  name: app
+specversion: 0.0.2
+"""
+
+
+class SerializerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = serializer._engine
+
+    def tearDown(self):
+        serializer._engine = self.engine
+
+    def _engines(self):
+        for engine in serializer.JSON_ENGINES:
+            try:
+                serializer._engine = engine()
+            except ImportError:
+                continue
+            yield serializer._engine[0]
+
+    def test_json(self):
+        for name in self._engines():
+            self.assertEqual(serializer.dumps_json(ARTIFACT), ARTIFACT_JSON,
+                             name)
+            self.assertEqual(serializer.loads_json(ARTIFACT_JSON), ARTIFACT,
+                             name)
+
+    def test_json_options(self):
+        for name in self._engines():
+            self.assertEqual(serializer.dumps_json({"b": 1, "a": [1, 2]},
+                                                   indent=False),
+                             b'{"b":1,"a":[1,2]}', name)
+            self.assertEqual(serializer.dumps_json({"b": 1, "a": {"d": 2,
+                                                                  "c": 3}},
+                                                   indent=False,
+                                                   sort_keys=True),
+                             b'{"a":{"c":3,"d":2},"b":1}', name)
+
+    def test_big_integer(self):
+        for name in self._engines():
+            self.assertEqual(serializer.dumps_json([2 ** 70], indent=False),
+                             b"[1180591620717411303424]", name)
+
+    def test_yaml(self):
+        self.assertEqual(serializer.dumps_yaml(NULECULE), NULECULE_YAML)
+
+    @unittest.skipIf(anymarkup is None, "anymarkup is not installed")
+    def test_same_as_anymarkup(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for fmt, obj, dumps in [("json", ARTIFACT, serializer.dumps_json),
+                                    ("yaml", NULECULE, serializer.dumps_yaml),
+                                    ("yaml", ARTIFACT, serializer.dumps_yaml)]:
+                path = os.path.join(tmpdir, "artifact." + fmt)
+                anymarkup.serialize_file(obj, path, format=fmt)
+                with open(path, "rb") as f:
+                    self.assertEqual(dumps(obj), f.read())
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    unittest.main()
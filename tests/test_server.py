@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+import gc
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    # python 2
+    from urllib2 import Request, urlopen, HTTPError
+
+from openshift2nulecule import server as server_module
+from openshift2nulecule.cli.main import CLI
+from openshift2nulecule.image import ImageRef
+from openshift2nulecule.server import JOB_DONE, JOB_FAILED, ExportServer
+
+
+class StubCLI(CLI):
+    """
+    CLI that records exports instead of running them
+    """
+
+    def __init__(self):
+        CLI.__init__(self)
+        self.exports = []
+
+    def export(self, args, session=None):
+        self.exports.append(args)
+        if args.output.endswith("fail"):
+            raise Exception("export failed")
+
+
+class ExportServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cli = StubCLI()
+        options = self.cli.parser.parse_args(
+            ["--project", "default", "--selector", "tier=web",
+             "--oc", "/usr/bin/oc"])
+        self.root = tempfile.mkdtemp()
+        self.server = ExportServer(self.cli, options, port=0, root=self.root)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _request(self, method, path, body=None):
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+        request = Request("http://{}:{}{}".format(
+            self.server.address[0], self.server.address[1], path), data)
+        request.get_method = lambda: method
+        try:
+            response = urlopen(request, timeout=10)
+        except HTTPError as e:
+            return e.code, json.loads(e.read().decode("utf-8"))
+        return response.getcode(), json.loads(response.read().decode("utf-8"))
+
+    def _wait(self, job_id):
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            job = self.server.get_job(job_id)
+            if job is None or job.finished:
+                return job
+            time.sleep(0.01)
+        self.fail("Job {} didn't finish".format(job_id))
+
+    def test_submit(self):
+        status, job = self._request("POST", "/jobs",
+                                    {"args": ["--output", "x"]})
+        self.assertEqual(status, 202)
+        self.assertEqual(self._wait(job["id"]).state, JOB_DONE)
+        status, body = self._request("GET", "/jobs/{}".format(job["id"]))
+        self.assertEqual(status, 200)
+        self.assertEqual(body["state"], JOB_DONE)
+        self.assertEqual(body["args"], ["--output", "x"])
+        self.assertEqual(self.server.get_job(job["id"]).options.output,
+                         os.path.join(self.root, "x"))
+
+        options, = self.cli.exports
+        # options of server are defaults
+        self.assertEqual(options.project, ["default"])
+        self.assertEqual(options.selector, ["tier=web"])
+        self.assertEqual(options.oc, "/usr/bin/oc")
+
+    def test_repeated_options_replace_server_options(self):
+        for _ in range(2):
+            status, job = self._request(
+                "POST", "/jobs",
+                {"args": ["--output", "x", "--project", "p1",
+                          "--project", "p2", "--selector", "tier=db"]})
+            self.assertEqual(status, 202)
+            self._wait(job["id"])
+        for options in self.cli.exports:
+            self.assertEqual(options.project, ["p1", "p2"])
+            self.assertEqual(options.selector, ["tier=db"])
+        self.assertEqual(self.server.options.project, ["default"])
+        self.assertEqual(self.server.options.selector, ["tier=web"])
+
+    def test_failed_job(self):
+        status, job = self._request("POST", "/jobs",
+                                    {"args": ["--output", "fail"]})
+        job = self._wait(job["id"])
+        self.assertEqual(job.state, JOB_FAILED)
+        self.assertEqual(job.error, "export failed")
+
+    def test_invalid_requests(self):
+        status, body = self._request("POST", "/jobs", {"args": "--output"})
+        self.assertEqual(status, 400)
+        status, body = self._request("POST", "/jobs", {"args": ["--debug",
+                                                                "--output",
+                                                                "x"]})
+        self.assertEqual(status, 400)
+        self.assertIn("--debug", body["error"])
+        status, body = self._request("POST", "/jobs", {"args": []})
+        self.assertEqual(status, 400)
+        status, body = self._request("GET", "/jobs/42")
+        self.assertEqual(status, 404)
+        self.assertEqual(self.cli.exports, [])
+
+    def test_server_options(self):
+        for args in [["--oc", "/tmp/oc"], ["--oc-config", "/tmp/config"],
+                     ["--docker-backend", "api"],
+                     ["--docker-url", "tcp://127.0.0.1:2375"],
+                     ["--server-root", "/"]]:
+            status, body = self._request("POST", "/jobs",
+                                         {"args": ["--output", "x"] + args})
+            self.assertEqual(status, 400)
+            self.assertIn(args[0], body["error"])
+        # value of server can be repeated
+        status, body = self._request("POST", "/jobs",
+                                     {"args": ["--output", "x",
+                                               "--oc", "/usr/bin/oc"]})
+        self.assertEqual(status, 202)
+
+    def test_output_outside_root(self):
+        for output in ["../x", "x/../../x", "/tmp/x", ".", self.root]:
+            status, body = self._request("POST", "/jobs",
+                                         {"args": ["--output", output]})
+            self.assertEqual(status, 400, output)
+            self.assertIn("--output", body["error"])
+        status, body = self._request(
+            "POST", "/jobs",
+            {"args": ["--output", os.path.join(self.root, "a", "..", "b")]})
+        self.assertEqual(status, 202)
+        self.assertEqual(self.server.get_job(body["id"]).options.output,
+                         os.path.join(self.root, "b"))
+
+    def test_finished_jobs_evicted(self):
+        original = server_module.FINISHED_JOBS
+        server_module.FINISHED_JOBS = 3
+        try:
+            ids = []
+            for index in range(5):
+                job = self.server.submit(["--output", str(index)])
+                ids.append(job.id)
+                self._wait(job.id)
+            deadline = time.time() + 5
+            while len(self.server.list_jobs()) > 3 and \
+                    time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            server_module.FINISHED_JOBS = original
+        status, jobs = self._request("GET", "/jobs")
+        self.assertEqual([job["id"] for job in jobs], ids[2:])
+        status, body = self._request("GET", "/jobs/{}".format(ids[0]))
+        self.assertEqual(status, 404)
+
+
+class ImageRefTest(unittest.TestCase):
+
+    def test_interned(self):
+        ref = ImageRef.parse("reg.example.com/p/web:1.0")
+        self.assertIs(ImageRef.parse("reg.example.com/p/web:1.0"), ref)
+        self.assertEqual(ref.registry, "reg.example.com")
+        self.assertEqual(ref.path, "p/web")
+        self.assertEqual(ref.tag, "1.0")
+
+    def test_unused_instances_released(self):
+        ImageRef.parse("reg.example.com/p/unused:1.0")
+        gc.collect()
+        self.assertNotIn("reg.example.com/p/unused:1.0",
+                         ImageRef._instances)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from openshift2nulecule import transforms
+
+
+def add_label(provider, artifact):
+    artifact["metadata"].setdefault("labels", {})["exported"] = provider
+    return artifact
+
+
+def _rc(deployment_config=None):
+    annotations = {}
+    if deployment_config:
+        annotations["openshift.io/deployment-config.name"] = \
+            deployment_config
+    return {"kind": "ReplicationController",
+            "metadata": {"name": "web-1", "annotations": annotations}}
+
+
+class TransformsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registered = transforms.get_transforms()
+
+    def tearDown(self):
+        transforms._transforms[:] = self.registered
+
+    def test_runtime_metadata(self):
+        artifact = {"kind": "Service",
+                    "metadata": {"name": "web", "uid": "1",
+                                 "resourceVersion": "42",
+                                 "namespace": "myproject",
+                                 "labels": {"app": "web"}},
+                    "spec": {"ports": [{"port": 80}]},
+                    "status": {"loadBalancer": {"ingress": []}}}
+        self.assertEqual(
+            transforms.apply_transforms("kubernetes", artifact),
+            {"kind": "Service",
+             "metadata": {"name": "web", "labels": {"app": "web"}},
+             "spec": {"ports": [{"port": 80}]},
+             "status": {}})
+
+    def test_deployment_rcs(self):
+        self.assertIsNone(transforms.apply_transforms("openshift",
+                                                      _rc("web")))
+        self.assertIsNotNone(transforms.apply_transforms("kubernetes",
+                                                         _rc("web")))
+        self.assertIsNotNone(transforms.apply_transforms("openshift", _rc()))
+
+    def test_imagestream_annotations(self):
+        def image_stream():
+            return {"kind": "ImageStream",
+                    "metadata": {"name": "web",
+                                 "annotations": {"a": "b"}}}
+
+        self.assertNotIn("annotations", transforms.apply_transforms(
+            "openshift", image_stream())["metadata"])
+        self.assertIn("annotations", transforms.apply_transforms(
+            "kubernetes", image_stream())["metadata"])
+
+    def test_order(self):
+        calls = []
+
+        def first(provider, artifact):
+            calls.append("first")
+            return dict(artifact, first=True)
+
+        def drop(provider, artifact):
+            calls.append("drop")
+            return None
+
+        def last(provider, artifact):
+            calls.append("last")
+            return artifact
+
+        artifact = {"kind": "Service", "metadata": {"name": "web"}}
+        self.assertEqual(transforms.apply_transforms(
+            "openshift", artifact, [first, last]),
+            {"kind": "Service", "metadata": {"name": "web"}, "first": True})
+        self.assertEqual(calls, ["first", "last"])
+
+        # transforms after dropped artifact are not called
+        del calls[:]
+        self.assertIsNone(transforms.apply_transforms(
+            "openshift", artifact, [first, drop, last]))
+        self.assertEqual(calls, ["first", "drop"])
+
+    def test_register(self):
+        transforms.register_transform(add_label)
+        transforms.register_transform(add_label)
+        self.assertEqual(transforms.get_transforms(),
+                         self.registered + [add_label])
+        artifact = transforms.apply_transforms(
+            "openshift", {"kind": "Service", "metadata": {"name": "web"}})
+        self.assertEqual(artifact["metadata"]["labels"],
+                         {"exported": "openshift"})
+
+        transforms.unregister_transform(add_label)
+        self.assertEqual(transforms.get_transforms(), self.registered)
+
+    def test_load(self):
+        transforms.load_transforms(["{}:add_label".format(__name__)])
+        self.assertEqual(transforms.get_transforms()[-1].__name__,
+                         "add_label")
+        for name in ["{}.add_label".format(__name__),
+                     "{}:missing".format(__name__),
+                     "missing_module:add_label"]:
+            with self.assertRaises(Exception) as cm:
+                transforms.load_transforms([name])
+            self.assertIn(name, str(cm.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import json
+import sys
+import threading
+import time
+import unittest
+
+from openshift2nulecule import utils
+
+
+class ChunkedStream(object):
+    """
+    File object returning at most `size` bytes from every read, so values
+    are split between chunks at every possible position
+    """
+
+    def __init__(self, data, size):
+        self.data = data
+        self.size = size
+        self.pos = 0
+
+    def read(self, size=-1):
+        chunk = self.data[self.pos:self.pos + self.size]
+        self.pos += len(chunk)
+        return chunk
+
+
+ITEMS = [{"kind": "Service", "metadata": {"name": "web"},
+          "spec": {"ports": [{"port": 8080}], "clusterIP": None}},
+         {"kind": "DeploymentConfig", "metadata": {"name": u"démo"},
+          "spec": {"replicas": 12345, "paused": False, "ratio": 1.5,
+                   "args": ["a", "b\"c", "\\n"]}},
+         12345678,
+         "text"]
+
+
+class IterListItemsTest(unittest.TestCase):
+
+    def _document(self, items=ITEMS, kind="List"):
+        return json.dumps({"kind": kind, "apiVersion": "v1",
+                           "metadata": {"resourceVersion": "42"},
+                           "items": items}, indent=2).encode("utf-8")
+
+    def test_values_split_between_chunks(self):
+        data = self._document()
+        for size in range(1, 20):
+            self.assertEqual(
+                list(utils.iter_list_items(ChunkedStream(data, size))),
+                ITEMS)
+
+    def test_items_before_kind(self):
+        data = b'{"items": [{"a": 1}, {"b": 2}], "kind": "List"}'
+        self.assertEqual(list(utils.iter_list_items(ChunkedStream(data, 3))),
+                         [{"a": 1}, {"b": 2}])
+
+    def test_empty_list(self):
+        for data in [b'{"kind": "List", "items": []}', b'{}',
+                     b'{"kind": "List", "items": null}']:
+            self.assertEqual(
+                list(utils.iter_list_items(ChunkedStream(data, 4))), [])
+
+    def test_different_kind(self):
+        data = self._document(kind="ServiceList")
+        with self.assertRaises(Exception) as cm:
+            list(utils.iter_list_items(ChunkedStream(data, 7)))
+        self.assertIn("kind", str(cm.exception))
+        self.assertEqual(
+            list(utils.iter_list_items(ChunkedStream(data, 7),
+                                       kind="ServiceList")), ITEMS)
+
+    def test_truncated_document(self):
+        data = self._document()[:-10]
+        with self.assertRaises(ValueError):
+            list(utils.iter_list_items(ChunkedStream(data, 5)))
+
+    def test_json_values(self):
+        data = b"".join(json.dumps(item, indent=2).encode("utf-8") + b"\n"
+                        for item in ITEMS)
+        for size in range(1, 10):
+            parser = utils._JSONListParser(ChunkedStream(data, size), None)
+            self.assertEqual(list(parser.values()), ITEMS)
+
+
+class RetryTest(unittest.TestCase):
+
+    def _failing(self, failures):
+        calls = []
+
+        def func(value):
+            calls.append(value)
+            if len(calls) <= failures:
+                raise Exception("failure {}".format(len(calls)))
+            return value
+        return func, calls
+
+    def test_retry(self):
+        func, calls = self._failing(2)
+        self.assertEqual(utils.retry(func, ("ok",), retries=2, delay=0.01),
+                         "ok")
+        self.assertEqual(len(calls), 3)
+
+    def test_retries_exhausted(self):
+        func, calls = self._failing(3)
+        with self.assertRaises(Exception) as cm:
+            utils.retry(func, ("ok",), retries=2, delay=0.01)
+        self.assertEqual(str(cm.exception), "failure 3")
+        self.assertEqual(len(calls), 3)
+
+    def test_stopped(self):
+        func, calls = self._failing(1)
+        stop = threading.Event()
+        stop.set()
+        with self.assertRaises(Exception):
+            utils.retry(func, ("ok",), retries=5, delay=60, stop=stop)
+        self.assertEqual(len(calls), 1)
+
+        # stop during delay interrupts waiting
+        func, calls = self._failing(1)
+        stop.clear()
+        threading.Timer(0.1, stop.set).start()
+        start = time.time()
+        with self.assertRaises(Exception):
+            utils.retry(func, ("ok",), retries=5, delay=60, stop=stop)
+        self.assertLess(time.time() - start, 30)
+        self.assertEqual(len(calls), 1)
+
+
+class StreamCmdTest(unittest.TestCase):
+
+    SLEEP = [sys.executable, "-c",
+             "import sys, time\n"
+             "sys.stdout.write('start\\n')\n"
+             "sys.stdout.flush()\n"
+             "time.sleep(60)"]
+
+    def test_output(self):
+        with utils.stream_cmd([sys.executable, "-c", "print('a\\nb')"]) \
+                as stdout:
+            self.assertEqual(list(stdout), [b"a\n", b"b\n"])
+
+    def test_failure(self):
+        with self.assertRaises(Exception) as cm:
+            with utils.stream_cmd([sys.executable, "-c",
+                                   "import sys; sys.exit(3)"]) as stdout:
+                stdout.read()
+        self.assertIn("failed", str(cm.exception))
+
+    def test_stop(self):
+        stop = threading.Event()
+        start = time.time()
+        with self.assertRaises(Exception) as cm:
+            with utils.stream_cmd(self.SLEEP, stop=stop) as stdout:
+                self.assertEqual(stdout.readline(), b"start\n")
+                stop.set()
+        self.assertIn("stopped", str(cm.exception))
+        self.assertLess(time.time() - start, 30)
+
+    def test_abandoned(self):
+        def lines():
+            with utils.stream_cmd(self.SLEEP) as stdout:
+                for line in stdout:
+                    yield line
+
+        start = time.time()
+        output = lines()
+        self.assertEqual(next(output), b"start\n")
+        output.close()
+        self.assertLess(time.time() - start, 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    from queue import Empty, Queue
+except ImportError:
+    # python 2
+    from Queue import Empty, Queue
+
+from openshift2nulecule import openshift
+from openshift2nulecule.openshift import OpenshiftClient
+from openshift2nulecule.watch import WatchExport
+
+# oc stub: lists services from services.json (list version 100), watch
+# prints events from events.json newer than requested version and ends
+# like watch expired by server. Every call is logged to oc.log.
+OC_SCRIPT = """#!{python}
+import json, os, sys
+try:
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from urlparse import urlparse, parse_qs
+root = os.path.dirname(os.path.abspath(__file__))
+args = sys.argv[1:]
+with open(os.path.join(root, "oc.log"), "a") as f:
+    f.write(" ".join(args) + "\\n")
+if args == ["project", "-q"]:
+    print("myproject")
+    sys.exit(0)
+if args[-1] == "--help":
+    print("Options:")
+    if os.path.exists(os.path.join(root, "raw")):
+        print("      --raw='': Raw URI to request from the server.")
+    sys.exit(0)
+with open(os.path.join(root, "services.json")) as f:
+    items = json.load(f)
+if "--raw" in args:
+    uri = urlparse(args[args.index("--raw") + 1])
+    params = parse_qs(uri.query)
+    if params.get("watch") == ["true"]:
+        with open(os.path.join(root, "events.json")) as f:
+            events = json.load(f)
+        version = int(params["resourceVersion"][0])
+        for event in events:
+            if int(event["object"]["metadata"]["resourceVersion"]) > version:
+                sys.stdout.write(json.dumps(event, indent=2) + "\\n")
+        sys.exit(0)
+json.dump({{"kind": "ServiceList", "metadata": {{"resourceVersion": "100"}},
+           "items": items}}, sys.stdout)
+"""
+
+
+def _service(name, version, port=80):
+    return {"kind": "Service", "apiVersion": "v1",
+            "metadata": {"name": name, "resourceVersion": str(version)},
+            "spec": {"ports": [{"port": port}]}}
+
+
+class OpenshiftWatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.oc = os.path.join(self.tmpdir, "oc")
+        with open(self.oc, "w") as f:
+            f.write(OC_SCRIPT.format(python=sys.executable))
+        os.chmod(self.oc, os.stat(self.oc).st_mode | stat.S_IEXEC)
+        self._write("services.json", [_service("web", 90)])
+        self._write("events.json", [
+            # change before list was made is not repeated
+            {"type": "MODIFIED", "object": _service("web", 90)},
+            {"type": "ADDED", "object": _service("db", 110)},
+            {"type": "DELETED", "object": _service("web", 120)}])
+        self.events = Queue()
+        self.stop = threading.Event()
+        self.poll_interval = openshift.WATCH_POLL_INTERVAL
+
+    def tearDown(self):
+        self.stop.set()
+        openshift.WATCH_POLL_INTERVAL = self.poll_interval
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _write(self, filename, data):
+        with open(os.path.join(self.tmpdir, filename), "w") as f:
+            json.dump(data, f)
+
+    def _log(self):
+        with open(os.path.join(self.tmpdir, "oc.log")) as f:
+            return f.read().splitlines()
+
+    def _next(self):
+        try:
+            resource, event, obj = self.events.get(timeout=10)
+        except Empty:
+            self.fail("No watch event")
+        self.assertEqual(resource, "service")
+        if event == "SYNC":
+            return event, sorted(item["metadata"]["name"] for item in obj)
+        return event, obj["metadata"]["name"]
+
+    def test_watch_from_list_version(self):
+        open(os.path.join(self.tmpdir, "raw"), "w").close()
+        client = OpenshiftClient(oc=self.oc)
+        client.watch(self.events, self.stop, ["service"])
+        self.assertEqual(self._next(), ("SYNC", ["web"]))
+        self.assertEqual(self._next(), ("ADDED", "db"))
+        self.assertEqual(self._next(), ("DELETED", "web"))
+        # expired watch continues from last seen version
+        restarted = ("--namespace myproject get --raw "
+                     "/api/v1/namespaces/myproject/services?"
+                     "resourceVersion=120&timeoutSeconds=300&watch=true")
+        deadline = time.time() + 5
+        while restarted not in self._log() and time.time() < deadline:
+            time.sleep(0.01)
+        self.stop.set()
+        self.assertTrue(client.can_watch)
+
+        log = self._log()
+        self.assertIn(restarted, log)
+        self.assertIn("project -q", log)
+        self.assertIn("--namespace myproject get --raw "
+                      "/api/v1/namespaces/myproject/services", log)
+        self.assertIn("--namespace myproject get --raw "
+                      "/api/v1/namespaces/myproject/services?"
+                      "resourceVersion=100&timeoutSeconds=300&watch=true",
+                      log)
+
+    def test_poll_without_raw_requests(self):
+        openshift.WATCH_POLL_INTERVAL = 0.1
+        client = OpenshiftClient(oc=self.oc, namespace="myproject")
+        client.watch(self.events, self.stop, ["service"])
+        self.assertEqual(self._next(), ("SYNC", ["web"]))
+        self._write("services.json", [_service("web", 90),
+                                      _service("db", 110)])
+        while True:
+            event = self._next()
+            if event != ("SYNC", ["web"]):
+                break
+        self.assertEqual(event, ("SYNC", ["db", "web"]))
+        self.stop.set()
+        self.assertFalse(client.can_watch)
+        for args in self._log():
+            self.assertNotIn("--raw ", args)
+
+
+class WatchExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.watch = WatchExport(None, os.path.join(self.tmpdir, "app"),
+                                 "app")
+        self.generated = []
+        generate = self.watch._generate
+
+        def counted(obj):
+            self.generated.append(obj["metadata"]["name"])
+            return generate(obj)
+        self.watch._generate = counted
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _artifact(self, filename):
+        with open(os.path.join(self.tmpdir, "app", "artifacts", "openshift",
+                               filename)) as f:
+            return json.load(f)
+
+    def _sync(self, services):
+        for resource in self.watch.resources:
+            items = services if resource == "service" else []
+            self.watch._apply((resource, "SYNC", items))
+
+    def test_only_changed_objects_generated(self):
+        self._sync([_service("web", 1), _service("db", 1)])
+        self.watch.update()
+        self.assertEqual(sorted(self.generated), ["db", "web"])
+        artifacts = dict(self.watch.manifest["artifacts"])
+
+        self.generated = []
+        self.watch._apply(("service", "MODIFIED", _service("web", 2, 8080)))
+        self.watch._apply(("service", "DELETED", _service("db", 3)))
+        self.watch.update()
+        self.assertEqual(self.generated, ["web"])
+        self.assertEqual(
+            self._artifact("web-Service.json")["spec"]["ports"][0]["port"],
+            8080)
+        self.assertEqual(len(self.watch.manifest["artifacts"]),
+                         len(artifacts) - 2)
+
+        # list that didn't change anything doesn't generate artifacts
+        self.generated = []
+        self._sync([_service("web", 2, 8080)])
+        self.assertFalse(self.watch._changed)
+        self.assertEqual(self.generated, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
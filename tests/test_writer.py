@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from openshift2nulecule.writer import BaseWriter, NuleculeWriter
+
+
+def _artifact(name, kind="Service"):
+    return {"kind": kind, "apiVersion": "v1", "metadata": {"name": name}}
+
+
+class UniqueNameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.writer = BaseWriter("app")
+
+    def test_collisions(self):
+        names = [self.writer._unique_name("artifacts/foo.json")
+                 for _ in range(3)]
+        self.assertEqual(names, ["artifacts/foo.json", "artifacts/foo_1.json",
+                                 "artifacts/foo_2.json"])
+
+    def test_generated_name_taken(self):
+        self.writer._unique_name("artifacts/foo_1.json")
+        self.writer._unique_name("artifacts/foo.json")
+        self.assertEqual(self.writer._unique_name("artifacts/foo.json"),
+                         "artifacts/foo_2.json")
+        self.assertEqual(self.writer._unique_name("artifacts/foo_1.json"),
+                         "artifacts/foo_1_1.json")
+
+    def test_different_case(self):
+        self.assertEqual(self.writer._unique_name("artifacts/Web.json"),
+                         "artifacts/Web.json")
+        self.assertEqual(self.writer._unique_name("artifacts/web.json"),
+                         "artifacts/web_1.json")
+        self.assertEqual(self.writer._unique_name("artifacts/WEB.json"),
+                         "artifacts/WEB_2.json")
+
+    def test_artifacts_of_providers(self):
+        paths = [self.writer._add_artifact(provider, _artifact("web"))
+                 for provider in ["openshift", "kubernetes", "openshift"]]
+        self.assertEqual(paths, ["artifacts/openshift/web-Service.json",
+                                 "artifacts/kubernetes/web-Service.json",
+                                 "artifacts/openshift/web-Service_1.json"])
+        self.assertEqual(self.writer._add_artifact("openshift", {
+            "kind": "Service", "metadata": {}}),
+            "artifacts/openshift/unknown-Service.json")
+
+
+class NuleculeWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_parallel_writes(self):
+        path = os.path.join(self.tmpdir, "app")
+        writer = NuleculeWriter(path, "app", jobs=4)
+        for index in range(20):
+            writer.write_artifact("openshift", _artifact("web{}".format(
+                index % 10)))
+        writer.close()
+        files = os.listdir(os.path.join(path, "artifacts", "openshift"))
+        self.assertEqual(len(files), 20)
+        self.assertEqual(len(writer.hashes), 20)
+
+
+if __name__ == "__main__":
+    unittest.main()